@@ -0,0 +1,10 @@
+"""
+Package: benchmarks
+Microbenchmarks of the model, serialization and route hot paths, and a
+load test of a running service
+
+Run them with:
+    python -m benchmarks run --output before.json
+    python -m benchmarks compare before.json after.json
+    python -m benchmarks load --url http://127.0.0.1:5000
+"""
@@ -0,0 +1,132 @@
+"""
+Runs the benchmarks or compares two runs
+
+    python -m benchmarks run [--database URI] [--sizes 1,10,100,1000] [--output FILE]
+    python -m benchmarks compare BASE.json HEAD.json
+    python -m benchmarks load [--url URL | --serve] [--concurrency 10] [--duration 30]
+
+The run drops and recreates the tables of the database, so anything but
+the default SQLite file needs --drop-tables.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from . import harness, load
+
+DEFAULT_DATABASE = "sqlite:///" + os.path.join(tempfile.gettempdir(), "shopcarts-bench.db")
+
+
+def main(argv=None):
+    """ Parses the command line and runs the requested command """
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--database", default=DEFAULT_DATABASE,
+                            help="database URI (default: %(default)s)")
+    run_parser.add_argument("--sizes", default="1,10,100,1000",
+                            help="products per cart (default: %(default)s)")
+    run_parser.add_argument("--suite", choices=["models", "routes", "all"], default="all")
+    run_parser.add_argument("--min-time", type=float, default=0.2,
+                            help="seconds per repeat (default: %(default)s)")
+    run_parser.add_argument("--repeats", type=int, default=5)
+    run_parser.add_argument("--output", help="write the results to this JSON file")
+    run_parser.add_argument("--drop-tables", action="store_true",
+                            help="allow dropping the tables of a database other than the default")
+    compare_parser = commands.add_parser("compare", help="compare two JSON results")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("head")
+    load_parser = commands.add_parser("load", help="load test a service on this host")
+    load_parser.add_argument("--url", default="http://127.0.0.1:5000",
+                             help="service to load (default: %(default)s)")
+    load_parser.add_argument("--serve", action="store_true",
+                             help="start the service with gunicorn.conf.py on a free port")
+    load_parser.add_argument("--concurrency", type=int, default=10,
+                             help="virtual users (default: %(default)s)")
+    load_parser.add_argument("--duration", type=float, default=30.0,
+                             help="seconds measured (default: %(default)s)")
+    load_parser.add_argument("--warmup", type=float, default=5.0,
+                             help="seconds run before measuring (default: %(default)s)")
+    load_parser.add_argument("--products", type=int, default=3,
+                             help="products added per cart (default: %(default)s)")
+    load_parser.add_argument("--reads", type=int, default=3,
+                             help="reads of each cart (default: %(default)s)")
+    load_parser.add_argument("--seed", type=int)
+    load_parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    if args.command == "load":
+        if not args.serve:
+            try:
+                load.local_address(args.url)
+            except ValueError as error:
+                parser.error(str(error))
+        return load_main(args)
+
+    if args.command == "compare":
+        rows = harness.compare(harness.load(args.base), harness.load(args.head))
+        for name, size, database, before, after, ratio in rows:
+            print("%-40s %6s %-10s %10s %10s %6.2fx" % (
+                name, "" if size is None else size, database, harness.format_seconds(before),
+                harness.format_seconds(after), ratio))
+        return 0
+
+    if args.database != DEFAULT_DATABASE and not args.drop_tables:
+        parser.error("the benchmarks drop every table of %s, pass --drop-tables" % args.database)
+    # the app reads its database from the environment when it is imported
+    os.environ["DATABASE_URI"] = args.database
+    from service import app  # pylint: disable=import-outside-toplevel
+    from service.models import db  # pylint: disable=import-outside-toplevel
+    from . import bench_models, bench_routes  # pylint: disable=import-outside-toplevel
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        database = db.engine.dialect.name
+    sizes = [int(size) for size in args.sizes.split(",")]
+    options = {"min_time": args.min_time, "repeats": args.repeats}
+    results = []
+    if args.suite in ("models", "all"):
+        results += bench_models.run(sizes, database, **options)
+    if args.suite in ("routes", "all"):
+        results += bench_routes.run(sizes, database, **options)
+    for result in results:
+        print("%-40s %6s %-10s %10s/call (%s calls x %s)" % (
+            result.name, "" if result.size is None else result.size, result.database,
+            harness.format_seconds(result.seconds), result.calls, result.repeats))
+    if args.output:
+        harness.write(args.output, results, database)
+    return 0
+
+
+def load_main(args):
+    """ Runs the load test and prints its results """
+    url, server = args.url, None
+    if args.serve:
+        port = load.free_port()
+        server = load.serve(port)
+        url = "http://127.0.0.1:%d" % port
+    try:
+        rows, elapsed = load.run(url, args.concurrency, args.duration, args.warmup,
+                                 args.products, args.reads, args.seed)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    print("%d users for %.1fs against %s" % (args.concurrency, elapsed, url))
+    for line in load.format_stats(rows, harness.format_seconds):
+        print(line)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"environment": dict(harness.environment(None), url=url,
+                                           concurrency=args.concurrency,
+                                           web_concurrency=os.getenv("WEB_CONCURRENCY"),
+                                           gunicorn_threads=os.getenv("GUNICORN_THREADS")),
+                       "results": [row._asdict() for row in rows]}, output, indent=2)
+    return 1 if rows[-1].errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
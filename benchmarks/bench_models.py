@@ -0,0 +1,71 @@
+"""
+Model and Serialization Benchmarks
+
+Times Product and Shopcart serialize/deserialize, the flask-restx
+marshalling of shopcart_model with json.dumps and the one pass encoder that
+replaces both, for carts loaded from the database, and the loading itself
+with the ORM and with the read-only records.
+"""
+import json
+from flask_restx import marshal
+from service import app
+from service.models import Product, Shopcart, db
+from service.routes import shopcart_encoder, shopcart_model
+from tests.factories import ProductFactory
+from .harness import benchmark
+
+
+def create_cart(size):
+    """ Saves a Shopcart with size products and returns its customer_id """
+    shopcart = Shopcart()
+    shopcart.create()
+    products = [ProductFactory(customer_id=shopcart.customer_id) for _ in range(size)]
+    if products:
+        db.session.execute(Product.__table__.insert(), [
+            {column: getattr(product, column)
+             for column in ("customer_id", "product_id") + Product.UPDATABLE_COLUMNS}
+            for product in products
+        ])
+        db.session.commit()
+    return shopcart.customer_id
+
+
+def run(sizes, database, **options):
+    """ Returns the Results of the model benchmarks for carts of each size """
+    results = []
+    with app.app_context():
+        product = ProductFactory()
+        payload = product.serialize()
+        results.append(benchmark("Product.serialize", product.serialize,
+                                 database=database, **options))
+        results.append(benchmark("Product.deserialize",
+                                 lambda: Product().deserialize(payload),
+                                 database=database, **options))
+        for size in sizes:
+            customer_id = create_cart(size)
+            # a new session per call, as in a request
+            results.append(benchmark("Shopcart.find",
+                                     lambda: (Shopcart.find(customer_id).product_list,
+                                              db.session.remove()),
+                                     size, database, **options))
+            results.append(benchmark("Shopcart.read",
+                                     lambda: (Shopcart.read(customer_id), db.session.remove()),
+                                     size, database, **options))
+            shopcart = Shopcart.find(customer_id)
+            data = shopcart.serialize()  # loads product_list once
+            results.append(benchmark("Shopcart.serialize", shopcart.serialize,
+                                     size, database, **options))
+            results.append(benchmark("Shopcart.deserialize",
+                                     lambda: Shopcart().deserialize(data),
+                                     size, database, **options))
+            results.append(benchmark("marshal(shopcart_model)",
+                                     lambda: marshal(shopcart.serialize(), shopcart_model),
+                                     size, database, **options))
+            results.append(benchmark("json.dumps(marshal(shopcart_model))",
+                                     lambda: json.dumps(marshal(shopcart, shopcart_model)),
+                                     size, database, **options))
+            results.append(benchmark("shopcart_encoder.dumps",
+                                     lambda: shopcart_encoder.dumps(shopcart),
+                                     size, database, **options))
+        db.session.remove()
+    return results
@@ -0,0 +1,79 @@
+"""
+Route Benchmarks
+
+Times each route of the service through the Flask test client, for carts
+of each size, against the database the app is configured with.
+"""
+import logging
+from service import app
+from service.models import Shopcart
+from tests.factories import ProductFactory
+from .bench_models import create_cart
+from .harness import benchmark
+
+# Products changed per call by the batch benchmark
+BATCH_SIZE = 10
+
+
+def run(sizes, database, **options):
+    """ Returns the Results of the route benchmarks for carts of each size """
+    app.logger.setLevel(logging.CRITICAL)
+    logging.getLogger("flask.app").setLevel(logging.CRITICAL)
+    client = app.test_client()
+    results = []
+
+    def timed(name, method, url, size=None, setup=None, **kwargs):
+        # setup returns the url or the request arguments of a call that uses
+        # up its cart or product, it is not timed
+        def call(fresh=None):
+            request = dict(kwargs, **(fresh or {}))
+            path = request.pop("url", url)
+            response = client.open(path, method=method, **request)
+            if response.status_code >= 400:
+                raise RuntimeError("%s %s answered %s" % (method, path, response.status_code))
+        results.append(benchmark(name, call, size, database, setup=setup, **options))
+
+    def fresh_cart(size):
+        with app.app_context():
+            return {"url": "/shopcarts/%s" % create_cart(size)}
+
+    def fresh_product(customer_id):
+        with app.app_context():
+            product = ProductFactory(customer_id=customer_id)
+            product.create()
+            return {"url": "/shopcarts/%s/products/%s" % (customer_id, product.product_id)}
+
+    for size in sizes:
+        with app.app_context():
+            customer_id = create_cart(size)
+            product_ids = [product.product_id for product in Shopcart.find(customer_id).product_list]
+        cart = "/shopcarts/%s" % customer_id
+        timed("GET /shopcarts/{id}", "GET", cart, size)
+        timed("GET /shopcarts/{id}/products", "GET", cart + "/products", size)
+        timed("GET /shopcarts/wishlist?customer-id", "GET",
+              "/shopcarts/wishlist?customer-id=%s" % customer_id, size)
+        timed("POST /shopcarts", "POST", "/shopcarts", size,
+              json={"product_list": [ProductFactory().serialize() for _ in range(size)]})
+        timed("DELETE /shopcarts/{id}", "DELETE", None, size, lambda: fresh_cart(size))
+        timed("DELETE /shopcarts/{id}/products/{id}", "DELETE", None, size,
+              lambda: fresh_product(customer_id))
+        # every call adds a product, so this runs after the reads of the whole cart
+        timed("POST /shopcarts/{id}/products", "POST", cart + "/products", size,
+              lambda: {"json": ProductFactory().serialize()})
+        if not product_ids:
+            continue
+        product = "%s/products/%s" % (cart, product_ids[0])
+        timed("GET /shopcarts/{id}/products/{id}", "GET", product, size)
+        timed("PUT /shopcarts/{id}/products/{id}", "PUT", product, size,
+              json=ProductFactory(product_id=product_ids[0]).serialize())
+        timed("PUT .../reversewishlist", "PUT", product + "/reversewishlist", size)
+        timed("POST /shopcarts/{id}/products:batch", "POST", cart + "/products:batch", size,
+              json={"operations": [{"op": "update", "product_id": product_id, "quantity": 2}
+                                   for product_id in product_ids[:BATCH_SIZE]]})
+        timed("PUT /shopcarts/{id}/wishlist", "PUT", cart + "/wishlist", size,
+              json={"product_ids": product_ids[:BATCH_SIZE], "wishlist": True})
+
+    timed("GET /shopcarts?limit=100", "GET", "/shopcarts?limit=100")
+    timed("GET /shopcarts/wishlist?limit=100", "GET", "/shopcarts/wishlist?limit=100")
+    timed("GET /shopcarts/export", "GET", "/shopcarts/export")
+    return results
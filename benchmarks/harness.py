@@ -0,0 +1,113 @@
+"""
+Benchmark Harness
+
+Times a callable until each repeat lasts at least min_time seconds and
+reports the per call statistics of the repeats. A setup callable runs
+before each call, outside the timing, and its result is passed to the call,
+for calls that use up what they act on. Results are written as JSON
+together with the commit, Python version and database they were taken on,
+so two runs can be compared with compare().
+"""
+import json
+import platform
+import statistics
+import subprocess
+import time
+from collections import namedtuple
+
+Result = namedtuple("Result", "name size database seconds min max stdev calls repeats")
+
+
+def measure(function, min_time=0.2, repeats=5, setup=None):
+    """ Returns the per call seconds of each repeat of function """
+    number = 1
+    while True:
+        elapsed = _time(function, number, setup)
+        if elapsed >= min_time / 10 or number >= 1 << 20:
+            break
+        number *= 10
+    # calls per repeat so that a repeat lasts about min_time
+    if elapsed > 0:
+        number = max(1, round(number * min_time / elapsed))
+    timings = [_time(function, number, setup) / number for _ in range(repeats)]
+    return timings, number
+
+
+def _time(function, number, setup=None):
+    if setup is None:
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        return time.perf_counter() - started
+    elapsed = 0.0
+    for _ in range(number):
+        argument = setup()
+        started = time.perf_counter()
+        function(argument)
+        elapsed += time.perf_counter() - started
+    return elapsed
+
+
+def benchmark(name, function, size=None, database=None, min_time=0.2, repeats=5, setup=None):
+    """ Times function and returns a Result with the median seconds per call """
+    timings, number = measure(function, min_time, repeats, setup)
+    return Result(
+        name=name, size=size, database=database,
+        seconds=statistics.median(timings), min=min(timings), max=max(timings),
+        stdev=statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        calls=number, repeats=repeats,
+    )
+
+
+def environment(database):
+    """ Returns what a run was measured on """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], check=True,
+                                capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": database,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def write(path, results, database):
+    """ Writes results and their environment to a JSON file """
+    with open(path, "w") as output:
+        json.dump({"environment": environment(database),
+                   "results": [result._asdict() for result in results]}, output, indent=2)
+
+
+def load(path):
+    """ Reads a JSON file written by write() """
+    with open(path) as source:
+        return json.load(source)
+
+
+def compare(base, head):
+    """ Returns (name, size, database, base seconds, head seconds, ratio) rows
+    for the benchmarks found in both runs, a ratio above 1 means head is slower
+    """
+    def key(result):
+        return (result["name"], result["size"], result["database"])
+
+    before = {key(result): result["seconds"] for result in base["results"]}
+    rows = []
+    for result in head["results"]:
+        if key(result) in before:
+            old = before[key(result)]
+            rows.append(key(result) + (old, result["seconds"],
+                                       result["seconds"] / old if old else float("inf")))
+    return rows
+
+
+def format_seconds(seconds):
+    """ Formats a duration with a unit that keeps it readable """
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return "%.2f%s" % (seconds / scale, unit)
+    return "%.0fns" % (seconds / 1e-9)
@@ -0,0 +1,273 @@
+"""
+Load Test
+
+Drives a running Shopcarts service over HTTP with a mix of calls like the
+one real clients make: every virtual user creates a cart, adds products,
+changes a quantity, toggles a wishlist flag, reads the cart and its
+wishlist a few times and deletes the cart, over and over. The users run in
+threads, each with its own keep-alive connection, and the latency of every
+call is recorded under its route so that throughput and the p50, p95, p99
+and p99.9 latencies are reported per route.
+
+Only services on this host are load tested (the run creates and deletes
+carts), which keeps the numbers free of network noise. With --serve the
+service is started with gunicorn.conf.py, so worker settings are compared
+by changing WEB_CONCURRENCY and GUNICORN_THREADS between runs.
+
+This module uses the standard library only and does not import the
+service, so it measures the service from the outside.
+"""
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+PERCENTILES = (50, 95, 99, 99.9)
+
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+# Seconds to wait for a started service to answer /healthcheck
+SERVE_TIMEOUT = 30
+
+CREATE = "POST /shopcarts"
+ADD_PRODUCT = "POST /shopcarts/{id}/products"
+UPDATE_QUANTITY = "PUT /shopcarts/{id}/products/{id}"
+TOGGLE_WISHLIST = "PUT /shopcarts/{id}/products/{id}/reversewishlist"
+GET_CART = "GET /shopcarts/{id}"
+LIST_WISHLIST = "GET /shopcarts/wishlist?customer-id"
+DELETE = "DELETE /shopcarts/{id}"
+
+# Routes in the order a session calls them
+ROUTES = (CREATE, ADD_PRODUCT, UPDATE_QUANTITY, TOGGLE_WISHLIST, GET_CART, LIST_WISHLIST, DELETE)
+
+RouteStats = namedtuple("RouteStats", "route requests errors throughput mean p50 p95 p99 p999 max")
+
+
+class Recorder:
+    """ Collects the latencies and errors of every route """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {route: [] for route in ROUTES}
+        self.errors = {route: 0 for route in ROUTES}
+        self.recording = True
+
+    def add(self, route, seconds, ok):
+        """ Records one call, calls made while not recording are dropped """
+        if not self.recording:
+            return
+        with self._lock:
+            if ok:
+                self.latencies[route].append(seconds)
+            else:
+                self.errors[route] += 1
+
+    def reset(self):
+        """ Forgets what was recorded so far, e.g. at the end of the warm-up """
+        with self._lock:
+            for route in ROUTES:
+                self.latencies[route] = []
+                self.errors[route] = 0
+
+    def stats(self, elapsed):
+        """ Returns a RouteStats for every route that was called, and the total """
+        with self._lock:
+            rows = [summarize(route, self.latencies[route], self.errors[route], elapsed)
+                    for route in ROUTES if self.latencies[route] or self.errors[route]]
+            everything = [seconds for route in ROUTES for seconds in self.latencies[route]]
+            rows.append(summarize("total", everything, sum(self.errors.values()), elapsed))
+        return rows
+
+
+def percentile(ordered, percent):
+    """ Returns the nearest rank percentile of a sorted list """
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[min(len(ordered), int(rank)) - 1]
+
+
+def summarize(route, latencies, errors, elapsed):
+    """ Returns the RouteStats of the latencies of a route """
+    ordered = sorted(latencies)
+    p50, p95, p99, p999 = (percentile(ordered, percent) for percent in PERCENTILES)
+    return RouteStats(
+        route=route, requests=len(ordered), errors=errors,
+        throughput=len(ordered) / elapsed if elapsed else 0.0,
+        mean=sum(ordered) / len(ordered) if ordered else 0.0,
+        p50=p50, p95=p95, p99=p99, p999=p999, max=ordered[-1] if ordered else 0.0,
+    )
+
+
+class Client:
+    """ A keep-alive connection to the service that times its calls """
+
+    def __init__(self, host, port, recorder, timeout=10):
+        self.host = host
+        self.port = port
+        self.recorder = recorder
+        self.timeout = timeout
+        self._connection = None
+
+    def call(self, route, method, path, body=None, expect=(200,)):
+        """ Makes a call and returns its decoded JSON, or None if it failed """
+        headers = {"Accept": "application/json"}
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        started = time.perf_counter()
+        try:
+            if self._connection is None:
+                self._connection = http.client.HTTPConnection(self.host, self.port,
+                                                              timeout=self.timeout)
+            self._connection.request(method, path, body, headers)
+            response = self._connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            self.recorder.add(route, time.perf_counter() - started, False)
+            return None
+        elapsed = time.perf_counter() - started
+        ok = response.status in expect
+        self.recorder.add(route, elapsed, ok)
+        if not ok or not data:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def close(self):
+        """ Closes the connection, the next call opens a new one """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def product(product_id, rng):
+    """ Returns the JSON body of a product """
+    return {
+        "customer_id": 0,
+        "product_id": product_id,
+        "product_name": rng.choice(("apple", "banana", "peach")),
+        "quantity": rng.randint(1, 5),
+        "price": round(rng.uniform(0.5, 50), 2),
+        "instock": "true",
+        "wishlist": rng.choice(("true", "false")),
+    }
+
+
+def session(client, rng, products=3, reads=3):
+    """ Runs the calls of one shopping session against the service """
+    cart = client.call(CREATE, "POST", "/shopcarts", {"product_list": []}, expect=(201,))
+    if not cart:
+        return
+    base = "/shopcarts/%s" % cart["customer_id"]
+    product_ids = rng.sample(range(1, 100000), products)
+    for product_id in product_ids:
+        client.call(ADD_PRODUCT, "POST", base + "/products", product(product_id, rng),
+                    expect=(201,))
+    if product_ids:
+        product_id = rng.choice(product_ids)
+        path = "%s/products/%s" % (base, product_id)
+        client.call(UPDATE_QUANTITY, "PUT", path, product(product_id, rng))
+        client.call(TOGGLE_WISHLIST, "PUT", path + "/reversewishlist")
+    for _ in range(reads):
+        client.call(GET_CART, "GET", base)
+    client.call(LIST_WISHLIST, "GET", "/shopcarts/wishlist?customer-id=%s" % cart["customer_id"])
+    client.call(DELETE, "DELETE", base, expect=(204,))
+
+
+def local_address(url):
+    """ Returns the (host, port) of url, raises ValueError if it is not on this host """
+    parts = urlsplit(url)
+    if parts.hostname not in LOCAL_HOSTS:
+        raise ValueError("only a service on this host can be load tested, not %s"
+                         % parts.hostname)
+    return parts.hostname, parts.port or 80
+
+
+def run(url, concurrency=10, duration=30.0, warmup=5.0, products=3, reads=3, seed=None):
+    """ Runs sessions from concurrency threads and returns (RouteStats list, seconds)
+
+    Calls made during the first warmup seconds are not counted.
+    """
+    host, port = local_address(url)
+    recorder = Recorder()
+    stop = threading.Event()
+
+    def user(number):
+        rng = random.Random(None if seed is None else seed + number)
+        client = Client(host, port, recorder)
+        try:
+            while not stop.is_set():
+                session(client, rng, products, reads)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=user, args=(number,), daemon=True,
+                                name="load-user-%d" % number)
+               for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    if warmup > 0:
+        time.sleep(warmup)
+        recorder.reset()
+    started = time.perf_counter()
+    time.sleep(duration)
+    recorder.recording = False
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return recorder.stats(elapsed), elapsed
+
+
+def free_port():
+    """ Returns a TCP port on localhost that nothing listens on """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def serve(port, environ=None):
+    """ Starts the service with gunicorn.conf.py on port and waits until it answers """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config=gunicorn.conf.py",
+         "--bind=127.0.0.1:%d" % port, "service:app"],
+        cwd=root, env=dict(os.environ, **(environ or {})))
+    deadline = time.monotonic() + SERVE_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited with %s" % process.returncode)
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/healthcheck")
+            if connection.getresponse().status == 200:
+                connection.close()
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    process.wait()
+    raise RuntimeError("gunicorn did not answer on port %d within %ss" % (port, SERVE_TIMEOUT))
+
+
+def format_stats(rows, format_seconds):
+    """ Returns the RouteStats as the lines of a table """
+    lines = ["%-50s %8s %6s %9s %9s %9s %9s %9s %9s" % (
+        "route", "requests", "errors", "req/s", "p50", "p95", "p99", "p99.9", "max")]
+    for row in rows:
+        lines.append("%-50s %8d %6d %9.1f %9s %9s %9s %9s %9s" % (
+            row.route, row.requests, row.errors, row.throughput,
+            format_seconds(row.p50), format_seconds(row.p95), format_seconds(row.p99),
+            format_seconds(row.p999), format_seconds(row.max)))
+    return lines
@@ -18,6 +18,73 @@ if 'VCAP_SERVICES' in os.environ:
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool of the engine. pool_pre_ping tests each connection on
+# checkout so connections broken by a database failover are replaced, and
+# pool_recycle (seconds) retires connections before the server drops them.
+# Size the pool so that workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) stays
+# below the max_connections of the database. SQLite does not pool.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+SQLALCHEMY_ENGINE_OPTIONS = {} if DATABASE_URI.startswith("sqlite") else {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+
+# Warm up each gunicorn worker before it serves requests: build the Swagger
+# schema, open WARMUP_CONNECTIONS pooled connections and run the hot queries
+# once. With preload_app the master also freezes its objects (gc.freeze) so
+# the forked workers share those memory pages.
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "false").lower() == "true"
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", str(DB_POOL_SIZE)))
+
+# Report the SQL statements and time of each request in a Server-Timing
+# header, and log every statement that takes at least SLOW_QUERY_SECONDS
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "0.5"))
+
+# Profile single requests that send X-Profile: <PROFILE_TOKEN>, the stats
+# are written to PROFILE_DIR. Profiling stays off without a token.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/shopcarts-profiles")
+
+# Sample the stacks of all threads SAMPLER_HZ times a second and serve the
+# last SAMPLER_WINDOW seconds as collapsed stacks at /debug/flamegraph
+SAMPLER_ENABLED = os.getenv("SAMPLER_ENABLED", "false").lower() == "true"
+SAMPLER_HZ = int(os.getenv("SAMPLER_HZ", "100"))
+SAMPLER_WINDOW = int(os.getenv("SAMPLER_WINDOW", "300"))
+
+# Serve the tracemalloc snapshots and session sizes under /debug/memory
+MEMORY_DEBUG_ENABLED = os.getenv("MEMORY_DEBUG_ENABLED", "false").lower() == "true"
+
+# Encode Shopcart and Product responses in one pass instead of serialize(),
+# marshal() and json.dumps(), optionally with orjson (compact output)
+FAST_JSON_ENABLED = os.getenv("FAST_JSON_ENABLED", "false").lower() == "true"
+JSON_BACKEND = os.getenv("JSON_BACKEND", "json")
+
+# Keyset pagination for collection endpoints
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Rows fetched per round trip by the server-side cursor of /shopcarts/export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Largest number of operations accepted by POST /shopcarts/{id}/products:batch
+MAX_BATCH_OPERATIONS = int(os.getenv("MAX_BATCH_OPERATIONS", "1000"))
+
+# Read-through cache of encoded GET /shopcarts/{id} responses. The cache is
+# per worker process, so other workers may serve a cart for up to the TTL
+# (seconds) after it changed.
+SHOPCART_CACHE_ENABLED = os.getenv("SHOPCART_CACHE_ENABLED", "false").lower() == "true"
+SHOPCART_CACHE_SIZE = int(os.getenv("SHOPCART_CACHE_SIZE", "10000"))
+SHOPCART_CACHE_TTL = float(os.getenv("SHOPCART_CACHE_TTL", "30"))
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
 LOGGING_LEVEL = logging.INFO
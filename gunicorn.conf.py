@@ -0,0 +1,71 @@
+"""
+Gunicorn configuration for the Shopcarts service
+
+Runs WEB_CONCURRENCY worker processes with GUNICORN_THREADS threads each
+(gthread worker class), so throughput scales with the cores of the host.
+Each worker has its own connection pool and every thread uses its own
+database session, so keep GUNICORN_THREADS <= DB_POOL_SIZE + DB_MAX_OVERFLOW
+and WEB_CONCURRENCY x (DB_POOL_SIZE + DB_MAX_OVERFLOW) below the
+max_connections of the database.
+
+The app is imported once in the master (preload_app) and then forked. The
+master keeps no database connection open, and a worker discards any
+connection it inherited instead of sharing it with the master.
+
+With WARMUP_ENABLED=true the master prepares and freezes the app before
+forking, and every worker opens its connections and runs the hot queries
+before it accepts requests (see service/warmup.py).
+
+Metrics of all workers are shared through PROMETHEUS_MULTIPROC_DIR, which
+is created and emptied when gunicorn loads this file.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = "0.0.0.0:" + os.getenv("PORT", "5000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_class = "gthread" if threads > 1 else "sync"
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+# restart workers now and then to bound the growth of long lived processes
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+errorlog = "-"
+# every worker writes its metrics here and /metrics adds them up, this has to
+# be set before the app (and so prometheus_client) is imported
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "shopcarts-metrics"))
+# the metrics of an earlier run are cleared here and not in on_starting, since
+# with preload_app the app opens its metric files before on_starting runs
+shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir, exist_ok=True)
+accesslog = os.getenv("GUNICORN_ACCESSLOG", None)
+
+
+def child_exit(server, worker):
+    """ Drops the live gauges of a worker that exited """
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def when_ready(server):
+    """ Prepares the preloaded app and freezes it before the workers fork """
+    if not preload_app:
+        return
+    from service import app
+    from service.warmup import freeze, prepare
+    if app.config["WARMUP_ENABLED"]:
+        prepare(app)
+        freeze()
+
+
+def post_worker_init(worker):
+    """ Warms up a worker before it accepts requests """
+    from service import app
+    from service.warmup import warm_up
+    if app.config["WARMUP_ENABLED"]:
+        warm_up(app)
@@ -18,31 +18,53 @@ app = Flask(__name__)
 app.config.from_object("config")
 
 # Import the routes After the Flask app is created
-from service import routes, models
-
-# Set up logging for production
-if __name__ != "__main__":
-    gunicorn_logger = logging.getLogger("gunicorn.error")
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
-    app.logger.propagate = False
-    # Make all log formats consistent
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z"
-    )
-    for handler in app.logger.handlers:
-        handler.setFormatter(formatter)
-    app.logger.info("Logging handler established")
-
-app.logger.info(70 * "*")
-app.logger.info("  M Y   S E R V I C E   R U N N I N G  ".center(70, "*"))
-app.logger.info(70 * "*")
-
-try:
-    routes.init_db()  # make our sqlalchemy tables
-except Exception as error:
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
-
-app.logger.info("Service inititalized!")
+from service import routes, models, commands, profiling
+from service.sampler import stack_sampler
+from service.encoding import check_backend
+
+
+def create_app():
+    """ Sets up logging and the database of the app and returns it
+
+    The routes are registered on the module level app when this package is
+    imported, so this configures that one app. It leaves no application
+    context pushed and no database connection open, which makes the app
+    safe to import in a gunicorn master before it forks its workers.
+    """
+    # Set up logging for production
+    if __name__ != "__main__":
+        gunicorn_logger = logging.getLogger("gunicorn.error")
+        app.logger.handlers = gunicorn_logger.handlers
+        app.logger.setLevel(gunicorn_logger.level)
+        app.logger.propagate = False
+        # Make all log formats consistent
+        formatter = logging.Formatter(
+            "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z"
+        )
+        for handler in app.logger.handlers:
+            handler.setFormatter(formatter)
+        app.logger.info("Logging handler established")
+
+    app.logger.info(70 * "*")
+    app.logger.info("  M Y   S E R V I C E   R U N N I N G  ".center(70, "*"))
+    app.logger.info(70 * "*")
+
+    try:
+        routes.init_db()  # make our sqlalchemy tables
+    except Exception as error:
+        app.logger.critical("%s: Cannot continue", error)
+        # gunicorn requires exit code 4 to stop spawning workers when they die
+        sys.exit(4)
+
+    if app.config["SAMPLER_ENABLED"]:
+        stack_sampler.start(hz=app.config["SAMPLER_HZ"], window=app.config["SAMPLER_WINDOW"])
+        app.logger.info("Sampling stacks at %s Hz", app.config["SAMPLER_HZ"])
+
+    if app.config["FAST_JSON_ENABLED"]:
+        check_backend(app)
+
+    app.logger.info("Service inititalized!")
+    return app
+
+
+create_app()
@@ -0,0 +1,109 @@
+"""
+Response Cache
+
+A small in-process LRU cache with a time to live, used to keep the encoded
+JSON of recently read Shopcarts. Writes invalidate the entry of the
+Shopcart they change. The cache is per process: with several gunicorn
+workers the other workers only see a change once their entry expires, so
+the TTL bounds how stale a read can be.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """ A thread safe LRU cache whose entries expire after ttl seconds """
+
+    def __init__(self, maxsize=1024, ttl=30.0, enabled=False):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = enabled
+        # bumped by every invalidation so a read that raced a write is not stored
+        self.generation = 0
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def configure(self, enabled=None, maxsize=None, ttl=None):
+        """ Changes the cache settings, drops every entry and resets the counters """
+        with self._lock:
+            if enabled is not None:
+                self.enabled = enabled
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            self._entries.clear()
+            self.generation += 1
+            self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def get(self, key):
+        """ Returns the cached value for key, or None """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, generation=None):
+        """ Stores value for key
+
+        Args:
+            generation (int): the generation read before the value was built,
+                nothing is stored if an invalidation happened since then
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """ Removes the entry for key """
+        with self._lock:
+            self.generation += 1
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        """ Removes every entry """
+        with self._lock:
+            self.generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        """ Returns the cache counters as a dictionary """
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+# Encoded GET /shopcarts/{customer_id} responses keyed by customer_id
+shopcart_cache = ResponseCache()
@@ -0,0 +1,79 @@
+"""
+Flask CLI commands
+
+Run them with the flask command, e.g.:
+    flask import-carts carts.ndjson.gz
+    flask generate-carts 1000000 --seed 7
+"""
+import click
+from sqlalchemy import func
+from service import app
+from service.generator import SIZE_DISTRIBUTIONS, GeneratorOptions, generate_carts
+from service.importer import import_carts, rows_per_second
+from service.models import Shopcart, db
+
+
+######################################################################
+# BULK IMPORT
+######################################################################
+@app.cli.command("import-carts")
+@click.argument("source", type=click.File("rb"))
+@click.option("--format", "fmt", type=click.Choice(["ndjson", "csv"]), default=None,
+              help="Input format, guessed from the file name when omitted")
+@click.option("--gzip/--no-gzip", "compressed", default=None,
+              help="Input is gzip compressed, guessed from the file name when omitted")
+def import_carts_command(source, fmt, compressed):
+    """ Bulk import Shopcarts from an NDJSON or CSV file ('-' for stdin) """
+    name = getattr(source, "name", "-")
+    stem = name[:-len(".gz")] if name.endswith(".gz") else name
+    if compressed is None:
+        compressed = name.endswith(".gz")
+    if fmt is None:
+        fmt = "csv" if stem.endswith(".csv") else "ndjson"
+    report = import_carts(source, fmt=fmt, compressed=compressed)
+    click.echo(
+        f"Imported {report.carts} new carts and {report.products} products "
+        f"from {report.rows} rows ({report.rejected} rejected) "
+        f"in {report.seconds:.2f}s, {rows_per_second(report):.0f} rows/s"
+    )
+
+
+######################################################################
+# SYNTHETIC DATA
+######################################################################
+@app.cli.command("generate-carts")
+@click.argument("carts", type=click.IntRange(min=1))
+@click.option("--mean-size", type=click.IntRange(min=0), default=10, show_default=True,
+              help="Mean number of products per cart")
+@click.option("--max-size", type=click.IntRange(min=0), default=100, show_default=True,
+              help="Most products in a cart")
+@click.option("--distribution", type=click.Choice(SIZE_DISTRIBUTIONS), default="geometric",
+              show_default=True, help="Distribution of the cart sizes")
+@click.option("--catalog", type=click.IntRange(min=1), default=100000, show_default=True,
+              help="Number of distinct product ids")
+@click.option("--skew", type=click.FloatRange(min=0), default=1.0, show_default=True,
+              help="Zipf exponent of the product popularity, 0 for uniform")
+@click.option("--wishlist", type=click.FloatRange(0, 1), default=0.2, show_default=True,
+              help="Share of products that are wishlisted")
+@click.option("--seed", type=int, default=0, show_default=True,
+              help="Seed of the generator, the same seed generates the same rows")
+@click.option("--start-id", type=click.IntRange(min=1), default=None,
+              help="First customer_id, after the highest existing one when omitted")
+def generate_carts_command(carts, mean_size, max_size, distribution, catalog, skew,
+                           wishlist, seed, start_id):
+    """ Generate and bulk insert synthetic Shopcarts """
+    if max_size > catalog:
+        raise click.BadParameter("cannot be larger than --catalog", param_hint="--max-size")
+    if start_id is None:
+        start_id = (db.session.query(func.max(Shopcart.customer_id)).scalar() or 0) + 1
+        db.session.remove()
+    options = GeneratorOptions(carts=carts, mean_size=mean_size, max_size=max_size,
+                               distribution=distribution, catalog=catalog, skew=skew,
+                               wishlist=wishlist, seed=seed)
+    report = generate_carts(options, start_id)
+    click.echo(
+        f"Generated {report.carts} new carts and {report.products} products "
+        f"from customer_id {start_id} in {report.seconds:.2f}s, "
+        f"{rows_per_second(report):.0f} rows/s"
+    )
+
@@ -0,0 +1,191 @@
+"""
+Fast JSON Encoding
+
+Without it a response is built three times: the route turns ORM rows into
+dictionaries with serialize(), flask-restx marshal() walks them again
+field by field, and json.dumps() encodes the result. A ModelEncoder is
+compiled once from a flask-restx model and writes ORM rows (or
+dictionaries) straight to JSON in one pass. Its output is byte for byte
+what json.dumps(marshal(row, model)) gives with the default RESTX_JSON
+settings, so the models still document the API in Swagger and clients see
+no difference.
+
+The fast path is opt-in with FAST_JSON_ENABLED. Set JSON_BACKEND=orjson to
+encode with orjson (when it is installed) instead: it is faster still but
+writes compact JSON with UTF-8 text, so its bytes differ from the stdlib
+ones while the values stay the same.
+"""
+import logging
+from json.encoder import encode_basestring_ascii
+from flask import current_app, request
+from flask_restx import fields
+from flask_restx.inputs import boolean
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional dependency
+    orjson = None
+
+logger = logging.getLogger("flask.app")
+
+BACKENDS = ("json", "orjson")
+
+# What an absent or None value encodes to
+NULL = "null"
+
+
+def _float(value):
+    """ Encodes a float like json.dumps, NaN and infinities included """
+    if value != value:  # pylint: disable=comparison-with-itself
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "Infinity" if value > 0 else "-Infinity"
+    return float.__repr__(value)
+
+
+# field class -> (encode to JSON text, convert to a JSON value), after format()
+SCALARS = {
+    fields.Integer: (lambda value: int.__repr__(int(value)), int),
+    fields.Float: (lambda value: _float(float(value)), float),
+    fields.String: (lambda value: encode_basestring_ascii(str(value)), str),
+    fields.Boolean: (lambda value: "true" if boolean(value) else "false", boolean),
+}
+
+
+class ModelEncoder:
+    """ Encodes objects with the fields of a flask-restx model in one pass """
+
+    def __init__(self, model):
+        self.name = getattr(model, "name", "model")
+        self._fields = []
+        prefix = "{"
+        for name, field in model.items():
+            if isinstance(field, type):
+                field = field()
+            key = encode_basestring_ascii(name) + ": "
+            write, convert = self._compile(field)
+            # what marshal() makes of None, an object of nulls for a Nested field
+            null = ModelEncoder(field.nested) if _non_null_nested(field) else None
+            self._fields.append((prefix + key, name, field.attribute or name, write, convert,
+                                 null.encode(None) if null else NULL,
+                                 null.convert(None) if null else None))
+            prefix = ", "
+
+    def _compile(self, field):
+        """ Returns the (write, convert) functions of a field """
+        if getattr(field, "default", None) is not None:
+            raise TypeError("%s: fields with a default are not supported" % self.name)
+        field_type = type(field)
+        if field_type in SCALARS:
+            encode, convert = SCALARS[field_type]
+            return (lambda value, parts: parts.append(encode(value))), convert
+        if field_type is fields.Nested:
+            nested = ModelEncoder(field.nested)
+            return nested.write, nested.convert
+        if field_type is fields.List:
+            container = field.container
+            write_item, convert_item = self._compile(container)
+
+            def write_list(value, parts):
+                if isinstance(value, dict):
+                    value = [value]
+                parts.append("[")
+                first = True
+                for item in value:
+                    if not first:
+                        parts.append(", ")
+                    first = False
+                    if item is None and not _non_null_nested(container):
+                        parts.append(NULL)
+                    else:
+                        write_item(item, parts)
+                parts.append("]")
+
+            def convert_list(value):
+                if isinstance(value, dict):
+                    value = [value]
+                return [None if item is None and not _non_null_nested(container)
+                        else convert_item(item) for item in value]
+            return write_list, convert_list
+        raise TypeError("%s: %s fields are not supported" % (self.name, field_type.__name__))
+
+    def write(self, obj, parts):
+        """ Appends the JSON text of obj to the list parts """
+        if not self._fields:
+            parts.append("{}")
+            return
+        get = _getter(obj)
+        for prefix, _, attribute, write, _, null, _ in self._fields:
+            parts.append(prefix)
+            value = get(attribute)
+            if value is None:
+                parts.append(null)
+            else:
+                write(value, parts)
+        parts.append("}")
+
+    def convert(self, obj):
+        """ Returns obj as a dictionary of JSON values """
+        get = _getter(obj)
+        result = {}
+        for _, name, attribute, _, convert, _, null in self._fields:
+            value = get(attribute)
+            result[name] = null if value is None else convert(value)
+        return result
+
+    def encode(self, obj, many=False):
+        """ Returns the JSON text of obj, or of the list obj if many """
+        parts = []
+        if many:
+            parts.append("[")
+            for index, item in enumerate(obj):
+                if index:
+                    parts.append(", ")
+                self.write(item, parts)
+            parts.append("]")
+        else:
+            self.write(obj, parts)
+        return "".join(parts)
+
+    def dumps(self, obj, many=False):
+        """ Returns the UTF-8 JSON of obj with the configured backend """
+        if orjson is not None and current_app.config.get("JSON_BACKEND") == "orjson":
+            data = [self.convert(item) for item in obj] if many else self.convert(obj)
+            return orjson.dumps(data)
+        return self.encode(obj, many).encode("ascii")
+
+
+def _non_null_nested(field):
+    """ Returns True for a Nested field that marshals None to an object of nulls """
+    return type(field) is fields.Nested and not field.allow_null
+
+
+def _getter(obj):
+    """ Returns a function that reads a key of obj like flask-restx get_value """
+    if obj is None:
+        return lambda key: None
+    if isinstance(obj, dict):
+        return obj.get
+    return lambda key: getattr(obj, key, None)
+
+
+def enabled():
+    """ Returns True if responses of the current request may take the fast path
+
+    flask-restx output changes with RESTX_JSON, debug mode (indented) and an
+    X-Fields mask, those requests keep the marshal() path.
+    """
+    config = current_app.config
+    return (config.get("FAST_JSON_ENABLED", False)
+            and not config.get("RESTX_JSON")
+            and not current_app.debug
+            and config.get("RESTX_MASK_HEADER", "X-Fields") not in request.headers)
+
+
+def check_backend(app):
+    """ Logs a warning if the configured JSON backend cannot be used """
+    backend = app.config.get("JSON_BACKEND", "json")
+    if backend not in BACKENDS:
+        logger.warning("Unknown JSON_BACKEND %s, using json", backend)
+    elif backend == "orjson" and orjson is None:
+        logger.warning("JSON_BACKEND is orjson but orjson is not installed, using json")
@@ -0,0 +1,103 @@
+"""
+Synthetic Shopcart Generator
+
+Generates large, realistic data sets for the benchmarks, EXPLAIN checks and
+load tests:
+
+    flask generate-carts 1000000 --mean-size 10 --skew 1.1 --seed 7
+
+Cart sizes follow a geometric distribution around --mean-size (so there are
+many small carts, some empty, and a long tail up to --max-size), or a
+uniform or fixed one. Product ids are drawn from a catalogue of --catalog
+products with Zipf's law: the product of rank k is picked with a weight of
+1 / k ** skew, so product 1 is the hottest and a skew of 0 picks uniformly.
+A --wishlist share of the products is wishlisted.
+
+The same seed and options always generate the same rows. The rows are fed
+to the bulk importer as they are generated, so PostgreSQL loads them with
+COPY and no more than one chunk is held in memory.
+"""
+import itertools
+import logging
+import math
+import random
+from collections import namedtuple
+from service.importer import import_rows
+
+logger = logging.getLogger("flask.app")
+
+SIZE_DISTRIBUTIONS = ("geometric", "uniform", "fixed")
+
+PRODUCT_NAMES = ("apple", "banana", "peach", "pear", "plum", "mango", "grape", "melon")
+
+# Draws per product of a cart before a cart is topped up with uniform picks,
+# keeps strongly skewed catalogues from looping on the same hot products
+MAX_DRAWS_PER_PRODUCT = 50
+
+GeneratorOptions = namedtuple(
+    "GeneratorOptions", "carts mean_size max_size distribution catalog skew wishlist seed")
+
+
+def zipf_weights(catalog, skew):
+    """ Returns the cumulative Zipf weights of product ranks 1..catalog """
+    return list(itertools.accumulate(1.0 / rank ** skew for rank in range(1, catalog + 1)))
+
+
+def cart_size(rng, options):
+    """ Draws the number of products of a cart """
+    if options.distribution == "fixed":
+        size = options.mean_size
+    elif options.distribution == "uniform":
+        size = rng.randint(0, 2 * options.mean_size)
+    else:
+        # failures before the first success, with a mean of mean_size
+        success = 1.0 / (options.mean_size + 1)
+        size = int(math.log(1.0 - rng.random()) / math.log(1.0 - success)) if success < 1 else 0
+    return min(size, options.max_size)
+
+
+def pick_products(rng, size, products, cum_weights):
+    """ Draws size distinct product ids with the Zipf weights """
+    picked = set()
+    draws = 0
+    while len(picked) < size and draws < size * MAX_DRAWS_PER_PRODUCT:
+        picked.update(rng.choices(products, cum_weights=cum_weights, k=size - len(picked)))
+        draws += size
+    while len(picked) < size:
+        picked.add(rng.choice(products))
+    return sorted(picked)
+
+
+def generate_rows(options, first_customer_id=1):
+    """ Yields import rows for options.carts carts, numbered from first_customer_id """
+    if options.distribution not in SIZE_DISTRIBUTIONS:
+        raise ValueError("Unknown cart size distribution: %s" % options.distribution)
+    if not 0 <= options.max_size <= options.catalog:
+        raise ValueError("max_size must be between 0 and the catalog size")
+    rng = random.Random(options.seed)
+    products = range(1, options.catalog + 1)
+    cum_weights = zipf_weights(options.catalog, options.skew)
+    for customer_id in range(first_customer_id, first_customer_id + options.carts):
+        customer = str(customer_id)
+        size = cart_size(rng, options)
+        if not size:
+            yield (customer, None, None, None, None, None, None)
+            continue
+        for product_id in pick_products(rng, size, products, cum_weights):
+            yield (
+                customer,
+                str(product_id),
+                PRODUCT_NAMES[product_id % len(PRODUCT_NAMES)],
+                str(rng.randint(1, 5)),
+                # a product costs the same in every cart
+                "%.2f" % (1 + product_id * 7919 % 10000 / 100),
+                "true" if rng.random() < 0.9 else "false",
+                "true" if rng.random() < options.wishlist else "false",
+            )
+
+
+def generate_carts(options, first_customer_id=1):
+    """ Generates carts and imports them, returns the ImportReport """
+    logger.info("Generating %s carts from customer_id %s with %s", options.carts,
+                first_customer_id, options)
+    return import_rows(generate_rows(options, first_customer_id))
@@ -0,0 +1,341 @@
+"""
+Bulk Shopcart Importer
+
+Loads large numbers of Shopcarts from NDJSON (one cart per line, the same
+shape as GET /shopcarts/{id}) or from CSV with one product per row:
+
+    customer_id,product_id,product_name,quantity,price,instock,wishlist
+
+A row with an empty product_id creates an empty Shopcart. Either format
+may be gzip compressed.
+
+On PostgreSQL the rows are streamed into a temporary staging table with
+COPY, validated with set based SQL and merged into the shopcart and
+product tables with INSERT ... SELECT ... ON CONFLICT, all in one
+transaction. Other databases fall back to chunked executemany inserts.
+"""
+import csv
+import gzip
+import io
+import json
+import logging
+import re
+import time
+from collections import namedtuple
+from sqlalchemy import and_, bindparam
+from service.cache import shopcart_cache
+from service.models import db, Product, Shopcart
+
+logger = logging.getLogger("flask.app")
+
+# Columns of an import row, in CSV order
+COLUMNS = ("customer_id", "product_id", "product_name", "quantity", "price", "instock", "wishlist")
+
+# Validation rules shared by the SQL (PostgreSQL ~ operator) and Python paths,
+# each is matched against the whole value
+ID_PATTERN = r"[0-9]{1,9}"
+QUANTITY_PATTERN = r"-?[0-9]{1,9}"
+PRICE_PATTERN = r"[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?"
+BOOLEAN_VALUES = ("true", "false")
+NAME_LENGTH = 120
+
+# Rows per executemany round trip on databases without COPY
+CHUNK_SIZE = 5000
+
+ImportReport = namedtuple("ImportReport", "rows rejected carts products seconds")
+
+
+def rows_per_second(report):
+    """ Returns the import throughput of a report """
+    return report.rows / report.seconds if report.seconds else float(report.rows)
+
+
+######################################################################
+#  R E A D I N G
+######################################################################
+
+
+def open_source(stream, compressed=False):
+    """ Wraps a binary stream in a text reader, decompressing it if needed """
+    if compressed:
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    return io.TextIOWrapper(stream, encoding="utf-8", newline="")
+
+
+def _text(value):
+    """ Converts a JSON value to the text staged for it """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def ndjson_rows(lines, rejected):
+    """ Flattens NDJSON Shopcarts into import rows
+
+    Lines that are not a JSON object with a customer_id are counted in
+    rejected[0] and skipped.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            cart = json.loads(line)
+            customer_id = _text(cart["customer_id"])
+            products = cart.get("product_list") or []
+        except (ValueError, KeyError, TypeError, AttributeError):
+            rejected[0] += 1
+            continue
+        if not products:
+            yield (customer_id, None, None, None, None, None, None)
+        for product in products:
+            if not isinstance(product, dict):
+                rejected[0] += 1
+                continue
+            yield (customer_id,) + tuple(_text(product.get(column)) for column in COLUMNS[1:])
+
+
+def csv_rows(lines):
+    """ Reads import rows from CSV with a header line """
+    reader = csv.reader(lines)
+    next(reader, None)
+    for record in reader:
+        record = [value if value != "" else None for value in record]
+        yield tuple(record[:len(COLUMNS)]) + (None,) * (len(COLUMNS) - len(record))
+
+
+class _CsvStream:
+    """ A file-like object that renders import rows as CSV for COPY """
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+        self._pending = ""
+        self.count = 0
+
+    def read(self, size=-1):
+        """ Returns up to size characters of CSV """
+        while size < 0 or len(self._pending) < size:
+            batch = [row for _, row in zip(range(1000), self._rows)]
+            if not batch:
+                break
+            self._writer.writerows(batch)
+            self.count += len(batch)
+            self._pending += self._buffer.getvalue()
+            self._buffer.seek(0)
+            self._buffer.truncate()
+        if size < 0:
+            data, self._pending = self._pending, ""
+        else:
+            data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    readline = read
+
+
+######################################################################
+#  I M P O R T I N G
+######################################################################
+
+
+def import_carts(stream, fmt="ndjson", compressed=False):
+    """ Imports Shopcarts from a binary stream and returns an ImportReport """
+    logger.info("Importing shopcarts from %s (compressed: %s)", fmt, compressed)
+    started = time.perf_counter()
+    source = open_source(stream, compressed)
+    rejected = [0]
+    if fmt == "csv":
+        rows = csv_rows(source)
+    elif fmt == "ndjson":
+        rows = ndjson_rows(source, rejected)
+    else:
+        raise ValueError("Unknown import format: %s" % fmt)
+    return import_rows(rows, rejected, started)
+
+
+def import_rows(rows, rejected=None, started=None):
+    """ Merges import rows into the database and returns an ImportReport
+
+    rows are tuples of text in COLUMNS order, as the readers yield them.
+    rejected is a one item list with the rows the reader already skipped.
+    """
+    if started is None:
+        started = time.perf_counter()
+    if rejected is None:
+        rejected = [0]
+    if db.engine.dialect.name == "postgresql":
+        staged, invalid, carts, products = _import_postgresql(rows)
+    else:
+        staged, invalid, carts, products = _import_portable(rows)
+    shopcart_cache.clear()
+    report = ImportReport(rows=staged + rejected[0], rejected=invalid + rejected[0],
+                          carts=carts, products=products,
+                          seconds=time.perf_counter() - started)
+    logger.info("Imported %s carts and %s products from %s rows (%s rejected) at %.0f rows/s",
+                report.carts, report.products, report.rows, report.rejected,
+                rows_per_second(report))
+    return report
+
+
+def _import_postgresql(rows):
+    """ Stages rows with COPY and merges them with set based statements """
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            "CREATE TEMP TABLE shopcart_import ("
+            " line bigserial, customer_id text, product_id text, product_name text,"
+            " quantity text, price text, instock text, wishlist text"
+            ") ON COMMIT DROP"
+        )
+        source = _CsvStream(rows)
+        cursor.copy_expert(
+            "COPY shopcart_import (%s) FROM STDIN WITH (FORMAT csv)" % ", ".join(COLUMNS),
+            source
+        )
+        cursor.execute(
+            "DELETE FROM shopcart_import WHERE customer_id IS NULL OR customer_id !~ %(id)s"
+            " OR (product_id IS NOT NULL AND ("
+            "  product_id !~ %(id)s"
+            "  OR product_name IS NULL OR length(product_name) > %(length)s"
+            "  OR quantity IS NULL OR quantity !~ %(quantity)s"
+            "  OR price IS NULL OR price !~ %(price)s"
+            "  OR instock IS NULL OR lower(instock) NOT IN %(booleans)s"
+            "  OR wishlist IS NULL OR lower(wishlist) NOT IN %(booleans)s))",
+            {"id": _anchored(ID_PATTERN), "quantity": _anchored(QUANTITY_PATTERN),
+             "price": _anchored(PRICE_PATTERN), "booleans": BOOLEAN_VALUES,
+             "length": NAME_LENGTH}
+        )
+        invalid = cursor.rowcount
+        cursor.execute(
+            "INSERT INTO shopcart (customer_id)"
+            " SELECT DISTINCT customer_id::integer FROM shopcart_import"
+            " ON CONFLICT (customer_id) DO NOTHING"
+        )
+        carts = cursor.rowcount
+        # the last row for a product wins, like repeated PUTs would
+        cursor.execute(
+            "INSERT INTO product (customer_id, product_id, product_name, quantity, price,"
+            " instock, wishlist)"
+            " SELECT DISTINCT ON (customer_id::integer, product_id::integer)"
+            "  customer_id::integer, product_id::integer, product_name, quantity::integer,"
+            "  price::float8, lower(instock)::boolean, lower(wishlist)::boolean"
+            " FROM shopcart_import WHERE product_id IS NOT NULL"
+            " ORDER BY customer_id::integer, product_id::integer, line DESC"
+            " ON CONFLICT (customer_id, product_id) DO UPDATE SET"
+            "  product_name = EXCLUDED.product_name, quantity = EXCLUDED.quantity,"
+            "  price = EXCLUDED.price, instock = EXCLUDED.instock, wishlist = EXCLUDED.wishlist"
+        )
+        products = cursor.rowcount
+        cursor.execute(
+            "UPDATE shopcart SET version = version + 1 WHERE customer_id IN"
+            " (SELECT DISTINCT customer_id::integer FROM shopcart_import"
+            "  WHERE product_id IS NOT NULL)"
+        )
+        # keep generated customer ids clear of the imported ones
+        cursor.execute(
+            "SELECT setval(pg_get_serial_sequence('shopcart', 'customer_id'),"
+            " GREATEST((SELECT max(customer_id) FROM shopcart), 1))"
+        )
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    return source.count, invalid, carts, products
+
+
+def _anchored(pattern):
+    """ Anchors a validation pattern for the PostgreSQL ~ operator """
+    return "^(" + pattern + ")$"
+
+
+def _valid(row):
+    """ Converts an import row to typed values, or returns None if it is invalid """
+    customer_id, product_id, name, quantity, price, instock, wishlist = row
+    if customer_id is None or not re.fullmatch(ID_PATTERN, customer_id):
+        return None
+    if product_id is None:
+        return (int(customer_id), None)
+    if (not re.fullmatch(ID_PATTERN, product_id)
+            or name is None or len(name) > NAME_LENGTH
+            or quantity is None or not re.fullmatch(QUANTITY_PATTERN, quantity)
+            or price is None or not re.fullmatch(PRICE_PATTERN, price)
+            or instock is None or instock.lower() not in BOOLEAN_VALUES
+            or wishlist is None or wishlist.lower() not in BOOLEAN_VALUES):
+        return None
+    return (int(customer_id), {
+        "customer_id": int(customer_id), "product_id": int(product_id),
+        "product_name": name, "quantity": int(quantity), "price": float(price),
+        "instock": instock.lower() == "true", "wishlist": wishlist.lower() == "true",
+    })
+
+
+def _import_portable(rows):
+    """ Validates rows in Python and merges them with chunked executemany """
+    staged = invalid = carts = products = 0
+    shopcart_table = Shopcart.__table__
+    product_table = Product.__table__
+    chunk = []
+    try:
+        for batch_end, row in _chunked(rows):
+            if row is not None:
+                staged += 1
+                converted = _valid(row)
+                if converted is None:
+                    invalid += 1
+                else:
+                    chunk.append(converted)
+            if not batch_end or not chunk:
+                continue
+            customer_ids = {customer_id for customer_id, _ in chunk}
+            existing = {customer_id for (customer_id,) in db.session.query(
+                Shopcart.customer_id).filter(Shopcart.customer_id.in_(customer_ids))}
+            new_carts = [{"customer_id": customer_id}
+                         for customer_id in sorted(customer_ids - existing)]
+            if new_carts:
+                db.session.execute(shopcart_table.insert(), new_carts)
+                carts += len(new_carts)
+            latest = {}
+            for _, product in chunk:
+                if product:
+                    latest[(product["customer_id"], product["product_id"])] = product
+            if latest:
+                present = {(row.customer_id, row.product_id) for row in db.session.query(
+                    Product.customer_id, Product.product_id).filter(
+                        Product.customer_id.in_(customer_ids))}
+                inserts = [p for key, p in latest.items() if key not in present]
+                updates = [dict({column: p[column] for column in Product.UPDATABLE_COLUMNS},
+                                b_customer_id=p["customer_id"], b_product_id=p["product_id"])
+                           for key, p in latest.items() if key in present]
+                if inserts:
+                    db.session.execute(product_table.insert(), inserts)
+                if updates:
+                    db.session.execute(product_table.update().where(and_(
+                        product_table.c.customer_id == bindparam("b_customer_id"),
+                        product_table.c.product_id == bindparam("b_product_id"))), updates)
+                changed = existing & {customer_id for customer_id, _ in latest}
+                if changed:
+                    db.session.execute(shopcart_table.update().where(
+                        shopcart_table.c.customer_id.in_(changed)).values(
+                            version=shopcart_table.c.version + 1))
+                products += len(latest)
+            chunk = []
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return staged, invalid, carts, products
+
+
+def _chunked(rows):
+    """ Yields (batch_end, row) pairs, ending a batch every CHUNK_SIZE rows """
+    count = 0
+    for row in rows:
+        count += 1
+        yield count % CHUNK_SIZE == 0, row
+    yield True, None
@@ -0,0 +1,212 @@
+"""
+Request and Database Instrumentation
+
+Collects Prometheus metrics for every request: a count and a latency
+histogram per flask-restx resource and method (e.g. ShopcartCollection.get),
+the requests in flight, the number and time of the SQL statements each
+request ran, and the state of the connection pool. GET /metrics serves them
+in the Prometheus text format.
+
+Every response also reports its SQL statements and time in a Server-Timing
+header, statements slower than SLOW_QUERY_SECONDS are logged with the
+handler that ran them, and handlers decorated with @query_budget(n) are
+checked against the number of statements they may run.
+
+Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+(set by gunicorn.conf.py) and /metrics adds up the files of all workers, so
+any worker answers a scrape for the whole service. The variable has to be
+set before prometheus_client is imported.
+"""
+import logging
+import os
+import time
+from functools import wraps
+from flask import g, has_request_context, request
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest, multiprocess, REGISTRY)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from service import app
+from service.models import db
+from service.pool import checkout_listeners, pool_stats
+
+logger = logging.getLogger("flask.app")
+
+# Label of requests that did not match a route, keeps the label set bounded
+UNMATCHED = "unmatched"
+
+# Method labels, any other verb a client sends is counted as OTHER_METHOD
+METHODS = frozenset(("GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS"))
+OTHER_METHOD = "other"
+
+
+class QueryBudgetExceeded(Exception):
+    """ Used when a handler runs more SQL statements than its budget """
+
+
+REQUESTS = Counter(
+    "shopcarts_http_requests_total", "HTTP requests by handler, method and status",
+    ["handler", "method", "status"])
+REQUEST_SECONDS = Histogram(
+    "shopcarts_http_request_duration_seconds", "Time to build the response by handler",
+    ["handler", "method"],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+IN_PROGRESS = Gauge(
+    "shopcarts_http_requests_in_progress", "HTTP requests being served",
+    multiprocess_mode="livesum")
+REQUEST_QUERIES = Histogram(
+    "shopcarts_http_request_db_queries", "SQL statements run per request by handler",
+    ["handler", "method"], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+REQUEST_QUERY_SECONDS = Histogram(
+    "shopcarts_http_request_db_seconds", "Time spent in SQL statements per request by handler",
+    ["handler", "method"],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 5))
+POOL_CONNECTIONS = Gauge(
+    "shopcarts_db_pool_connections", "Pooled database connections by state",
+    ["state"], multiprocess_mode="livesum")
+POOL_WAIT_SECONDS = Histogram(
+    "shopcarts_db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection",
+    buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5, 30))
+POOL_TIMEOUTS = Counter(
+    "shopcarts_db_pool_timeouts_total", "Connection checkouts that timed out")
+
+# (endpoint, method) -> handler label, filled as routes are first hit
+_handlers = {}
+
+
+def method_label(method):
+    """ Returns the method label of a request, keeping the label set bounded """
+    return method if method in METHODS else OTHER_METHOD
+
+
+def handler_name(endpoint, method):
+    """ Returns the handler label of a request, Resource.method for flask-restx """
+    key = (endpoint, method)
+    name = _handlers.get(key)
+    if name is None:
+        view = app.view_functions.get(endpoint)
+        view_class = getattr(view, "view_class", None)
+        if view_class is not None:
+            name = "%s.%s" % (view_class.__name__, method.lower())
+        else:
+            name = endpoint or UNMATCHED
+        _handlers[key] = name
+    return name
+
+
+def query_budget(limit):
+    """ Limits the SQL statements a handler may run, serialization included
+
+    Put it above @api.marshal_with so lazy loads during marshalling count.
+    Going over the budget raises QueryBudgetExceeded when the app is
+    TESTING and logs a warning otherwise.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            before = g.get("metrics_queries", 0)
+            result = function(*args, **kwargs)
+            used = g.get("metrics_queries", 0) - before
+            if used > limit:
+                message = "%s ran %d SQL statements, its budget is %d" % (
+                    function.__qualname__, used, limit)
+                if app.config.get("TESTING"):
+                    raise QueryBudgetExceeded(message)
+                logger.warning(message)
+            return result
+        return wrapper
+    return decorator
+
+
+def render_metrics():
+    """ Returns the metrics of every worker in the Prometheus text format """
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+######################################################################
+# REQUEST HOOKS
+######################################################################
+@app.before_request
+def start_request_metrics():
+    """ Starts timing a request """
+    IN_PROGRESS.inc()
+    g.metrics_started = time.perf_counter()
+    g.metrics_queries = 0
+    g.metrics_query_seconds = 0.0
+
+
+@app.after_request
+def record_request_metrics(response):
+    """ Records the latency, status and SQL statements of a request """
+    if "metrics_started" in g and app.config.get("SERVER_TIMING_ENABLED", True):
+        elapsed = time.perf_counter() - g.metrics_started
+        response.headers.add(
+            "Server-Timing", 'db;dur=%.2f;desc="%d queries", app;dur=%.2f'
+            % (g.metrics_query_seconds * 1000, g.metrics_queries, elapsed * 1000))
+    _finish_request(response.status_code)
+    return response
+
+
+@app.teardown_request
+def finish_failed_request_metrics(error=None):
+    """ Records a request that raised before a response was made """
+    _finish_request(500)
+
+
+def _finish_request(status_code):
+    started = g.pop("metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    IN_PROGRESS.dec()
+    method = method_label(request.method)
+    handler = handler_name(request.endpoint, method)
+    REQUESTS.labels(handler, method, status_code).inc()
+    REQUEST_SECONDS.labels(handler, method).observe(elapsed)
+    REQUEST_QUERIES.labels(handler, method).observe(g.metrics_queries)
+    REQUEST_QUERY_SECONDS.labels(handler, method).observe(g.metrics_query_seconds)
+    stats = pool_stats(db.engine.pool)
+    if "in_use" in stats:
+        POOL_CONNECTIONS.labels("in_use").set(stats["in_use"])
+        POOL_CONNECTIONS.labels("idle").set(stats["idle"])
+
+
+######################################################################
+# SQL AND POOL HOOKS
+######################################################################
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    """ Starts timing a SQL statement """
+    if context is not None:
+        context.metrics_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    """ Adds a SQL statement to the totals of the current request """
+    started = getattr(context, "metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    in_request = has_request_context() and "metrics_queries" in g
+    if in_request:
+        g.metrics_queries += 1
+        g.metrics_query_seconds += elapsed
+    if elapsed >= app.config.get("SLOW_QUERY_SECONDS", float("inf")):
+        handler = (handler_name(request.endpoint, method_label(request.method))
+                   if in_request else "-")
+        logger.warning("Slow query (%.3fs) in %s: %s", elapsed, handler, " ".join(statement.split()))
+
+
+def record_checkout(waited, timed_out):
+    """ Records the wait of a connection checkout """
+    POOL_WAIT_SECONDS.observe(waited)
+    if timed_out:
+        POOL_TIMEOUTS.inc()
+
+
+checkout_listeners.append(record_checkout)
@@ -0,0 +1,123 @@
+"""
+Memory Diagnostics
+
+Wraps tracemalloc for the /debug/memory endpoints: tracing is started and
+stopped at run time, snapshots are kept by id, and the top allocation sites
+of a snapshot or the difference between two snapshots are returned as
+dictionaries. It also reports the resident set size of the process and the
+number of live SQLAlchemy sessions with the objects in their identity maps,
+which is where a leaked session shows up.
+
+Everything here is per process: ask the same gunicorn worker (e.g. run with
+one worker) when comparing snapshots.
+"""
+import itertools
+import os
+import threading
+import tracemalloc
+from collections import OrderedDict
+from sqlalchemy.orm.session import _sessions
+
+# Snapshots kept at a time, the oldest is dropped first
+MAX_SNAPSHOTS = 10
+
+GROUP_BY = ("lineno", "filename", "traceback")
+
+# Allocations of tracemalloc itself and of the import machinery are noise
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class MemoryTracer:
+    """ Starts tracemalloc and keeps its snapshots by id """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshots = OrderedDict()
+        self._ids = itertools.count(1)
+
+    def start(self, frames=1):
+        """ Starts tracing allocations with up to frames frames per traceback """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def stop(self):
+        """ Stops tracing and forgets the snapshots """
+        tracemalloc.stop()
+        with self._lock:
+            self._snapshots.clear()
+
+    def snapshot(self):
+        """ Takes a snapshot and returns its id """
+        if not tracemalloc.is_tracing():
+            raise ValueError("tracemalloc is not tracing, start it first")
+        snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+        with self._lock:
+            snapshot_id = next(self._ids)
+            self._snapshots[snapshot_id] = snapshot
+            while len(self._snapshots) > MAX_SNAPSHOTS:
+                self._snapshots.popitem(last=False)
+        return snapshot_id
+
+    def snapshot_ids(self):
+        """ Returns the ids of the snapshots kept """
+        with self._lock:
+            return list(self._snapshots)
+
+    def _get(self, snapshot_id):
+        with self._lock:
+            snapshot = self._snapshots.get(snapshot_id)
+        if snapshot is None:
+            raise KeyError(snapshot_id)
+        return snapshot
+
+    def top(self, snapshot_id, limit=20, group_by="lineno"):
+        """ Returns the allocation sites of a snapshot that hold the most memory """
+        stats = self._get(snapshot_id).statistics(group_by)
+        return [_stat(stat) for stat in stats[:limit]]
+
+    def diff(self, snapshot_id, compare_to, limit=20, group_by="lineno"):
+        """ Returns the allocation sites that grew the most between two snapshots """
+        stats = self._get(snapshot_id).compare_to(self._get(compare_to), group_by)
+        return [dict(_stat(stat), size_diff=stat.size_diff, count_diff=stat.count_diff)
+                for stat in stats[:limit]]
+
+    def status(self):
+        """ Returns the tracing state, process size and session counters """
+        traced, peak = tracemalloc.get_traced_memory()
+        sessions = list(_sessions.values())
+        return {
+            "tracing": tracemalloc.is_tracing(),
+            "traced_bytes": traced,
+            "traced_peak_bytes": peak,
+            "rss_bytes": rss_bytes(),
+            "snapshots": self.snapshot_ids(),
+            "sessions": len(sessions),
+            "identity_map_objects": sum(len(session.identity_map) for session in sessions),
+        }
+
+
+def _stat(stat):
+    return {
+        "site": "; ".join("%s:%s" % (frame.filename, frame.lineno)
+                          for frame in reversed(stat.traceback)),
+        "size": stat.size,
+        "count": stat.count,
+    }
+
+
+def rss_bytes():
+    """ Returns the resident set size of the process, or None where /proc is missing """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# The tracer of this process
+memory_tracer = MemoryTracer()
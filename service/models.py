@@ -4,6 +4,14 @@ All of the models are stored in this module
 """
 import logging
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, bindparam, event, exists, not_, select, tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from service.cache import shopcart_cache
+from service.pool import TimedQueuePool
+from service.statements import bakery, execute
 
 logger = logging.getLogger("flask.app")
 
@@ -23,6 +31,20 @@ class DataValidationError(Exception):
     """ Used for an data validation errors when deserializing """
     pass
 
+
+class VersionMismatchError(Exception):
+    """ Used when a Shopcart changed since the version a client expected """
+
+
+# SQLSTATE raised by PostgreSQL when a product references a missing shopcart
+FOREIGN_KEY_VIOLATION = "23503"
+
+# Session.info key of the shopcarts whose version this transaction bumped
+TOUCHED_SHOPCARTS = "touched_shopcarts"
+
+# Session.info key of the version each shopcart was last bumped to by touch()
+TOUCHED_VERSIONS = "touched_versions"
+
 ######################################################################
 #  P R O D U C T   M O D E L
 ######################################################################
@@ -43,11 +65,35 @@ class Product(db.Model):
     price = db.Column(db.Float, nullable=False)
     instock = db.Column(db.Boolean(), nullable=False)
     wishlist = db.Column(db.Boolean(), nullable=False)
+    __table_args__ = (
+        # a product appears at most once per shopcart and is looked up by both
+        db.Index("ix_product_customer_id_product_id", "customer_id", "product_id", unique=True),
+        # only the wishlisted rows, ordered for per customer and cross customer reads
+        db.Index("ix_product_wishlist", customer_id, id,
+                 postgresql_where=wishlist, sqlite_where=wishlist),
+    )
+
+    # columns that a PUT of an existing product may change
+    UPDATABLE_COLUMNS = ("product_name", "quantity", "price", "instock", "wishlist")
+
+    def delete(self, expected_version=None):
+        """
+        Removes a Product from the data store
+
+        Returns False if the shopcart no longer exists.
 
-    def delete(self):
+        Args:
+            expected_version (int): only delete it if the shopcart is still
+                at this version
+        """
         logger.info("Deleting Product %s", self.id)
+        customer_id = self.customer_id
+        if expected_version is not None and not Shopcart.touch(customer_id, expected_version):
+            return False
         db.session.delete(self)
         db.session.commit()
+        shopcart_cache.invalidate(customer_id)
+        return True
 
     def create(self):
         """
@@ -56,14 +102,30 @@ class Product(db.Model):
         logger.info("Creating %s", self.id)
         self.id = None
         db.session.add(self)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        shopcart_cache.invalidate(self.customer_id)
 
-    def update(self):
+    def update(self, expected_version=None):
         """
         Updates a product to the database
+
+        Returns False if the shopcart no longer exists.
+
+        Args:
+            expected_version (int): only save it if the shopcart is still
+                at this version
         """
         logger.info("Saving %s", self.id)
+        customer_id = self.customer_id
+        if expected_version is not None and not Shopcart.touch(customer_id, expected_version):
+            return False
         db.session.commit()
+        shopcart_cache.invalidate(customer_id)
+        return True
 
     def serialize(self):
         """ Serializes a Shopcart into a dictionary """
@@ -91,7 +153,7 @@ class Product(db.Model):
         except KeyError as error:
             raise DataValidationError(
                 "Invalid Address: missing " + error.args[0])
-        except TypeError as error:
+        except (TypeError, ValueError) as error:
             raise DataValidationError(
                 "Invalid Address: body of request contained" "bad or no data"
             )
@@ -105,7 +167,303 @@ class Product(db.Model):
     def find(cls, by_id):
         """ Finds a product by it's product.id """
         logger.info("Processing lookup for Product.id %s ...", by_id)
-        return cls.query.get(by_id)
+        return bakery(lambda session: session.query(cls))(db.session()).get(by_id)
+
+    @classmethod
+    def upsert(cls, customer_id, product_id, data, expected_version=None):
+        """
+        Adds a product to a shopcart or updates the one already there
+
+        On PostgreSQL this is a single INSERT ... ON CONFLICT DO UPDATE, so
+        concurrent requests for the same product cannot create duplicates.
+        Returns the saved Product, or None if the shopcart does not exist.
+        Raises VersionMismatchError if expected_version is given and the
+        shopcart is at another version.
+        """
+        logger.info("Upserting product_id %s in shopcart %s", product_id, customer_id)
+        product = cls().deserialize(data)
+        values = {column: getattr(product, column) for column in cls.UPDATABLE_COLUMNS}
+        # bumping the version first also locks the shopcart row
+        if not Shopcart.touch(customer_id, expected_version):
+            return None
+        if db.engine.dialect.name == "postgresql":
+            return cls._upsert_postgresql(customer_id, product_id, values)
+        return cls._upsert_portable(customer_id, product_id, values, expected_version)
+
+    @classmethod
+    def _upsert_postgresql(cls, customer_id, product_id, values):
+        """ Upserts with ON CONFLICT on the (customer_id, product_id) index """
+        stmt = postgresql.insert(cls.__table__).values(
+            customer_id=customer_id, product_id=product_id, **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["customer_id", "product_id"],
+            set_={column: stmt.excluded[column] for column in values}
+        ).returning(*cls.__table__.columns)
+        try:
+            row = db.session.execute(stmt).fetchone()
+            db.session.commit()
+        except IntegrityError as error:
+            db.session.rollback()
+            if getattr(error.orig, "pgcode", None) == FOREIGN_KEY_VIOLATION:
+                return None
+            raise
+        shopcart_cache.invalidate(customer_id)
+        return cls(**dict(row))
+
+    @classmethod
+    def _upsert_portable(cls, customer_id, product_id, values, expected_version=None):
+        """ Upserts with a lookup followed by an INSERT or UPDATE """
+        for attempt in range(2):
+            if attempt and not Shopcart.touch(customer_id, expected_version):
+                return None
+            product = cls.find_in_cart(customer_id, product_id)
+            if not product:
+                product = cls(customer_id=customer_id, product_id=product_id)
+                db.session.add(product)
+            for column, value in values.items():
+                setattr(product, column, value)
+            try:
+                db.session.commit()
+                shopcart_cache.invalidate(customer_id)
+                return product
+            except IntegrityError:
+                # a concurrent request inserted it first, update that row instead
+                db.session.rollback()
+        raise DataValidationError(
+            "Product %s in shopcart %s could not be saved" % (product_id, customer_id))
+
+    @classmethod
+    def parse_batch(cls, customer_id, operations):
+        """
+        Validates a list of batch operations before any of them is applied
+
+        Each operation is a dict with an "op" of add, update or delete and a
+        product_id. Adds carry a full product, updates any of the
+        UPDATABLE_COLUMNS. Returns a list of (op, product_id, values) tuples.
+        """
+        if not isinstance(operations, list) or not operations:
+            raise DataValidationError("Invalid batch: operations must be a non-empty list")
+        parsed = []
+        seen = set()
+        for index, operation in enumerate(operations):
+            try:
+                op = operation["op"]
+                product_id = int(operation["product_id"])
+                if op == "add":
+                    product = cls().deserialize(dict(operation, customer_id=customer_id))
+                    product.instock = operation["instock"] in (True, "true")
+                    product.wishlist = operation["wishlist"] in (True, "true")
+                    values = {column: getattr(product, column) for column in cls.UPDATABLE_COLUMNS}
+                elif op == "update":
+                    values = cls._parse_columns(operation)
+                    if not values:
+                        raise DataValidationError("nothing to update")
+                elif op == "delete":
+                    values = {}
+                else:
+                    raise DataValidationError("unknown op %r" % op)
+                if "quantity" in values and values["quantity"] <= 0:
+                    raise DataValidationError("quantity must be a positive integer")
+            except KeyError as error:
+                raise DataValidationError(
+                    "Invalid batch operation %s: missing %s" % (index, error.args[0]))
+            except (TypeError, ValueError, DataValidationError) as error:
+                raise DataValidationError("Invalid batch operation %s: %s" % (index, error))
+            if product_id in seen:
+                raise DataValidationError(
+                    "Invalid batch operation %s: product_id %s appears twice" % (index, product_id))
+            seen.add(product_id)
+            parsed.append((op, product_id, values))
+        return parsed
+
+    @classmethod
+    def _parse_columns(cls, data):
+        """ Converts the updatable columns present in data """
+        converters = {
+            "product_name": str,
+            "quantity": int,
+            "price": float,
+            "instock": lambda value: value in (True, "true"),
+            "wishlist": lambda value: value in (True, "true"),
+        }
+        return {column: converters[column](data[column])
+                for column in cls.UPDATABLE_COLUMNS if column in data}
+
+    @classmethod
+    def apply_batch(cls, customer_id, operations, expected_version=None):
+        """
+        Applies parsed batch operations to a shopcart in a single transaction
+
+        Adds, updates and deletes are each sent as one bulk statement and the
+        transaction is committed once. Returns one result per operation
+        (created, updated, deleted, conflict or not_found), or None if the
+        shopcart does not exist.
+        """
+        logger.info("Applying %s batch operations to shopcart %s", len(operations), customer_id)
+        table = cls.__table__
+        # bumping the version locks the shopcart row so concurrent batches are serialized
+        if not Shopcart.touch(customer_id, expected_version):
+            return None
+        product_ids = [product_id for _, product_id, _ in operations]
+        existing = {row.product_id for row in db.session.query(cls.product_id).filter(
+            cls.customer_id == customer_id, cls.product_id.in_(product_ids))}
+
+        results = []
+        inserts, deletes, updates = [], [], {}
+        for op, product_id, values in operations:
+            if op == "add":
+                if product_id in existing:
+                    results.append("conflict")
+                    continue
+                inserts.append(dict(values, customer_id=customer_id, product_id=product_id))
+                results.append("created")
+            elif product_id not in existing:
+                results.append("not_found")
+            elif op == "update":
+                # executemany needs the same columns in every parameter set
+                updates.setdefault(tuple(sorted(values)), []).append(
+                    dict(values, b_product_id=product_id))
+                results.append("updated")
+            else:
+                deletes.append(product_id)
+                results.append("deleted")
+
+        try:
+            if deletes:
+                db.session.execute(table.delete().where(and_(
+                    table.c.customer_id == customer_id, table.c.product_id.in_(deletes))))
+            for params in updates.values():
+                db.session.execute(table.update().where(and_(
+                    table.c.customer_id == customer_id,
+                    table.c.product_id == bindparam("b_product_id"))), params)
+            if inserts:
+                db.session.execute(table.insert(), inserts)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        shopcart_cache.invalidate(customer_id)
+        return results
+
+    @classmethod
+    def toggle_wishlist(cls, customer_id, product_id, expected_version=None):
+        """
+        Flips the wishlist flag of a product in a shopcart
+
+        The flag is negated by the UPDATE itself, so concurrent toggles
+        cannot overwrite each other. Returns the updated Product, or None if
+        the shopcart or the product does not exist.
+        """
+        logger.info("Toggling wishlist of product_id %s in shopcart %s", product_id, customer_id)
+        table = cls.__table__
+        if not Shopcart.touch(customer_id, expected_version):
+            return None
+        where = and_(table.c.customer_id == customer_id, table.c.product_id == product_id)
+        stmt = table.update().where(where).values(wishlist=not_(table.c.wishlist))
+        try:
+            if db.engine.dialect.name == "postgresql":
+                row = db.session.execute(stmt.returning(*table.columns)).fetchone()
+            else:
+                # the touched shopcart row stays locked until the commit
+                result = db.session.execute(stmt)
+                row = None
+                if result.rowcount:
+                    row = db.session.execute(select([table]).where(where)).fetchone()
+            if row is None:
+                db.session.rollback()
+                return None
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        shopcart_cache.invalidate(customer_id)
+        return cls(**dict(row))
+
+    @classmethod
+    def set_wishlist(cls, customer_id, product_ids, wishlist, expected_version=None):
+        """
+        Sets or clears the wishlist flag of many products of a shopcart
+
+        All products are changed by one UPDATE. Product ids that are not in
+        the shopcart are ignored. Returns the updated Products ordered by
+        product_id, or None if the shopcart does not exist.
+        """
+        if not isinstance(product_ids, list) or not product_ids:
+            raise DataValidationError("Invalid wishlist: product_ids must be a non-empty list")
+        if not isinstance(wishlist, bool):
+            raise DataValidationError("Invalid wishlist: wishlist must be true or false")
+        try:
+            product_ids = sorted({int(product_id) for product_id in product_ids})
+        except (TypeError, ValueError):
+            raise DataValidationError("Invalid wishlist: product_ids must be integers")
+        logger.info("Setting wishlist to %s for %s products in shopcart %s",
+                    wishlist, len(product_ids), customer_id)
+        table = cls.__table__
+        if not Shopcart.touch(customer_id, expected_version):
+            return None
+        where = and_(table.c.customer_id == customer_id, table.c.product_id.in_(product_ids))
+        stmt = table.update().where(where).values(wishlist=wishlist)
+        try:
+            if db.engine.dialect.name == "postgresql":
+                rows = db.session.execute(stmt.returning(*table.columns)).fetchall()
+            else:
+                db.session.execute(stmt)
+                rows = db.session.execute(select([table]).where(where)).fetchall()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        shopcart_cache.invalidate(customer_id)
+        return sorted((cls(**dict(row)) for row in rows), key=lambda product: product.product_id)
+
+    @classmethod
+    def find_in_cart(cls, customer_id, product_id):
+        """ Finds a product in a shopcart by it's (customer_id, product_id) """
+        logger.info("Processing lookup for product_id %s in shopcart %s ...",
+                    product_id, customer_id)
+        query = bakery(lambda session: session.query(cls))
+        query += lambda q: q.filter(cls.customer_id == bindparam("customer_id"),
+                                    cls.product_id == bindparam("product_id"))
+        return query(db.session()).params(customer_id=customer_id, product_id=product_id).first()
+
+    ##################################################
+    # READ-ONLY QUERIES, see ProductRecord
+    ##################################################
+
+    @classmethod
+    def read_in_cart(cls, customer_id, product_id):
+        """ Returns the ProductRecord of a product in a shopcart, or None """
+        logger.info("Processing read of product_id %s in shopcart %s ...",
+                    product_id, customer_id)
+        row = execute(db.session, READ_PRODUCT_IN_CART,
+                      customer_id=customer_id, product_id=product_id).fetchone()
+        return ProductRecord(*row) if row else None
+
+    @classmethod
+    def read_wishlisted(cls, customer_id):
+        """ Returns the ProductRecords of the wishlisted products of a shopcart """
+        logger.info("Processing wishlist read for customer_id %s ...", customer_id)
+        return [ProductRecord(*row)
+                for row in execute(db.session, READ_WISHLISTED, customer_id=customer_id)]
+
+    @classmethod
+    def read_wishlisted_page(cls, after=None, limit=100):
+        """ Returns up to limit ProductRecords of wishlisted products of all shopcarts
+
+        Products are ordered by (customer_id, id), the order of the partial
+        ix_product_wishlist index.
+
+        Args:
+            after (tuple): only return products after this (customer_id, id) cursor
+            limit (int): the maximum number of products to return
+        """
+        logger.info("Processing read of wishlisted products after %s (limit %s)", after, limit)
+        table = cls.__table__
+        stmt = ProductRecord.select().where(table.c.wishlist)
+        if after is not None:
+            stmt = stmt.where(tuple_(table.c.customer_id, table.c.id) > tuple_(*after))
+        stmt = stmt.order_by(table.c.customer_id, table.c.id).limit(limit)
+        return [ProductRecord(*row) for row in db.session.execute(stmt)]
 
 ######################################################################
 #  S H O P C A R T   M O D E L
@@ -121,6 +479,8 @@ class Shopcart(db.Model):
 
     # Table Schema
     customer_id = db.Column(db.Integer, primary_key=True)
+    # bumped by every change to the shopcart or its products, used as the ETag
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
     product_list = db.relationship(
         'Product', cascade="all,delete", backref='shopcart', lazy=True)
 
@@ -133,21 +493,55 @@ class Shopcart(db.Model):
         """
         logger.info("Creating shopcart for customer_id: %s", self.customer_id)
         self.customer_id = None  # id must be none to generate next primary key
-        db.session.add(self)
-        db.session.commit()
+        # the products go in with one executemany INSERT instead of one per product
+        products = list(self.product_list)
+        self.product_list.clear()
+        try:
+            db.session.add(self)
+            db.session.flush()
+            if products:
+                db.session.execute(Product.__table__.insert(), [
+                    dict({column: getattr(product, column) for column in Product.UPDATABLE_COLUMNS},
+                         customer_id=self.customer_id, product_id=product.product_id)
+                    for product in products])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        shopcart_cache.invalidate(self.customer_id)
 
     def update(self):
         """
         Updates a Shopcart to the database
         """
         logger.info("Saving %s", self.customer_id)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        shopcart_cache.invalidate(self.customer_id)
+
+    def delete(self, expected_version=None):
+        """ Removes a Shopcart from the data store
+
+        Returns False if it no longer exists.
 
-    def delete(self):
-        """ Removes a Shopcart from the data store """
+        Args:
+            expected_version (int): only delete it if it is still at this version
+        """
         logger.info("Deleting %s", self.customer_id)
+        customer_id = self.customer_id
+        if expected_version is not None and not Shopcart.touch(customer_id, expected_version):
+            return False
+        # the products go with one DELETE instead of being loaded to cascade
+        table = Product.__table__
+        db.session.execute(table.delete().where(table.c.customer_id == customer_id))
+        set_committed_value(self, "product_list", [])
         db.session.delete(self)
         db.session.commit()
+        shopcart_cache.invalidate(customer_id)
+        return True
 
     def serialize(self):
         """ Serializes a Shopcart into a dictionary """
@@ -168,10 +562,17 @@ class Shopcart(db.Model):
         try:
             # handle inner list of addresses
             product_list = data["product_list"]
+            product_ids = set()
             for json_product in product_list:
                 product = Product()
                 product.deserialize(json_product)
-                product.create()
+                # ix_product_customer_id_product_id allows a product once per shopcart
+                if product.product_id in product_ids:
+                    raise DataValidationError(
+                        "Invalid Shopcart: product_id %s is listed more than once"
+                        % product.product_id)
+                product_ids.add(product.product_id)
+                # saved together with the shopcart so it gets its customer_id
                 self.product_list.append(product)
         except KeyError as error:
             raise DataValidationError(
@@ -188,19 +589,86 @@ class Shopcart(db.Model):
 
     @classmethod
     def init_db(cls, app):
-        """ Initializes the database session """
+        """ Initializes the database and creates the tables
+
+        No application context stays pushed and no connection stays open
+        afterwards: sessions are scoped to the application context of each
+        request (and so to its thread), and a gunicorn master that imports
+        the app before forking hands no connections to its workers.
+        """
         logger.info("Initializing database")
         cls.app = app
+        shopcart_cache.configure(
+            enabled=app.config.get("SHOPCART_CACHE_ENABLED", False),
+            maxsize=app.config.get("SHOPCART_CACHE_SIZE", 1024),
+            ttl=app.config.get("SHOPCART_CACHE_TTL", 30.0),
+        )
+        engine_options = app.config.get("SQLALCHEMY_ENGINE_OPTIONS")
+        if engine_options and not app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+            # time connection checkouts for GET /stats/pool
+            engine_options.setdefault("poolclass", TimedQueuePool)
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
-        app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        with app.app_context():
+            db.create_all()  # make our sqlalchemy tables
+            db.session.remove()
+            db.get_engine(app).dispose()
 
     @classmethod
     def find(cls, customer_id):
         """ Finds a shopcart by it's ID """
         logger.info("Processing lookup for customer_id %s ...", customer_id)
-        return cls.query.get(customer_id)
+        return bakery(lambda session: session.query(cls))(db.session()).get(customer_id)
+
+    @classmethod
+    def version_of(cls, customer_id):
+        """ Returns the version of a shopcart, or None if it does not exist """
+        logger.info("Processing version lookup for customer_id %s ...", customer_id)
+        return execute(db.session, SHOPCART_VERSION, customer_id=customer_id).scalar()
+
+    @classmethod
+    def touch(cls, customer_id, expected_version=None):
+        """
+        Bumps the version of a shopcart inside the current transaction
+
+        Returns the new version, or False if the shopcart does not exist.
+        Raises VersionMismatchError, after rolling back, if expected_version
+        is given and the shopcart is at another version.
+        """
+        table = cls.__table__
+        stmt = table.update().where(table.c.customer_id == customer_id)
+        if expected_version is not None:
+            stmt = stmt.where(table.c.version == expected_version)
+        stmt = stmt.values(version=table.c.version + 1)
+        if db.engine.dialect.name == "postgresql":
+            version = db.session.execute(stmt.returning(table.c.version)).scalar()
+        elif db.session.execute(stmt).rowcount != 1:
+            version = None
+        elif expected_version is not None:
+            version = expected_version + 1
+        else:
+            # the UPDATE holds the write lock, so nobody bumped it since
+            version = cls.version_of(customer_id)
+        if version is not None:
+            db.session.info.setdefault(TOUCHED_SHOPCARTS, set()).add(customer_id)
+            db.session.info.setdefault(TOUCHED_VERSIONS, {})[customer_id] = version
+            return version
+        db.session.rollback()
+        if expected_version is not None and cls.exists(customer_id):
+            raise VersionMismatchError(
+                "Shopcart %s is no longer at version %s" % (customer_id, expected_version))
+        return False
+
+    @classmethod
+    def touched_version(cls, customer_id):
+        """ Returns the version touch() last bumped a shopcart to in this session """
+        return db.session.info.get(TOUCHED_VERSIONS, {}).get(customer_id)
+
+    @classmethod
+    def exists(cls, customer_id):
+        """ Returns True if a shopcart with the given ID exists """
+        logger.info("Processing existence check for customer_id %s ...", customer_id)
+        return execute(db.session, SHOPCART_EXISTS, customer_id=customer_id).scalar()
 
     @classmethod
     def all(cls):
@@ -209,9 +677,79 @@ class Shopcart(db.Model):
         logger.info("Processing all Shopcarts")
         # for doc in cls.query.all():
         #     results.append(doc)
-        return cls.query.all()
+        # the products of every shopcart come in one more query, not one each
+        return cls.query.options(selectinload(cls.product_list)).all()
         # return results
 
+    ##################################################
+    # READ-ONLY QUERIES, see ShopcartRecord
+    ##################################################
+
+    @classmethod
+    def read(cls, customer_id):
+        """ Returns the ShopcartRecord of a shopcart and its products, or None
+
+        The shopcart and its products are read with one statement, so the
+        version always matches the products.
+        """
+        logger.info("Processing read of customer_id %s ...", customer_id)
+        rows = execute(db.session, READ_SHOPCART, customer_id=customer_id)
+        return next(ShopcartRecord.group(rows), None)
+
+    @classmethod
+    def read_page(cls, after=None, limit=100):
+        """ Returns up to limit ShopcartRecords ordered by customer_id
+
+        The shopcarts of the page and their products are read with one
+        statement, however many shopcarts there are.
+
+        Args:
+            after (int): only return Shopcarts with a customer_id after this cursor
+            limit (int): the maximum number of Shopcarts to return
+        """
+        logger.info("Processing read of Shopcarts after %s (limit %s)", after, limit)
+        table = cls.__table__
+        page = select([table.c.customer_id, table.c.version]).order_by(table.c.customer_id)
+        if after is not None:
+            page = page.where(table.c.customer_id > after)
+        stmt = ShopcartRecord.select(page.limit(limit).alias("page"))
+        return list(ShopcartRecord.group(db.session.execute(stmt)))
+
+    @classmethod
+    def read_all(cls, batch_size=1000):
+        """ Returns an iterator over the ShopcartRecords of all Shopcarts
+
+        One statement is read with a server-side cursor, batch_size rows at
+        a time, so memory use stays flat no matter how many Shopcarts there
+        are.
+        """
+        logger.info("Streaming read of all Shopcarts in batches of %s", batch_size)
+        stmt = ShopcartRecord.select(cls.__table__).execution_options(stream_results=True)
+        result = db.session.execute(stmt)
+
+        def rows():
+            while True:
+                batch = result.fetchmany(batch_size)
+                if not batch:
+                    return
+                yield from batch
+        return ShopcartRecord.group(rows())
+
+    @classmethod
+    def estimated_count(cls):
+        """ Returns an approximate number of Shopcarts without scanning the table """
+        logger.info("Processing estimated count of Shopcarts")
+        if db.engine.dialect.name == "postgresql":
+            estimate = db.session.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)",
+                {"table": cls.__tablename__}
+            ).scalar()
+            # before PostgreSQL 14 a table that was never analyzed has reltuples 0,
+            # counting is cheap when the table really is (nearly) empty
+            if estimate is not None and estimate > 0:
+                return int(estimate)
+        return db.session.query(db.func.count(cls.customer_id)).scalar()
+
     @classmethod
     def clear(cls):
         # db.drop_all()  # clean up the last tests
@@ -234,3 +772,153 @@ class Shopcart(db.Model):
     #     """
     #     logger.info("Processing name query for %s ...", name)
     #     return cls.query.filter(cls.name == name)
+
+
+######################################################################
+#  R E A D - O N L Y   R E C O R D S
+######################################################################
+
+
+class ProductRecord:
+    """
+    A Product row read with a SQLAlchemy Core select
+
+    It has the columns and serialize() of a Product, without the identity
+    map entry, instance state and change tracking of an ORM instance. Used
+    by the read endpoints, which change nothing.
+    """
+
+    __slots__ = ("id", "customer_id", "product_id", "product_name", "quantity", "price",
+                 "instock", "wishlist")
+
+    def __init__(self, id, customer_id, product_id, product_name,  # pylint: disable=redefined-builtin
+                 quantity, price, instock, wishlist):
+        self.id = id
+        self.customer_id = customer_id
+        self.product_id = product_id
+        self.product_name = product_name
+        self.quantity = quantity
+        self.price = price
+        self.instock = instock
+        self.wishlist = wishlist
+
+    serialize = Product.serialize
+
+    def __repr__(self):
+        return "<ProductRecord %s in shopcart %s>" % (self.product_id, self.customer_id)
+
+    @classmethod
+    def columns(cls):
+        """ Returns the product table columns in the order of __slots__ """
+        return [Product.__table__.c[name] for name in cls.__slots__]
+
+    @classmethod
+    def select(cls):
+        """ Returns a select of the columns of ProductRecords """
+        return select(cls.columns())
+
+
+class ShopcartRecord:
+    """
+    A Shopcart row and its ProductRecords read with a SQLAlchemy Core select
+
+    It has the columns and serialize() of a Shopcart.
+    """
+
+    __slots__ = ("customer_id", "version", "product_list")
+
+    def __init__(self, customer_id, version, product_list=None):
+        self.customer_id = customer_id
+        self.version = version
+        self.product_list = product_list if product_list is not None else []
+
+    serialize = Shopcart.serialize
+
+    def __repr__(self):
+        return "<ShopcartRecord for customer_id: %s>" % (self.customer_id)
+
+    @classmethod
+    def select(cls, shopcarts):
+        """ Returns a select of shopcarts (a table or subquery) outer joined to their
+        products, ordered by customer_id and product id, for group()
+        """
+        product = Product.__table__
+        return select([shopcarts.c.customer_id, shopcarts.c.version] + ProductRecord.columns()) \
+            .select_from(shopcarts.outerjoin(product, product.c.customer_id == shopcarts.c.customer_id)) \
+            .order_by(shopcarts.c.customer_id, product.c.id)
+
+    @classmethod
+    def group(cls, rows):
+        """ Yields a ShopcartRecord for each shopcart of the rows of a select() """
+        record = None
+        for row in rows:
+            if record is None or row[0] != record.customer_id:
+                if record is not None:
+                    yield record
+                record = cls(row[0], row[1])
+            # a shopcart without products has a single row of NULL product columns
+            if row[2] is not None:
+                record.product_list.append(ProductRecord(*row[2:]))
+        if record is not None:
+            yield record
+
+
+######################################################################
+#  P R E C O M P I L E D   S T A T E M E N T S
+######################################################################
+# The Core statements of the hot lookups are built once, with bindparam()
+# placeholders, and run with service.statements.execute()
+
+SHOPCART_VERSION = select([Shopcart.__table__.c.version]).where(
+    Shopcart.__table__.c.customer_id == bindparam("customer_id"))
+
+SHOPCART_EXISTS = select([exists().where(
+    Shopcart.__table__.c.customer_id == bindparam("customer_id"))])
+
+READ_SHOPCART = ShopcartRecord.select(Shopcart.__table__).where(
+    Shopcart.__table__.c.customer_id == bindparam("customer_id"))
+
+READ_PRODUCT_IN_CART = ProductRecord.select().where(and_(
+    Product.__table__.c.customer_id == bindparam("customer_id"),
+    Product.__table__.c.product_id == bindparam("product_id")))
+
+READ_WISHLISTED = ProductRecord.select().where(and_(
+    Product.__table__.c.customer_id == bindparam("customer_id"),
+    Product.__table__.c.wishlist)).order_by(Product.__table__.c.id)
+
+
+######################################################################
+#  V E R S I O N   T R A C K I N G
+######################################################################
+
+
+@event.listens_for(db.session, "after_flush")
+def bump_shopcart_versions(session, flush_context):
+    """ Bumps the version of every shopcart whose products were flushed """
+    touched = session.info.setdefault(TOUCHED_SHOPCARTS, set())
+    created = {obj.customer_id for obj in session.new if isinstance(obj, Shopcart)}
+    # a deleted shopcart has no version left to bump
+    deleted = {obj.customer_id for obj in session.deleted if isinstance(obj, Shopcart)}
+    changed = {obj.customer_id for obj in session.new | session.dirty | session.deleted
+               if isinstance(obj, Product) and obj.customer_id is not None}
+    changed -= touched | created | deleted
+    if changed:
+        table = Shopcart.__table__
+        session.connection().execute(
+            table.update().where(table.c.customer_id.in_(changed)).values(
+                version=table.c.version + 1))
+    touched |= changed | created
+
+
+@event.listens_for(db.session, "after_commit")
+@event.listens_for(db.session, "after_rollback")
+def forget_touched_shopcarts(session):
+    """ Starts tracking bumped versions afresh with the next transaction """
+    session.info.pop(TOUCHED_SHOPCARTS, None)
+
+
+@event.listens_for(db.session, "after_rollback")
+def forget_touched_versions(session):
+    """ Forgets the versions of a transaction that was rolled back """
+    session.info.pop(TOUCHED_VERSIONS, None)
+
@@ -0,0 +1,96 @@
+"""
+Observable, Fork Safe Connection Pool
+
+A QueuePool that records how long requests wait to check out a database
+connection, so the pool can be sized against the number of gunicorn
+workers and threads. The counters are per process and are served by
+GET /stats/pool.
+
+Every pool also remembers the process that opened each connection. A
+connection inherited across a fork (gunicorn --preload) is discarded on
+checkout without being closed, so the child never talks over a socket
+that the parent still uses.
+"""
+import os
+import threading
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.pool import Pool, QueuePool
+
+
+# Functions called with the seconds every checkout of a TimedQueuePool waited
+# and whether it timed out
+checkout_listeners = []
+
+
+class TimedQueuePool(QueuePool):
+    """ A QueuePool that times every connection checkout """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = self.timeouts = 0
+        self.wait_seconds = self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            for listener in checkout_listeners:
+                listener(waited, timed_out)
+
+
+def pool_stats(pool):
+    """ Returns the sizes and checkout wait times of a pool as a dictionary """
+    stats = {"class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "timeout": pool.timeout(),
+            "idle": pool.checkedin(),
+            "in_use": pool.checkedout(),
+            "overflow": pool.overflow(),
+        })
+    if isinstance(pool, TimedQueuePool):
+        with pool._stats_lock:
+            checkouts = pool.checkouts
+            stats.update({
+                "checkouts": checkouts,
+                "timeouts": pool.timeouts,
+                "wait_seconds_total": pool.wait_seconds,
+                "wait_seconds_avg": pool.wait_seconds / checkouts if checkouts else 0.0,
+                "wait_seconds_max": pool.max_wait_seconds,
+            })
+    return stats
+
+
+@event.listens_for(Pool, "connect")
+def remember_connection_pid(dbapi_connection, connection_record):
+    """ Records the process that opened a connection """
+    connection_record.info["pid"] = os.getpid()
+
+
+@event.listens_for(Pool, "checkout")
+def discard_forked_connection(dbapi_connection, connection_record, connection_proxy):
+    """ Replaces a connection that was opened by another process """
+    pid = os.getpid()
+    if connection_record.info.get("pid", pid) != pid:
+        # drop the connection without closing it, it belongs to the parent
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            "Connection record belongs to pid %s, attempting to check out in pid %s"
+            % (connection_record.info["pid"], pid)
+        )
@@ -0,0 +1,92 @@
+"""
+On-demand Request Profiling
+
+Runs a single request under cProfile when profiling is enabled
+(PROFILING_ENABLED) and the request carries the secret PROFILE_TOKEN in an
+X-Profile header:
+
+    curl -H "X-Profile: $PROFILE_TOKEN" http://localhost:5000/shopcarts/1
+
+The stats are written to PROFILE_DIR as <id>.prof (load them with pstats
+or snakeviz) and <id>.txt (the top functions by cumulative time), and the
+response names the id in an X-Profile-Id header. Every other request only
+pays for one header lookup.
+"""
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import time
+import uuid
+from service import app
+
+logger = logging.getLogger("flask.app")
+
+PROFILE_HEADER = "HTTP_X_PROFILE"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+# Functions listed in the <id>.txt summary
+SUMMARY_LINES = 40
+
+
+class ProfileOnDemand:
+    """ WSGI middleware that profiles the requests that ask for it """
+
+    def __init__(self, wsgi_app, flask_app):
+        self.wsgi_app = wsgi_app
+        self.flask_app = flask_app
+
+    def __call__(self, environ, start_response):
+        token = environ.get(PROFILE_HEADER)
+        if token is None or not self._allowed(token):
+            return self.wsgi_app(environ, start_response)
+        return self._profile(environ, start_response)
+
+    def _allowed(self, token):
+        config = self.flask_app.config
+        secret = config.get("PROFILE_TOKEN", "")
+        return (config.get("PROFILING_ENABLED", False) and bool(secret)
+                and hmac.compare_digest(token.encode(), secret.encode()))
+
+    def _profile(self, environ, start_response):
+        profile_id = "%s-%s" % (time.strftime("%Y%m%dT%H%M%S"), uuid.uuid4().hex[:12])
+
+        def start_profiled_response(status, headers, exc_info=None):
+            headers.append((PROFILE_ID_HEADER, profile_id))
+            return start_response(status, headers, exc_info)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            # read the whole body so streamed responses are profiled too
+            app_iter = self.wsgi_app(environ, start_profiled_response)
+            try:
+                body = list(app_iter)
+            finally:
+                if hasattr(app_iter, "close"):
+                    app_iter.close()
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            self._save(profiler, profile_id, environ, elapsed)
+        return body
+
+    def _save(self, profiler, profile_id, environ, elapsed):
+        directory = self.flask_app.config.get("PROFILE_DIR", "profiles")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, profile_id)
+        profiler.dump_stats(path + ".prof")
+        summary = io.StringIO()
+        summary.write("%s %s %.3fs\n\n" % (
+            environ.get("REQUEST_METHOD"), environ.get("PATH_INFO"), elapsed))
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(SUMMARY_LINES)
+        with open(path + ".txt", "w") as summary_file:
+            summary_file.write(summary.getvalue())
+        logger.info("Profiled %s %s in %.3fs as %s", environ.get("REQUEST_METHOD"),
+                    environ.get("PATH_INFO"), elapsed, path)
+
+
+app.wsgi_app = ProfileOnDemand(app.wsgi_app, app)
@@ -20,22 +20,40 @@ Shopcarts Service with Swagger
 Paths:
 ------
 GET / - Displays a UI for Selenium testing
-GET /shopcarts - Returns a list all of the Shopcarts
+GET /metrics - Returns request, database and pool metrics in the Prometheus format
+GET /debug/flamegraph - Returns the sampled stacks of the worker as collapsed stacks
+GET /debug/memory - Returns tracemalloc snapshots and identity map sizes (see memory_* below)
+GET /shopcarts - Returns a page of Shopcarts (?limit=&after=&count=)
+GET /shopcarts/export - Streams every Shopcart as newline delimited JSON
+PUT /shopcarts/{customer_id}/wishlist - Sets the wishlist flag of many products of a Shopcart
+GET /shopcarts/wishlist - Returns wishlisted products of one or (paged) all Shopcarts
 GET /shopcarts/{id} - Returns the Shopcart with a given id number
 POST /shopcarts - creates a new Shopcart record in the database
 PUT /shopcarts/{id} - updates a Shopcart record in the database
 DELETE /shopcarts/{id} - deletes a Shopcart record in the database
 DELETE /shopcarts/{id}/products/{id} - deletes a product record in the shopcart
+POST /shopcarts/{id}/products:batch - adds, updates and deletes many products at once
 """
 
 from re import escape
 import sys
+import json
 import secrets
 import logging
 from functools import wraps
-from flask import jsonify, request, url_for, make_response, render_template
-from flask_restx import Api, Resource, fields, reqparse, inputs
-from service.models import Product, Shopcart, DataValidationError, DatabaseConnectionError
+from flask import jsonify, request, url_for, make_response, render_template, stream_with_context
+from werkzeug.http import quote_etag
+from flask_restx import Api, Resource, fields, reqparse, inputs, marshal
+from flask_restx.utils import unpack
+from service.models import (Product, Shopcart, DataValidationError, DatabaseConnectionError,
+                            VersionMismatchError, db)
+from service.cache import shopcart_cache
+from service.pool import pool_stats
+from service.statements import statement_cache
+from service.instrumentation import query_budget, render_metrics
+from service.sampler import stack_sampler
+from service.memory import GROUP_BY as MEMORY_GROUP_BY, memory_tracer
+from service.encoding import ModelEncoder, enabled as fast_json_enabled
 from . import app, status    # HTTP Status Codes
 
 # Document the type of autorization required
@@ -66,6 +84,129 @@ def healthcheck():
     return make_response(jsonify(status=200, message='Healthy'), status.HTTP_200_OK)
 
 
+######################################################################
+# GET CACHE STATISTICS
+######################################################################
+@app.route('/stats/cache')
+def cache_stats():
+    """ Returns the hit, miss and eviction counters of the shopcart cache """
+    return make_response(jsonify(shopcart_cache.stats()), status.HTTP_200_OK)
+
+
+######################################################################
+# GET STATEMENT CACHE STATISTICS
+######################################################################
+@app.route('/stats/statements')
+def statement_stats():
+    """ Returns the hit and miss counters of the cache of compiled statements """
+    return make_response(jsonify(statement_cache.stats()), status.HTTP_200_OK)
+
+
+######################################################################
+# GET PROMETHEUS METRICS
+######################################################################
+@app.route('/metrics')
+def metrics():
+    """ Returns the request, database and pool metrics of all workers """
+    body, content_type = render_metrics()
+    return app.response_class(body, status=status.HTTP_200_OK, content_type=content_type)
+
+
+######################################################################
+# GET A FLAMEGRAPH OF THE SAMPLED STACKS
+######################################################################
+@app.route('/debug/flamegraph')
+def flamegraph():
+    """ Returns the recently sampled stacks of this worker as collapsed stacks """
+    if not stack_sampler.running:
+        return make_response(jsonify(status=404, message='The stack sampler is not running'),
+                             status.HTTP_404_NOT_FOUND)
+    return app.response_class(stack_sampler.collapsed(), status=status.HTTP_200_OK,
+                              content_type='text/plain; charset=utf-8')
+
+
+######################################################################
+# MEMORY DIAGNOSTICS
+######################################################################
+def memory_debug(function):
+    """ Answers 404 unless MEMORY_DEBUG_ENABLED is set """
+    @wraps(function)
+    def decorated(*args, **kwargs):
+        if not app.config.get('MEMORY_DEBUG_ENABLED'):
+            return make_response(jsonify(status=404, message='Memory diagnostics are disabled'),
+                                 status.HTTP_404_NOT_FOUND)
+        return function(*args, **kwargs)
+    return decorated
+
+
+def memory_error(code, message):
+    """ Returns a JSON error of the memory endpoints """
+    return make_response(jsonify(status=code, message=message), code)
+
+
+@app.route('/debug/memory')
+@memory_debug
+def memory_status():
+    """ Returns the tracemalloc state, RSS and identity map size of this worker """
+    return make_response(jsonify(memory_tracer.status()), status.HTTP_200_OK)
+
+
+@app.route('/debug/memory/tracemalloc', methods=['PUT', 'DELETE'])
+@memory_debug
+def memory_tracing():
+    """ Starts (PUT ?frames=N) or stops (DELETE) tracing allocations """
+    if request.method == 'DELETE':
+        memory_tracer.stop()
+    else:
+        frames = request.args.get('frames', 1, type=int)
+        if frames is None or not 1 <= frames <= 100:
+            return memory_error(status.HTTP_400_BAD_REQUEST, 'frames must be between 1 and 100')
+        memory_tracer.start(frames)
+    return make_response(jsonify(memory_tracer.status()), status.HTTP_200_OK)
+
+
+@app.route('/debug/memory/snapshots', methods=['POST'])
+@memory_debug
+def take_memory_snapshot():
+    """ Takes a tracemalloc snapshot and returns its id and top allocation sites """
+    try:
+        snapshot_id = memory_tracer.snapshot()
+    except ValueError as error:
+        return memory_error(status.HTTP_409_CONFLICT, str(error))
+    return make_response(jsonify(id=snapshot_id, top=memory_tracer.top(snapshot_id)),
+                         status.HTTP_201_CREATED)
+
+
+@app.route('/debug/memory/snapshots/<int:snapshot_id>')
+@memory_debug
+def memory_snapshot(snapshot_id):
+    """ Returns the top allocation sites of a snapshot (?limit=&group_by=&compare_to=) """
+    limit = request.args.get('limit', 20, type=int)
+    group_by = request.args.get('group_by', 'lineno')
+    compare_to = request.args.get('compare_to', type=int)
+    if limit is None or limit < 1 or group_by not in MEMORY_GROUP_BY:
+        return memory_error(status.HTTP_400_BAD_REQUEST,
+                            'limit must be positive and group_by one of ' + ', '.join(MEMORY_GROUP_BY))
+    try:
+        if compare_to is None:
+            stats = memory_tracer.top(snapshot_id, limit, group_by)
+        else:
+            stats = memory_tracer.diff(snapshot_id, compare_to, limit, group_by)
+    except KeyError as error:
+        return memory_error(status.HTTP_404_NOT_FOUND, f'Snapshot {error.args[0]} was not found')
+    return make_response(jsonify(id=snapshot_id, compare_to=compare_to, stats=stats),
+                         status.HTTP_200_OK)
+
+
+######################################################################
+# GET CONNECTION POOL STATISTICS
+######################################################################
+@app.route('/stats/pool')
+def pool_statistics():
+    """ Returns the in use and idle connections and checkout waits of the pool """
+    return make_response(jsonify(pool_stats(db.engine.pool)), status.HTTP_200_OK)
+
+
 ######################################################################
 # Configure Swagger before initializing it
 ######################################################################
@@ -99,6 +240,93 @@ shopcart_model = api.model('Shopcart', {
                                 description='The List of Product in Shopcart'),
 })
 
+batch_operation_model = api.model('BatchOperation', {
+    'op': fields.String(required=True, enum=['add', 'update', 'delete'],
+                        description='The change to make to the product'),
+    'product_id': fields.Integer(required=True, description='The product to change'),
+    'product_name': fields.String,
+    'quantity': fields.Integer,
+    'price': fields.Float,
+    'instock': fields.Boolean,
+    'wishlist': fields.Boolean,
+})
+
+batch_model = api.model('Batch', {
+    'operations': fields.List(fields.Nested(batch_operation_model), required=True,
+                              description='The operations to apply in one transaction'),
+})
+
+batch_result_model = api.model('BatchResult', {
+    'op': fields.String,
+    'product_id': fields.Integer,
+    'status': fields.Integer(description='The HTTP status of the single operation'),
+    'result': fields.String(description='created, updated, deleted, conflict or not_found'),
+})
+
+batch_response_model = api.model('BatchResponse', {
+    'customer_id': fields.Integer(description='The customer id of the shopcart'),
+    'results': fields.List(fields.Nested(batch_result_model),
+                           description='One result per operation, in order'),
+})
+
+wishlist_update_model = api.model('WishlistUpdate', {
+    'product_ids': fields.List(fields.Integer, required=True,
+                               description='The products to change'),
+    'wishlist': fields.Boolean(required=True,
+                               description='True to wishlist the products, False to clear them'),
+})
+
+# One pass encoders of the models, used instead of marshal() when FAST_JSON_ENABLED
+product_encoder = ModelEncoder(product_model)
+shopcart_encoder = ModelEncoder(shopcart_model)
+
+
+def fast_response(encoder, data, code=status.HTTP_200_OK, headers=None, many=False):
+    """ Returns data written by encoder as the JSON response flask-restx would make """
+    response = app.response_class(encoder.dumps(data, many) + b"\n", status=code,
+                                  mimetype='application/json')
+    response.headers.extend(headers or {})
+    return response
+
+
+def request_mask():
+    """ Returns the X-Fields mask of the current request, or None """
+    return request.headers.get(app.config['RESTX_MASK_HEADER'])
+
+
+def marshal_masked(data, model):
+    """ marshal() that applies the X-Fields mask of the request like api.marshal_with """
+    return marshal(data, model, mask=request_mask())
+
+
+def marshal_fast(model, encoder, as_list=False):
+    """ api.marshal_with that writes the response with encoder when fast JSON is on
+
+    The model still documents the response in Swagger and marshals it when
+    the fast path is off.
+    """
+    def decorator(function):
+        marshalled = api.marshal_with(model, as_list=as_list)(function)
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not fast_json_enabled():
+                return marshalled(*args, **kwargs)
+            data, code, headers = unpack(function(*args, **kwargs))
+            return fast_response(encoder, data, code, headers, many=as_list)
+        return wrapper
+    return decorator
+
+
+# HTTP status reported for each batch operation result
+BATCH_STATUS = {
+    'created': status.HTTP_201_CREATED,
+    'updated': status.HTTP_200_OK,
+    'deleted': status.HTTP_204_NO_CONTENT,
+    'conflict': status.HTTP_409_CONFLICT,
+    'not_found': status.HTTP_404_NOT_FOUND,
+}
+
 # shopcart_model = api.inherit(
 #     'ShopcartModel',
 #     create_model,
@@ -113,6 +341,19 @@ shopcart_model = api.model('Shopcart', {
 shopcart_args = reqparse.RequestParser()
 shopcart_args.add_argument('customer-id', type=int, required=False,
                            help='List Wishlisted Items')
+shopcart_args.add_argument('limit', type=int, location='args', required=False,
+                           help='The maximum number of products to return without customer-id')
+shopcart_args.add_argument('after', type=str, location='args', required=False,
+                           help='Only return products after this customer_id-id cursor')
+
+shopcart_list_args = reqparse.RequestParser()
+shopcart_list_args.add_argument('limit', type=int, location='args', required=False,
+                                help='The maximum number of Shopcarts to return')
+shopcart_list_args.add_argument('after', type=int, location='args', required=False,
+                                help='Only return Shopcarts after this customer id cursor')
+shopcart_list_args.add_argument('count', type=inputs.boolean, location='args',
+                                required=False, default=False,
+                                help='Return an approximate total in X-Total-Count')
 
 ######################################################################
 # Special Error Handlers
@@ -131,6 +372,18 @@ def request_validation_error(error):
     }, status.HTTP_400_BAD_REQUEST
 
 
+@api.errorhandler(VersionMismatchError)
+def version_mismatch_error(error):
+    """ Handles writes whose If-Match no longer matches the Shopcart """
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        'status_code': status.HTTP_412_PRECONDITION_FAILED,
+        'error': 'Precondition Failed',
+        'message': message
+    }, status.HTTP_412_PRECONDITION_FAILED
+
+
 @api.errorhandler(DatabaseConnectionError)
 def database_connection_error(error):
     """ Handles Database Errors from connection attempts """
@@ -177,10 +430,11 @@ class ShopcartCollection(Resource):
     # ------------------------------------------------------------------
     # CREATE A NEW SHOPCART
     # ------------------------------------------------------------------
+    @query_budget(4)
     @api.doc('create_shopcart')
     @api.response(400, 'The posted Shopcart data was not valid')
     @api.expect(shopcart_model)
-    @api.marshal_with(shopcart_model)
+    @marshal_fast(shopcart_model, shopcart_encoder)
     def post(self):
         """
         Creates a Shopcart
@@ -195,20 +449,78 @@ class ShopcartCollection(Resource):
             'Shopcart with new id [%s] created!', shopcart.customer_id)
         location_url = api.url_for(
             ShopcartResource, customer_id=shopcart.customer_id, _external=True)
-        return shopcart.serialize(), status.HTTP_201_CREATED, {'Location': location_url}
+        return shopcart, status.HTTP_201_CREATED, {'Location': location_url}
 
     # ------------------------------------------------------------------
     # LIST ALL SHOPCARTS
     # ------------------------------------------------------------------
+    @query_budget(2)
     @api.doc('list_shopcarts')
-    @api.marshal_list_with(shopcart_model)
+    @api.response(400, 'The page size was not valid')
+    @api.expect(shopcart_list_args, validate=True)
+    @marshal_fast(shopcart_model, shopcart_encoder, as_list=True)
     def get(self):
-        """ Returns all of the Shopcarts """
-        app.logger.info("Request for all shopcarts")
-        shopcarts = Shopcart.all()
+        """
+        Returns a page of Shopcarts
+
+        Shopcarts are ordered by customer_id. When more Shopcarts are available
+        a Link header with rel="next" points at the following page.
+        """
+        app.logger.info("Request for a page of shopcarts")
+        args = shopcart_list_args.parse_args()
+        limit = args['limit']
+        if limit is None:
+            limit = app.config['DEFAULT_PAGE_SIZE']
+        if not 0 < limit <= app.config['MAX_PAGE_SIZE']:
+            abort(status.HTTP_400_BAD_REQUEST,
+                  f"limit must be between 1 and {app.config['MAX_PAGE_SIZE']}")
+        # fetch one extra row to find out if there is a next page
+        shopcarts = Shopcart.read_page(after=args['after'], limit=limit + 1)
+        headers = {}
+        if len(shopcarts) > limit:
+            shopcarts = shopcarts[:limit]
+            next_url = api.url_for(ShopcartCollection, limit=limit,
+                                   after=shopcarts[-1].customer_id, _external=True)
+            headers['Link'] = f'<{next_url}>; rel="next"'
+        if args['count']:
+            headers['X-Total-Count'] = str(Shopcart.estimated_count())
         app.logger.info('[%s] Shopcarts returned', len(shopcarts))
-        results = [shopcart.serialize() for shopcart in shopcarts]
-        return results, status.HTTP_200_OK
+        return shopcarts, status.HTTP_200_OK, headers
+
+
+######################################################################
+#  PATH: /shopcarts/export
+######################################################################
+@api.route('/shopcarts/export')
+class ShopcartExport(Resource):
+    """ Streams the whole Shopcart table to downstream systems """
+
+    # ------------------------------------------------------------------
+    # EXPORT ALL SHOPCARTS
+    # ------------------------------------------------------------------
+    @api.doc('export_shopcarts')
+    @api.produces(['application/x-ndjson'])
+    @api.response(200, 'One Shopcart per line', shopcart_model)
+    def get(self):
+        """
+        Export all of the Shopcarts
+
+        This endpoint streams one JSON encoded Shopcart per line, reading the
+        table with a server-side cursor so memory use stays flat
+        """
+        app.logger.info("Request to export all shopcarts")
+        batch_size = app.config['EXPORT_BATCH_SIZE']
+        fast = fast_json_enabled()
+
+        def generate():
+            for shopcart in Shopcart.read_all(batch_size):
+                if fast:
+                    yield shopcart_encoder.dumps(shopcart) + b"\n"
+                else:
+                    yield json.dumps(marshal(shopcart, shopcart_model)) + "\n"
+
+        return app.response_class(stream_with_context(generate()),
+                                  mimetype='application/x-ndjson')
 
 
 ######################################################################
@@ -229,9 +541,10 @@ class ShopcartResource(Resource):
     # ------------------------------------------------------------------
     # RETRIEVE A Shopcart
     # ------------------------------------------------------------------
+    @query_budget(2)
     @api.doc('get_shopcart')
     @api.response(404, 'Shopcart not found')
-    @api.marshal_with(shopcart_model)
+    @api.response(200, 'Success', shopcart_model)
     def get(self, customer_id):
         """
         Retrieve a single Shopcart
@@ -240,17 +553,50 @@ class ShopcartResource(Resource):
         """
         app.logger.info(
             f"Request to Retrieve a shopcart with id {customer_id}")
-        shopcart = Shopcart.find(customer_id)
+        # the cache holds whole shopcarts, a masked response is built every time
+        masked = request_mask() is not None
+        cached = None if masked else shopcart_cache.get(customer_id)
+        if cached is not None:
+            version, body = cached
+            if is_not_modified(version):
+                return not_modified(version)
+            response = app.response_class(body, status=status.HTTP_200_OK,
+                                          mimetype='application/json')
+            response.headers.extend(etag_headers(version))
+            response.headers['X-Cache'] = 'HIT'
+            return response
+        generation = shopcart_cache.generation
+        if request.if_none_match:
+            version = Shopcart.version_of(customer_id)
+            if version is None:
+                abort(status.HTTP_404_NOT_FOUND,
+                      f"Shopcart with id {customer_id} was not found.")
+            if is_not_modified(version):
+                return not_modified(version)
+        shopcart = Shopcart.read(customer_id)
         if not shopcart:
             abort(status.HTTP_404_NOT_FOUND,
                   f"Shopcart with id {customer_id} was not found.")
-        return shopcart.serialize(), status.HTTP_200_OK
+        # the version is read with the products, so the ETag always matches the body
+        version = shopcart.version
+        if fast_json_enabled():
+            response = fast_response(shopcart_encoder, shopcart)
+        else:
+            response = api.make_response(marshal_masked(shopcart, shopcart_model),
+                                         status.HTTP_200_OK)
+        response.headers.extend(etag_headers(version))
+        if shopcart_cache.enabled and not masked:
+            shopcart_cache.set(customer_id, (version, response.get_data()), generation)
+            response.headers['X-Cache'] = 'MISS'
+        return response
 
     # ------------------------------------------------------------------
     # DELETE A SHOPCART
     # ------------------------------------------------------------------
+    @query_budget(4)
     @api.doc('delete_shopcart')
     @api.response(204, 'Shopcart deleted')
+    @api.response(412, 'The Shopcart changed since the If-Match ETag')
     def delete(self, customer_id):
         """
         Delete a Shopcart
@@ -260,10 +606,13 @@ class ShopcartResource(Resource):
         app.logger.info(
             'Request to Delete a Shopcart with id [%s]', customer_id)
         shopcart = Shopcart.find(customer_id)
-        if shopcart:
-            shopcart.delete()
+        # a shopcart deleted since find() fails an If-Match like a missing one
+        if shopcart and shopcart.delete(expected_version()):
             app.logger.info(
                 'Shopcart with customer_id [%s] was deleted', customer_id)
+        elif request.if_match:
+            abort(status.HTTP_412_PRECONDITION_FAILED,
+                  f"Shopcart with id {customer_id} does not exist.")
         return '', status.HTTP_204_NO_CONTENT
 
 ######################################################################
@@ -277,20 +626,33 @@ class ProductResource(Resource):
     # ------------------------------------------------------------------
     # GET PRODUCTS IN A SHOPCART
     # ------------------------------------------------------------------
+    @query_budget(2)
     @api.doc('get_products_list')
-    @api.marshal_list_with(product_model)
+    @api.response(404, 'Shopcart not found')
+    @api.response(200, 'Success', [product_model])
     def get(self, customer_id):
         """
         Return the product list of a shopcart 
         """
         app.logger.info("Request for product list in a shopcart")
-        shopcart = Shopcart.find(customer_id)
-        results = [product.serialize() for product in shopcart.product_list]
-        return results, status.HTTP_200_OK
+        if request.if_none_match:
+            version = Shopcart.version_of(customer_id)
+            if version is not None and is_not_modified(version):
+                return not_modified(version)
+        shopcart = Shopcart.read(customer_id)
+        if not shopcart:
+            abort(status.HTTP_404_NOT_FOUND,
+                  f"Shopcart with id {customer_id} was not found.")
+        version = shopcart.version
+        headers = etag_headers(version)
+        if fast_json_enabled():
+            return fast_response(product_encoder, shopcart.product_list, headers=headers, many=True)
+        return marshal_masked(shopcart.product_list, product_model), status.HTTP_200_OK, headers
 
     # ------------------------------------------------------------------
     # ADD A PRODUCT TO A SHOPCART
     # ------------------------------------------------------------------
+    @query_budget(4)
     @api.doc('purchase_product')
     def post(self, customer_id):
         """
@@ -314,8 +676,9 @@ class ProductResource(Resource):
                 f"instock {product.instock}\n"
                 f"wishlist {product.wishlist}\n"
             )
-            shopcart.product_list.append(product)
-            shopcart.update()
+            # add the product on its own instead of loading the whole product_list
+            product.customer_id = shopcart.customer_id
+            product.create()
         except:
             abort(status.HTTP_400_BAD_REQUEST,
                   f"Shopcart with id {customer_id} has bad input.")
@@ -333,17 +696,20 @@ class ProductCollection(Resource):
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING Shopcart
     # ------------------------------------------------------------------
+    @query_budget(5)
     @api.doc('update_shopcart')
     @api.response(404, 'Shopcart not found')
     @api.response(400, 'The posted Product data was not valid')
     @api.response(404, 'Product not found')
+    @api.response(412, 'The Shopcart changed since the If-Match ETag')
     @api.expect(product_model)
-    @api.marshal_with(product_model)
+    @marshal_fast(product_model, product_encoder)
     def put(self, customer_id, product_id):
         """
         Update a Shopcart
 
-        This endpoint will update a Shopcart based the body that is posted
+        This endpoint will add the product to the Shopcart, or update it if it
+        is already there, based the body that is posted
         """
         app.logger.info(f'Request to Update a Shopcart with id {customer_id}, product id {product_id}')
         app.logger.debug('Payload = %s', api.payload)
@@ -356,48 +722,21 @@ class ProductCollection(Resource):
         if int(data["quantity"]) <= 0:
             abort(status.HTTP_400_BAD_REQUEST,
                   f"Quantity have to be a POSITIVE INTEGER.")
-        shopcart = Shopcart.find(customer_id)
-        if not shopcart:
+        product = Product.upsert(customer_id, product_id, data, expected_version())
+        if not product:
             abort(status.HTTP_404_NOT_FOUND,
                   f"Shopcart with id {customer_id} was not found.")
-        shopcart_info = shopcart.serialize()
-        if (len(shopcart_info["product_list"]) == 0) or (
-                not any(p["product_id"] == product_id for p in shopcart_info["product_list"])):
-            try:
-                product = Product()
-                product.deserialize(data)
-                product.create()
-                shopcart.product_list.append(product)
-                shopcart.update()
-            except:
-                abort(status.HTTP_400_BAD_REQUEST,
-                  f"Shopcart with id {customer_id} has bad input.")
-            return product.serialize(), status.HTTP_200_OK
-        else:
-            for json_product in shopcart_info["product_list"]:
-                if json_product["product_id"] == product_id:
-                    try:
-                        product = Product.find(int(json_product["id"]))
-                        product.product_name = data["product_name"]
-                        product.quantity = int(data["quantity"])
-                        product.price = float(data["price"])
-                        product.instock = (data["instock"] == "true")
-                        product.wishlist = (data["wishlist"] == "true")
-                        product.update()
-                    except:
-                        abort(status.HTTP_400_BAD_REQUEST,
-                  f"Shopcart with id {customer_id} has bad input.")
-                    return product.serialize(), status.HTTP_200_OK
-        abort(status.HTTP_404_NOT_FOUND,
-              "Product with id {} not found".format(product_id))
+        # the new ETag lets the client send its next write with If-Match
+        return product, status.HTTP_200_OK, etag_headers(Shopcart.touched_version(customer_id))
 
     # ------------------------------------------------------------------
     # GET A PRODUCT IN A SHOPCART
     # ------------------------------------------------------------------
+    @query_budget(2)
     @api.doc('get_a_product')
     @api.response(404, 'Shopcart not found')
     @api.response(404, 'Product not found')
-    @api.marshal_with(product_model)
+    @api.response(200, 'Success', product_model)
     def get(self, customer_id, product_id):
         """
         Retrieve a single Product
@@ -405,25 +744,32 @@ class ProductCollection(Resource):
         This endpoint will return a product of a shopcart 
         """
         app.logger.info("Request to get a product in a shopcart")
-        shopcart = Shopcart.find(customer_id)
-        if not shopcart:
+        # a product changes only together with its shopcart version
+        version = Shopcart.version_of(customer_id)
+        if version is None:
             abort(status.HTTP_404_NOT_FOUND,
                   "shopcart with id {} not found".format(customer_id))
-        products = shopcart.product_list
-        for product in products:
-            if product.product_id == product_id:
-                return product.serialize(), status.HTTP_200_OK
-        abort(status.HTTP_404_NOT_FOUND, "can not find product with id {} in shopcart {}".format(
-            product_id, customer_id))
+        if is_not_modified(version):
+            return not_modified(version)
+        product = Product.read_in_cart(customer_id, product_id)
+        if not product:
+            abort(status.HTTP_404_NOT_FOUND, "can not find product with id {} in shopcart {}".format(
+                product_id, customer_id))
+        headers = etag_headers(version)
+        if fast_json_enabled():
+            return fast_response(product_encoder, product, headers=headers)
+        return marshal_masked(product, product_model), status.HTTP_200_OK, headers
 
     # ------------------------------------------------------------------
     # DELETE A PRODUCT IN A SHOPCART
     # ------------------------------------------------------------------
 
+    @query_budget(3)
     @api.doc('delete_a_product')
     @api.response(404, 'Shopcart not found')
     @api.response(404, 'Product not found')
     @api.response(204, 'Product deleted')
+    @api.response(412, 'The Shopcart changed since the If-Match ETag')
     def delete(self, customer_id, product_id):
         """
         Delete a product in a Shopcart
@@ -432,20 +778,63 @@ class ProductCollection(Resource):
         """
         app.logger.info(
             "Request to delete a product with product_id in a shopcart with customer_id: %s", customer_id)
-        shopcart = Shopcart.find(customer_id)
-        if shopcart:
-            products = shopcart.product_list
-            for product in products:
-                if product.product_id == product_id:
-                    product.delete()
-                    app.logger.info(
-                        'Product with product_id [%s] in the shopcart with customer_id [%s] was deleted', product_id, customer_id)
-                    return product.serialize(), status.HTTP_204_NO_CONTENT
+        product = Product.find_in_cart(customer_id, product_id)
+        if not product:
+            if not Shopcart.exists(customer_id):
+                abort(status.HTTP_404_NOT_FOUND,
+                      "shopcart with id {} not found".format(customer_id))
             abort(status.HTTP_404_NOT_FOUND, "can not find product with id {} in shopcart {}".format(
                 product_id, customer_id))
-        else:
+        if not product.delete(expected_version()):
             abort(status.HTTP_404_NOT_FOUND,
                   "shopcart with id {} not found".format(customer_id))
+        app.logger.info(
+            'Product with product_id [%s] in the shopcart with customer_id [%s] was deleted', product_id, customer_id)
+        return '', status.HTTP_204_NO_CONTENT
+
+
+######################################################################
+#  PATH: /shopcarts/{customer_id}/products:batch
+######################################################################
+@api.route('/shopcarts/<int:customer_id>/products:batch')
+@api.param('customer_id', 'The shopcart identifier')
+class ProductBatch(Resource):
+    """ Applies many product changes to a Shopcart in one transaction """
+    # ------------------------------------------------------------------
+    # ADD, UPDATE AND DELETE PRODUCTS IN A SHOPCART
+    # ------------------------------------------------------------------
+    @query_budget(6)
+    @api.doc('batch_products')
+    @api.response(400, 'The posted operations were not valid')
+    @api.response(404, 'Shopcart not found')
+    @api.expect(batch_model)
+    @api.marshal_with(batch_response_model)
+    def post(self, customer_id):
+        """
+        Change many products in a Shopcart
+
+        This endpoint validates every operation first, then applies them all
+        with bulk statements and a single commit
+        """
+        app.logger.info(f'Request to apply a batch to shopcart {customer_id}')
+        data = api.payload
+        operations = data.get('operations') if isinstance(data, dict) else None
+        if isinstance(operations, list) and len(operations) > app.config['MAX_BATCH_OPERATIONS']:
+            abort(status.HTTP_400_BAD_REQUEST,
+                  f"A batch can have at most {app.config['MAX_BATCH_OPERATIONS']} operations.")
+        parsed = Product.parse_batch(customer_id, operations)
+        results = Product.apply_batch(customer_id, parsed, expected_version())
+        if results is None:
+            abort(status.HTTP_404_NOT_FOUND,
+                  f"Shopcart with id {customer_id} was not found.")
+        return {
+            'customer_id': customer_id,
+            'results': [
+                {'op': op, 'product_id': product_id,
+                 'status': BATCH_STATUS[result], 'result': result}
+                for (op, product_id, _), result in zip(parsed, results)
+            ]
+        }, status.HTTP_200_OK
 
 
 ######################################################################
@@ -461,34 +850,65 @@ class ReverseWishlistCollection(Resource):
     # ------------------------------------------------------------------
     # REVERSE AN EXISTING product in Shopcart
     # ------------------------------------------------------------------
+    @query_budget(4)
     @api.doc('reverse_wishlist')
     @api.response(404, 'Object not found')
     @api.response(400, 'The Product is not valid for reverse')
-    @api.marshal_with(product_model)
+    @marshal_fast(product_model, product_encoder)
     def put(self, customer_id, product_id):
         """
         Reverse a product wishlist state
         """
-        app.logger.info(f'Request to Find a shopcart with id {customer_id}')
-        shopcart = Shopcart.find(customer_id)
-        if not shopcart:
-            return (f"Account with id {customer_id} was not found",
-                    status.HTTP_404_NOT_FOUND)
-        shopcart_info = shopcart.serialize()
-        if (len(shopcart_info["product_list"]) == 0) or (
-                not any(p["product_id"] == product_id for p in shopcart_info["product_list"])):
+        app.logger.info(f'Request to reverse wishlist of product {product_id} in shopcart {customer_id}')
+        product = Product.toggle_wishlist(customer_id, product_id, expected_version())
+        if not product:
+            if not Shopcart.exists(customer_id):
+                return (f"Account with id {customer_id} was not found",
+                        status.HTTP_404_NOT_FOUND)
             return (f"Product with product_id {product_id} was not found",
                     status.HTTP_404_NOT_FOUND)
-        else:
-            for json_product in shopcart_info["product_list"]:
-                if json_product["product_id"] == product_id:
-                    product = Product.find(int(json_product["id"]))
-                    product.wishlist = not product.wishlist
-                    product.update()
-                    app.logger.info(
-                        f'Product wishlist Status now {product.wishlist}')
-                    app.logger.info(product.serialize())
-                    return product, status.HTTP_200_OK
+        app.logger.info(
+            f'Product wishlist Status now {product.wishlist}')
+        return product, status.HTTP_200_OK, etag_headers(Shopcart.touched_version(customer_id))
+
+
+######################################################################
+# PATH: /shopcarts/<int:customer_id>/wishlist
+######################################################################
+
+
+@api.route('/shopcarts/<int:customer_id>/wishlist')
+@api.param('customer_id', 'The shopcart identifier')
+class ShopcartWishlist(Resource):
+    """ Sets or clears the wishlist flag of many products at once """
+    # ------------------------------------------------------------------
+    # SET THE WISHLIST FLAG OF PRODUCTS IN A SHOPCART
+    # ------------------------------------------------------------------
+    @query_budget(4)
+    @api.doc('set_wishlist')
+    @api.response(400, 'The posted data was not valid')
+    @api.response(404, 'Shopcart not found')
+    @api.expect(wishlist_update_model)
+    @marshal_fast(product_model, product_encoder, as_list=True)
+    def put(self, customer_id):
+        """
+        Set the wishlist flag of many products in a Shopcart
+
+        Every listed product is changed by a single UPDATE. Products that
+        are not in the Shopcart are left out of the response.
+        """
+        app.logger.info(f'Request to set the wishlist of products in shopcart {customer_id}')
+        data = api.payload if isinstance(api.payload, dict) else {}
+        product_ids = data.get('product_ids')
+        if isinstance(product_ids, list) and len(product_ids) > app.config['MAX_BATCH_OPERATIONS']:
+            abort(status.HTTP_400_BAD_REQUEST,
+                  f"At most {app.config['MAX_BATCH_OPERATIONS']} products can be changed at once.")
+        products = Product.set_wishlist(customer_id, product_ids, data.get('wishlist'),
+                                        expected_version())
+        if products is None:
+            abort(status.HTTP_404_NOT_FOUND,
+                  f"Shopcart with id {customer_id} was not found.")
+        return products, status.HTTP_200_OK, etag_headers(Shopcart.touched_version(customer_id))
 
 ######################################################################
 #  PATH: /shopcarts/wishlist
@@ -500,36 +920,63 @@ class WishlistResource(Resource):
     # ------------------------------------------------------------------
     # LIST ALL WISHLISTED ITEMS
     # ------------------------------------------------------------------
+    @query_budget(2)
     @api.doc('list_wishlisted_products')
-    @api.response(400, 'Missing customer id from query string')
+    @api.response(400, 'The query string was not valid')
     @api.response(404, 'Shopcart not found')
     @api.expect(shopcart_args, validate=True)
-    @api.marshal_list_with(product_model)
+    @marshal_fast(product_model, product_encoder, as_list=True)
     def get(self):
         """
         List a shopcart wishlist
+
+        Without a customer-id this pages through the wishlisted products of
+        every shopcart, with a Link header with rel="next" for the next page
         """
         customer_id = request.args.get('customer-id', None)
-        if not customer_id:
-            abort(
-                status.HTTP_400_BAD_REQUEST,
-                "Missing customer id from query string"
-            )
-        shopcart = Shopcart.find(customer_id)
-        if not shopcart:
+        if customer_id is None:
+            return self._list_all_wishlisted()
+        try:
+            customer_id = int(customer_id)
+        except ValueError:
+            abort(status.HTTP_400_BAD_REQUEST, "customer-id must be an integer")
+        wishlisted_items = Product.read_wishlisted(customer_id)
+        if not wishlisted_items and not Shopcart.exists(customer_id):
             abort(
                 status.HTTP_404_NOT_FOUND,
-                "shopcart with id {customer_id} not found",
+                f"shopcart with id {customer_id} not found",
             )
-        products = [product.serialize() for product in shopcart.product_list]
-        wishlisted_items = []
-        
-        for product in products:
-            if product['wishlist'] == 'true':
-                wishlisted_items.append(product)
-        app.logger.info(f"Request for cart {customer_id} to return Wishlisted Items: {wishlisted_items}")
+        app.logger.info(f"Request for cart {customer_id} returned {len(wishlisted_items)} Wishlisted Items")
         return wishlisted_items, status.HTTP_200_OK
 
+    @staticmethod
+    def _list_all_wishlisted():
+        """ Returns a page of the wishlisted products of all shopcarts """
+        limit = request.args.get('limit', app.config['DEFAULT_PAGE_SIZE'])
+        after = request.args.get('after', None)
+        try:
+            limit = int(limit)
+            if after is not None:
+                after = tuple(int(part) for part in after.split('-'))
+                if len(after) != 2:
+                    raise ValueError(after)
+        except ValueError:
+            abort(status.HTTP_400_BAD_REQUEST,
+                  "limit must be an integer and after a customer_id-id cursor")
+        if not 0 < limit <= app.config['MAX_PAGE_SIZE']:
+            abort(status.HTTP_400_BAD_REQUEST,
+                  f"limit must be between 1 and {app.config['MAX_PAGE_SIZE']}")
+        # fetch one extra row to find out if there is a next page
+        products = Product.read_wishlisted_page(after=after, limit=limit + 1)
+        headers = {}
+        if len(products) > limit:
+            products = products[:limit]
+            cursor = f"{products[-1].customer_id}-{products[-1].id}"
+            next_url = api.url_for(WishlistResource, limit=limit, after=cursor, _external=True)
+            headers['Link'] = f'<{next_url}>; rel="next"'
+        app.logger.info(f"Request for all wishlists returned {len(products)} Wishlisted Items")
+        return products, status.HTTP_200_OK, headers
+
 
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
@@ -540,6 +987,38 @@ def abort(error_code: int, message: str):
     api.abort(error_code, message)
 
 
+def expected_version():
+    """Returns the Shopcart version required by an If-Match header, or None"""
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    tags = request.if_match.as_set()
+    if len(tags) != 1 or not next(iter(tags)).isdigit():
+        abort(status.HTTP_412_PRECONDITION_FAILED,
+              "If-Match must be a single ETag returned by this service")
+    return int(next(iter(tags)))
+
+
+def is_not_modified(version):
+    """Returns True if the If-None-Match header matches the Shopcart version"""
+    return request.if_none_match.contains_weak(str(version))
+
+
+def not_modified(version):
+    """Returns an empty 304 Not Modified response for the Shopcart version"""
+    response = app.response_class(status=status.HTTP_304_NOT_MODIFIED)
+    response.headers.extend(etag_headers(version))
+    return response
+
+
+def etag_headers(version):
+    """Returns the ETag header of a Shopcart version
+
+    A body masked by X-Fields has the same version as the full one, so the
+    response varies with that header.
+    """
+    return {'ETag': quote_etag(str(version)), 'Vary': app.config['RESTX_MASK_HEADER']}
+
+
 @ app.before_first_request
 def init_db():
     """ Initlaize the model """
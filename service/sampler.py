@@ -0,0 +1,135 @@
+"""
+Sampling Profiler
+
+A background thread that samples the stacks of every thread of the process
+SAMPLER_HZ times a second with sys._current_frames() and counts them as
+collapsed stacks ("outer;...;inner count"), the input format of
+flamegraph.pl and speedscope. Samples are kept in slices so that
+GET /debug/flamegraph serves a rolling window of the last SAMPLER_WINDOW
+seconds. Threads that are idle (waiting on a lock, a queue or a socket)
+are left out.
+
+Each gunicorn worker samples itself: the thread is restarted in every
+forked child, since threads do not survive a fork.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+# Seconds of samples kept together, the window moves in these steps
+SLICE_SECONDS = 5
+
+# (file, function) of the frames threads block in while they have nothing to do
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("socket.py", "accept"),
+    ("socketserver.py", "serve_forever"),
+    ("queue.py", "get"),
+}
+
+
+class StackSampler:
+    """ Samples the stacks of all threads into a rolling window of collapsed stacks """
+
+    def __init__(self, hz=100, window=300):
+        self.hz = hz
+        self.window = window
+        self._lock = threading.Lock()
+        self._slices = deque()
+        self._thread = None
+        self._stop = threading.Event()
+        self.samples = 0
+
+    @property
+    def running(self):
+        """ True while the sampling thread is alive """
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, hz=None, window=None):
+        """ Starts sampling in a daemon thread """
+        if hz is not None:
+            self.hz = hz
+        if window is not None:
+            self.window = window
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stops sampling and waits for the thread to end """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def restart_after_fork(self):
+        """ Drops the samples of the parent and samples the child instead """
+        if self._thread is None:
+            return
+        self._lock = threading.Lock()
+        self._slices = deque()
+        self._thread = None
+        self.samples = 0
+        self.start()
+
+    def _run(self):
+        interval = 1.0 / self.hz
+        own_id = threading.get_ident()
+        while not self._stop.wait(interval):
+            self.sample(ignore=own_id)
+
+    def sample(self, ignore=None):
+        """ Adds one sample of every thread but ignore to the current slice """
+        stacks = [collapse(frame) for thread_id, frame in sys._current_frames().items()
+                  if thread_id != ignore and not is_idle(frame)]
+        now = time.monotonic()
+        with self._lock:
+            if not self._slices or self._slices[-1][0] <= now - SLICE_SECONDS:
+                self._slices.append((now, Counter()))
+            counts = self._slices[-1][1]
+            for stack in stacks:
+                counts[stack] += 1
+            self.samples += 1
+            while self._slices and self._slices[0][0] < now - self.window:
+                self._slices.popleft()
+
+    def collapsed(self):
+        """ Returns the stacks of the window as collapsed stack lines, most frequent first """
+        total = Counter()
+        cutoff = time.monotonic() - self.window
+        with self._lock:
+            for started, counts in self._slices:
+                if started >= cutoff:
+                    total.update(counts)
+        return "".join("%s %d\n" % (stack, count) for stack, count in total.most_common())
+
+
+def frame_name(frame):
+    """ Returns the flamegraph label of a frame """
+    code = frame.f_code
+    return "%s:%s" % (os.path.basename(code.co_filename), code.co_name)
+
+
+def is_idle(frame):
+    """ Returns True if the innermost frame of a thread is waiting for work """
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+def collapse(frame):
+    """ Returns the stack of a frame from the outermost call, joined with ; """
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+# The sampler of this process, started by create_app when SAMPLER_ENABLED
+stack_sampler = StackSampler()
+os.register_at_fork(after_in_child=stack_sampler.restart_after_fork)
@@ -0,0 +1,87 @@
+"""
+Statement Cache
+
+On SQLAlchemy 1.3 every call of a lookup builds its Query again and
+compiles it to SQL again, although only the parameters change. The hot
+lookups skip both steps:
+
+- ORM lookups are baked queries (sqlalchemy.ext.baked) made with bakery:
+  each Query is built once, and it and its compiled SQL are kept here.
+- Core statements are built once, with bindparam() placeholders, and run
+  with execute(), which uses this cache as the compiled_cache of the
+  connection, so each one is compiled once per dialect.
+
+The cache counts its hits and misses (GET /stats/statements). They are per
+process, and a warmed up worker should see nothing but hits.
+"""
+import threading
+from collections import OrderedDict
+from sqlalchemy.ext.baked import BakedQuery, Bakery
+
+
+class StatementCache:
+    """ A thread safe LRU cache of built queries and compiled statements
+
+    It has the get() and item assignment that SQLAlchemy expects of a
+    bakery cache and of a compiled_cache.
+    """
+
+    def __init__(self, maxsize=200):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.maxsize = maxsize
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        """ Returns the cached value for key, or default """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """ Removes every entry and resets the counters """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """ Returns the cache counters as a dictionary """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Built queries and compiled statements of the hot lookups
+statement_cache = StatementCache()
+
+# Makes the baked queries of the models, e.g. bakery(lambda session: session.query(Shopcart))
+bakery = Bakery(BakedQuery, statement_cache)
+
+
+def execute(session, statement, **params):
+    """ Executes a Core statement built once, compiling it at most once """
+    connection = session.connection().execution_options(compiled_cache=statement_cache)
+    return connection.execute(statement, params)
@@ -0,0 +1,90 @@
+"""
+Worker Warm-up
+
+Moves the work that would otherwise slow down the first requests of a new
+gunicorn worker to worker start: running the before_first_request hooks,
+building the Swagger schema, opening the pooled connections and running
+each hot query once so the mappers are configured and the statements have
+been compiled and executed against the database.
+
+With preload_app the gunicorn master runs prepare() and freeze() before it
+forks, and every worker runs warm_up() in post_worker_init (see
+gunicorn.conf.py).
+"""
+import gc
+import logging
+import time
+from service.models import db, Product, Shopcart
+from service.statements import statement_cache
+
+logger = logging.getLogger("flask.app")
+
+# Read only queries of the request handlers, run with ids that do not exist
+HOT_QUERIES = (
+    lambda: Shopcart.find(0),
+    lambda: Shopcart.read(0),
+    lambda: Shopcart.exists(0),
+    lambda: Shopcart.version_of(0),
+    lambda: Shopcart.read_page(limit=1),
+    lambda: Shopcart.estimated_count(),
+    lambda: Product.find_in_cart(0, 0),
+    lambda: Product.read_in_cart(0, 0),
+    lambda: Product.read_wishlisted(0),
+    lambda: Product.read_wishlisted_page(limit=1),
+)
+
+
+def prepare(app):
+    """ Runs the warm-up steps that do not keep a database connection open """
+    from service.routes import api    # pylint: disable=import-outside-toplevel
+    app.try_trigger_before_first_request_functions()
+    with app.test_request_context():
+        api.__schema__  # pylint: disable=pointless-statement
+
+
+def open_connections(count):
+    """ Opens up to count pooled connections at once and returns them to the pool """
+    pool = db.engine.pool
+    if hasattr(pool, "size"):
+        count = min(count, pool.size())
+    connections = []
+    try:
+        for _ in range(count):
+            connection = db.engine.connect()
+            connections.append(connection)
+            connection.execute("SELECT 1")
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+
+def warm_up(app):
+    """ Warms up a worker and returns what was done as a dictionary """
+    started = time.perf_counter()
+    prepare(app)
+    with app.app_context():
+        connections = open_connections(app.config.get("WARMUP_CONNECTIONS", 1))
+        for query in HOT_QUERIES:
+            query()
+        db.session.remove()
+    stats = {
+        "connections": connections,
+        "queries": len(HOT_QUERIES),
+        "statements": len(statement_cache),
+        "seconds": time.perf_counter() - started,
+    }
+    logger.info("Warmed up with %(connections)s connections and %(queries)s queries"
+                " in %(seconds).3fs", stats)
+    return stats
+
+
+def freeze():
+    """ Moves every object alive now out of the reach of the garbage collector
+
+    Called in the gunicorn master just before it forks, so the workers do
+    not touch (and copy) the pages of those objects when they collect.
+    """
+    gc.collect()
+    gc.freeze()
+    logger.info("Froze %s objects before forking", gc.get_freeze_count())
@@ -0,0 +1,81 @@
+"""
+Test cases for the Response Cache
+
+"""
+import unittest
+from unittest.mock import patch
+from service.cache import ResponseCache
+
+######################################################################
+#  R E S P O N S E   C A C H E   T E S T   C A S E S
+######################################################################
+
+
+class TestResponseCache(unittest.TestCase):
+    """ Test Cases for ResponseCache """
+
+    def setUp(self):
+        self.cache = ResponseCache(maxsize=2, ttl=10, enabled=True)
+
+    def test_get_and_set(self):
+        """Cache a value and read it back"""
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(1, b"one")
+        self.assertEqual(self.cache.get(1), b"one")
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_disabled(self):
+        """A disabled cache stores nothing"""
+        cache = ResponseCache()
+        cache.set(1, b"one")
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats()["misses"], 0)
+
+    def test_lru_eviction(self):
+        """The least recently used entry is evicted first"""
+        self.cache.set(1, b"one")
+        self.cache.set(2, b"two")
+        self.cache.get(1)
+        self.cache.set(3, b"three")
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(self.cache.get(1), b"one")
+        self.assertEqual(self.cache.get(3), b"three")
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_ttl_expiry(self):
+        """Entries expire after the TTL"""
+        with patch("service.cache.time.monotonic", return_value=100.0):
+            self.cache.set(1, b"one")
+        with patch("service.cache.time.monotonic", return_value=109.0):
+            self.assertEqual(self.cache.get(1), b"one")
+        with patch("service.cache.time.monotonic", return_value=111.0):
+            self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+
+    def test_invalidate(self):
+        """Invalidation drops the entry and stale writes"""
+        self.cache.set(1, b"one")
+        generation = self.cache.generation
+        self.cache.invalidate(1)
+        self.assertIsNone(self.cache.get(1))
+        # a value read before the invalidation is not stored
+        self.cache.set(1, b"stale", generation)
+        self.assertIsNone(self.cache.get(1))
+        self.cache.set(1, b"fresh", self.cache.generation)
+        self.assertEqual(self.cache.get(1), b"fresh")
+        self.cache.clear()
+        self.assertEqual(self.cache.stats()["size"], 0)
+        self.assertEqual(self.cache.stats()["invalidations"], 2)
+
+    def test_configure(self):
+        """Configuring the cache drops the entries and resets the counters"""
+        self.cache.set(1, b"one")
+        self.cache.get(1)
+        self.cache.get(2)
+        self.cache.configure(ttl=5)
+        self.assertIsNone(self.cache.get(1))
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["ttl"]), (0, 1, 5))
@@ -0,0 +1,113 @@
+"""
+Test cases for the one pass JSON encoder
+
+"""
+import json
+import unittest
+from unittest.mock import Mock, patch
+from flask_restx import Model, fields, marshal
+from service import app, encoding
+from service.encoding import ModelEncoder, check_backend
+from service.models import Product, Shopcart
+from service.routes import product_model, shopcart_model
+
+EVERYTHING = Model("Everything", {
+    "count": fields.Integer,
+    "ratio": fields.Float(description="a float"),
+    "name": fields.String,
+    "flag": fields.Boolean,
+    "tags": fields.List(fields.String),
+    "child": fields.Nested(product_model),
+    "optional": fields.Nested(product_model, allow_null=True),
+    "children": fields.List(fields.Nested(product_model)),
+    "renamed": fields.Integer(attribute="count"),
+})
+
+######################################################################
+#  E N C O D I N G   T E S T   C A S E S
+######################################################################
+
+
+class TestEncoding(unittest.TestCase):
+    """ Test Cases for ModelEncoder """
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def assertEncodesLikeMarshal(self, model, obj, many=False):
+        """ Checks that the encoder writes what json.dumps(marshal()) does """
+        expected = json.dumps(marshal(obj, model))
+        self.assertEqual(ModelEncoder(model).encode(obj, many), expected)
+        self.assertEqual(ModelEncoder(model).convert(obj) if not many else
+                         [ModelEncoder(model).convert(item) for item in obj],
+                         json.loads(expected))
+
+    def test_orm_rows(self):
+        """Encode ORM rows like marshal() and json.dumps()"""
+        products = [Product(customer_id=1, product_id=n, product_name="café \"%d\"\n" % n,
+                            quantity=n, price=n / 3, instock=bool(n % 2), wishlist=False)
+                    for n in range(3)]
+        shopcart = Shopcart(customer_id=1, product_list=products)
+        self.assertEncodesLikeMarshal(shopcart_model, shopcart)
+        self.assertEncodesLikeMarshal(product_model, products, many=True)
+        self.assertEncodesLikeMarshal(shopcart_model, Shopcart(customer_id=2))
+        self.assertEncodesLikeMarshal(product_model, Product())
+
+    def test_dictionaries(self):
+        """Encode dictionaries, serialize() output and missing keys included"""
+        product = Product(customer_id=1, product_id=2, product_name="apple", quantity=3,
+                          price=1.5, instock=True, wishlist=False)
+        self.assertEncodesLikeMarshal(product_model, product.serialize())
+        self.assertEncodesLikeMarshal(EVERYTHING, {
+            "count": 7, "ratio": 2, "name": 12, "flag": "false", "tags": ["a", None, "☃"],
+            "child": None, "optional": None, "children": [product.serialize(), None],
+        })
+        self.assertEncodesLikeMarshal(EVERYTHING, {"child": {"price": "3.25"}, "children": None})
+        self.assertEncodesLikeMarshal(EVERYTHING, {})
+        self.assertEncodesLikeMarshal(EVERYTHING, None)
+
+    def test_floats(self):
+        """Encode floats, NaN and infinities like json.dumps"""
+        for price in (0.1, 1e300, -2.5e-8, float("nan"), float("inf"), float("-inf")):
+            self.assertEqual(ModelEncoder(product_model).encode({"price": price}),
+                             json.dumps(marshal({"price": price}, product_model)))
+
+    def test_unsupported_fields(self):
+        """Refuse to compile fields it cannot encode like marshal()"""
+        for field in (fields.Raw, fields.Integer(default=1), fields.DateTime):
+            self.assertRaises(TypeError, ModelEncoder, Model("Bad", {"field": field}))
+
+    def test_dumps(self):
+        """Return bytes with the configured backend"""
+        product = Product(customer_id=1, product_id=2, product_name="é", quantity=3,
+                          price=1.5, instock=True, wishlist=True)
+        encoder = ModelEncoder(product_model)
+        self.assertEqual(encoder.dumps(product), encoder.encode(product).encode())
+        fake_orjson = Mock(dumps=lambda data: json.dumps(data).encode())
+        with patch.object(encoding, "orjson", fake_orjson), \
+                patch.dict(app.config, {"JSON_BACKEND": "orjson"}):
+            self.assertEqual(json.loads(encoder.dumps([product], many=True)),
+                             [marshal(product, product_model)])
+
+    @unittest.skipIf(encoding.orjson is None, "orjson is not installed")
+    def test_orjson(self):
+        """Encode the same values with orjson"""
+        product = Product(customer_id=1, product_id=2, product_name="é", quantity=3,
+                          price=1.5, instock=True, wishlist=True)
+        with patch.dict(app.config, {"JSON_BACKEND": "orjson"}):
+            data = ModelEncoder(product_model).dumps(product)
+        self.assertEqual(json.loads(data), marshal(product, product_model))
+
+    def test_check_backend(self):
+        """Warn about a JSON backend that cannot be used"""
+        with patch.dict(app.config, {"JSON_BACKEND": "simplejson"}), \
+                self.assertLogs("flask.app", "WARNING"):
+            check_backend(app)
+        with patch.object(encoding, "orjson", None), \
+                patch.dict(app.config, {"JSON_BACKEND": "orjson"}), \
+                self.assertLogs("flask.app", "WARNING"):
+            check_backend(app)
@@ -0,0 +1,70 @@
+"""
+Test cases for the gunicorn configuration
+
+"""
+import os
+import runpy
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG = os.path.join(ROOT, "gunicorn.conf.py")
+
+# Loads the config and then preloads the app, in the order of the gunicorn master
+MASTER = """
+import runpy, sys
+runpy.run_path(sys.argv[1])
+import service
+"""
+
+######################################################################
+#  G U N I C O R N   C O N F I G U R A T I O N   T E S T   C A S E S
+######################################################################
+
+
+class TestGunicornConfig(unittest.TestCase):
+    """ Test Cases for gunicorn.conf.py """
+
+    def test_workers_and_threads(self):
+        """Run N workers with M threads each from the environment"""
+        with patch.dict(os.environ, {"WEB_CONCURRENCY": "4", "GUNICORN_THREADS": "8",
+                                     "PORT": "8080"}):
+            config = runpy.run_path(CONFIG)
+        self.assertEqual(config["workers"], 4)
+        self.assertEqual(config["threads"], 8)
+        self.assertEqual(config["worker_class"], "gthread")
+        self.assertEqual(config["bind"], "0.0.0.0:8080")
+        self.assertTrue(config["preload_app"])
+
+    def test_single_threaded(self):
+        """Use sync workers without threads"""
+        with patch.dict(os.environ, {"GUNICORN_THREADS": "1", "GUNICORN_PRELOAD": "false"}):
+            config = runpy.run_path(CONFIG)
+        self.assertEqual(config["worker_class"], "sync")
+        self.assertFalse(config["preload_app"])
+        self.assertGreaterEqual(config["workers"], 1)
+
+    def test_worker_warm_up(self):
+        """Warm up every worker when enabled"""
+        with patch.dict(os.environ):
+            config = runpy.run_path(CONFIG)
+        from service import app
+        with patch("service.warmup.warm_up") as warm_up, \
+                patch.dict(app.config, {"WARMUP_ENABLED": True}):
+            config["post_worker_init"](None)
+        warm_up.assert_called_once_with(app)
+        with patch("service.warmup.warm_up") as warm_up:
+            config["post_worker_init"](None)
+        warm_up.assert_not_called()
+
+    def test_preload_on_a_fresh_host(self):
+        """Create the metrics directory before the preloaded app opens it"""
+        with tempfile.TemporaryDirectory() as directory:
+            metrics = os.path.join(directory, "metrics")
+            env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=metrics)
+            subprocess.run([sys.executable, "-c", MASTER, CONFIG], env=env, check=True,
+                           capture_output=True, cwd=ROOT)
+            self.assertTrue(os.listdir(metrics))
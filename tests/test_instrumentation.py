@@ -0,0 +1,90 @@
+"""
+Test cases for the request and database instrumentation
+
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+from flask import g
+from service import app
+from service.instrumentation import (OTHER_METHOD, POOL_WAIT_SECONDS, UNMATCHED,
+                                     QueryBudgetExceeded, handler_name, method_label,
+                                     query_budget, record_checkout, record_query)
+
+# Increments a request counter in a process that shares the metrics directory
+WORKER = """
+from service.instrumentation import REQUESTS, render_metrics
+REQUESTS.labels("ShopcartCollection.get", "GET", 200).inc()
+print(render_metrics()[0].decode())
+"""
+
+######################################################################
+#  I N S T R U M E N T A T I O N   T E S T   C A S E S
+######################################################################
+
+
+class TestInstrumentation(unittest.TestCase):
+    """ Test Cases for the Prometheus instrumentation """
+
+    def test_handler_names(self):
+        """Label requests by flask-restx resource and method"""
+        self.assertEqual(handler_name("shopcart_collection", "GET"), "ShopcartCollection.get")
+        self.assertEqual(handler_name("product_batch", "POST"), "ProductBatch.post")
+        self.assertEqual(handler_name("health_check", "GET"), "health_check")
+        self.assertEqual(handler_name(None, "GET"), UNMATCHED)
+        self.assertEqual(method_label("DELETE"), "DELETE")
+        self.assertEqual(method_label("BREW"), OTHER_METHOD)
+
+    def test_record_checkout(self):
+        """Observe the wait of pooled connection checkouts"""
+        before = POOL_WAIT_SECONDS._sum.get()
+        record_checkout(0.5, False)
+        self.assertAlmostEqual(POOL_WAIT_SECONDS._sum.get() - before, 0.5)
+
+    def test_query_budget(self):
+        """Raise in tests and warn in production when a handler goes over budget"""
+        @query_budget(1)
+        def handler(queries):
+            g.metrics_queries += queries
+            return queries
+
+        with app.test_request_context():
+            g.metrics_queries = 0
+            with patch.dict(app.config, {"TESTING": True}):
+                self.assertEqual(handler(1), 1)
+                self.assertRaises(QueryBudgetExceeded, handler, 2)
+            with patch.dict(app.config, {"TESTING": False}), \
+                    self.assertLogs("flask.app", level="WARNING") as logs:
+                self.assertEqual(handler(3), 3)
+        self.assertIn("ran 3 SQL statements, its budget is 1", logs.output[0])
+
+    def test_slow_query_handler(self):
+        """Name the handler of a slow query with the bounded method label"""
+        with app.test_request_context("/shopcarts", method="BREW"), \
+                patch.dict(app.config, {"SLOW_QUERY_SECONDS": 0}), \
+                patch("service.instrumentation.handler_name", return_value="h") as name, \
+                self.assertLogs("flask.app", level="WARNING") as logs:
+            g.metrics_queries = g.metrics_query_seconds = 0
+            record_query(None, None, "SELECT 1", (), SimpleNamespace(metrics_started=0), False)
+            self.assertEqual(g.metrics_queries, 1)
+        name.assert_called_once_with(None, OTHER_METHOD)
+        self.assertIn("Slow query", logs.output[0])
+
+    def test_metrics_across_workers(self):
+        """Add up the metrics that several worker processes wrote"""
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory)
+            outputs = [
+                subprocess.run([sys.executable, "-c", WORKER], env=env, check=True,
+                               capture_output=True, text=True,
+                               cwd=os.path.dirname(app.root_path)).stdout
+                for _ in range(2)
+            ]
+        sample = ('shopcarts_http_requests_total{handler="ShopcartCollection.get",'
+                  'method="GET",status="200"}')
+        self.assertIn(sample + " 1.0", outputs[0])
+        self.assertIn(sample + " 2.0", outputs[1])
@@ -0,0 +1,81 @@
+"""
+Test cases for the memory diagnostics
+
+"""
+import unittest
+from unittest.mock import patch
+from service import app, status
+from service.memory import MemoryTracer, memory_tracer
+
+######################################################################
+#  M E M O R Y   D I A G N O S T I C S   T E S T   C A S E S
+######################################################################
+
+
+class TestMemoryTracer(unittest.TestCase):
+    """ Test Cases for MemoryTracer and /debug/memory """
+
+    def setUp(self):
+        self.config = patch.dict(app.config, {"MEMORY_DEBUG_ENABLED": True})
+        self.config.start()
+        self.app = app.test_client()
+
+    def tearDown(self):
+        memory_tracer.stop()
+        self.config.stop()
+
+    def test_snapshots(self):
+        """Compare two snapshots to find where memory went"""
+        tracer = MemoryTracer()
+        self.assertRaises(ValueError, tracer.snapshot)
+        tracer.start()
+        try:
+            first = tracer.snapshot()
+            kept = [bytearray(1000) for _ in range(100)]
+            second = tracer.snapshot()
+            growth = tracer.diff(second, first, limit=1)
+            self.assertIn("test_memory.py", growth[0]["site"])
+            self.assertGreaterEqual(growth[0]["size_diff"], 100 * 1000)
+            self.assertIn("test_memory.py", tracer.top(second, limit=1)[0]["site"])
+            self.assertRaises(KeyError, tracer.top, 99)
+            self.assertEqual(tracer.snapshot_ids(), [first, second])
+        finally:
+            tracer.stop()
+        self.assertEqual(len(kept), 100)
+        self.assertEqual(tracer.snapshot_ids(), [])
+
+    def test_memory_endpoints(self):
+        """Trace allocations through /debug/memory"""
+        resp = self.app.get("/debug/memory")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertFalse(resp.get_json()["tracing"])
+        self.assertIn("identity_map_objects", resp.get_json())
+        resp = self.app.post("/debug/memory/snapshots")
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+        resp = self.app.put("/debug/memory/tracemalloc?frames=5")
+        self.assertTrue(resp.get_json()["tracing"])
+        first = self.app.post("/debug/memory/snapshots").get_json()["id"]
+        resp = self.app.post("/debug/memory/snapshots")
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        second = resp.get_json()["id"]
+        resp = self.app.get(f"/debug/memory/snapshots/{second}?compare_to={first}&limit=5")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertLessEqual(len(resp.get_json()["stats"]), 5)
+        self.assertIn("size_diff", resp.get_json()["stats"][0])
+        resp = self.app.get(f"/debug/memory/snapshots/{second}?group_by=traceback")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get(f"/debug/memory/snapshots/{second}?group_by=module")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get("/debug/memory/snapshots/999")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        resp = self.app.delete("/debug/memory/tracemalloc")
+        self.assertFalse(resp.get_json()["tracing"])
+        self.assertEqual(resp.get_json()["snapshots"], [])
+
+    def test_disabled(self):
+        """Hide the memory endpoints unless enabled"""
+        with patch.dict(app.config, {"MEMORY_DEBUG_ENABLED": False}):
+            resp = self.app.get("/debug/memory")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
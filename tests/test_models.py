@@ -3,9 +3,14 @@ Test cases for Shopcart Model
 
 """
 import logging
+import threading
 import unittest
 import os
-from service.models import Shopcart, Product, DataValidationError, db
+from unittest.mock import MagicMock, patch
+from flask import has_app_context
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from service.models import Shopcart, Product, DataValidationError, VersionMismatchError, db
 from service import app
 from .factories import ShopcartFactory, ProductFactory
 
@@ -35,6 +40,8 @@ class TestShopcartModel(unittest.TestCase):
         pass
 
     def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
         db.drop_all()  # clean up the last tests
         db.create_all()  # make our sqlalchemy tables
 
@@ -42,6 +49,7 @@ class TestShopcartModel(unittest.TestCase):
         """ This runs after each test """
         db.session.remove()
         db.drop_all()
+        self.context.pop()
 
     ######################################################################
     #  T E S T   C A S E S
@@ -128,3 +136,279 @@ class TestShopcartModel(unittest.TestCase):
         self.assertEqual(shopcart.customer_id, 1)
         shopcarts = Shopcart.all()
         self.assertEqual(len(shopcarts), 1)
+
+    def test_page_shopcarts(self):
+        """Page through shopcarts with a keyset cursor"""
+        for _ in range(5):
+            Shopcart().create()
+        first = Shopcart.read_page(limit=2)
+        self.assertEqual([s.customer_id for s in first], [1, 2])
+        rest = Shopcart.read_page(after=first[-1].customer_id, limit=10)
+        self.assertEqual([s.customer_id for s in rest], [3, 4, 5])
+        self.assertEqual(Shopcart.read_page(after=5, limit=10), [])
+        self.assertEqual(Shopcart.estimated_count(), 5)
+
+    def test_estimated_count_of_unanalyzed_table(self):
+        """Count the shopcarts when PostgreSQL has no estimate yet"""
+        for _ in range(3):
+            Shopcart().create()
+        with patch.object(db.engine.dialect, "name", "postgresql"):
+            for reltuples, expected in ((0, 3), (-1, 3), (None, 3), (1000, 1000)):
+                with patch.object(db.session, "execute",
+                                  return_value=MagicMock(scalar=lambda: reltuples)):
+                    self.assertEqual(Shopcart.estimated_count(), expected)
+
+    def _create_shopcarts_with_products(self, count, products):
+        """Create count shopcarts holding a number of products each"""
+        for _ in range(count):
+            shopcart = Shopcart()
+            shopcart.create()
+            for _ in range(products):
+                product = ProductFactory(id=None)
+                shopcart.product_list.append(product)
+            shopcart.update()
+        db.session.expire_all()
+
+    def _count_queries(self, function):
+        """Returns the result of function and the number of statements it ran"""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            result = function()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        return result, len(statements)
+
+    def test_list_shopcarts_query_count(self):
+        """Listing shopcarts runs a constant number of queries"""
+        self._create_shopcarts_with_products(5, 3)
+        for limit in (2, 10):
+            results, queries = self._count_queries(
+                lambda: [s.serialize() for s in Shopcart.read_page(limit=limit)])
+            self.assertEqual(len(results), min(limit, 5))
+            self.assertTrue(all(len(s["product_list"]) == 3 for s in results))
+            self.assertEqual(queries, 1)
+
+    def test_all_shopcarts_query_count(self):
+        """Load all shopcarts and their products in a constant number of queries"""
+        self._create_shopcarts_with_products(5, 3)
+        db.session.expire_all()
+        results, queries = self._count_queries(
+            lambda: [s.serialize() for s in Shopcart.all()])
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(len(s["product_list"]) == 3 for s in results))
+        self.assertEqual(queries, 2)
+
+    def test_find_product_in_shopcart(self):
+        """Find a product by customer_id and product_id"""
+        shopcart = Shopcart()
+        shopcart.create()
+        for product_id in (7, 8):
+            shopcart.product_list.append(ProductFactory(id=None, product_id=product_id))
+        shopcart.update()
+        product = Product.find_in_cart(shopcart.customer_id, 8)
+        self.assertIsNotNone(product)
+        self.assertEqual(product.product_id, 8)
+        self.assertEqual(product.customer_id, shopcart.customer_id)
+        self.assertIsNone(Product.find_in_cart(shopcart.customer_id, 9))
+        self.assertIsNone(Product.find_in_cart(shopcart.customer_id + 1, 8))
+        self.assertTrue(Shopcart.exists(shopcart.customer_id))
+        self.assertFalse(Shopcart.exists(shopcart.customer_id + 1))
+
+    def test_product_unique_in_shopcart(self):
+        """A product can only be added to a shopcart once"""
+        shopcart = Shopcart()
+        shopcart.create()
+        shopcart.product_list.append(ProductFactory(id=None, product_id=7))
+        shopcart.update()
+        duplicate = ProductFactory(id=None, product_id=7, customer_id=shopcart.customer_id)
+        self.assertRaises(IntegrityError, duplicate.create)
+        # the failed commit was rolled back and the session is usable again
+        self.assertEqual(len(Shopcart.find(shopcart.customer_id).product_list), 1)
+
+    def test_upsert_product(self):
+        """Upsert adds a product and then updates the same row"""
+        shopcart = Shopcart()
+        shopcart.create()
+        data = ProductFactory().serialize()
+        product = Product.upsert(shopcart.customer_id, 42, data)
+        self.assertEqual(product.customer_id, shopcart.customer_id)
+        self.assertEqual(product.product_id, 42)
+        self.assertEqual(product.product_name, data["product_name"])
+        data["quantity"] = 99
+        updated = Product.upsert(shopcart.customer_id, 42, data)
+        self.assertEqual(updated.id, product.id)
+        self.assertEqual(updated.quantity, 99)
+        self.assertEqual(len(Shopcart.find(shopcart.customer_id).product_list), 1)
+
+    def test_upsert_product_without_shopcart(self):
+        """Upsert into a shopcart that does not exist"""
+        data = ProductFactory().serialize()
+        self.assertIsNone(Product.upsert(1234, 42, data))
+        data["quantity"] = "many"
+        self.assertRaises(DataValidationError, Product.upsert, 1234, 42, data)
+
+    def test_shopcart_version(self):
+        """Every product change bumps the shopcart version"""
+        shopcart = Shopcart()
+        shopcart.create()
+        customer_id = shopcart.customer_id
+        self.assertEqual(Shopcart.version_of(customer_id), 1)
+        shopcart.product_list.append(ProductFactory(id=None, product_id=1))
+        shopcart.update()
+        self.assertEqual(Shopcart.version_of(customer_id), 2)
+        product = Product.find_in_cart(customer_id, 1)
+        product.quantity = 5
+        product.update()
+        self.assertEqual(Shopcart.version_of(customer_id), 3)
+        Product.upsert(customer_id, 2, ProductFactory().serialize())
+        self.assertEqual(Shopcart.version_of(customer_id), 4)
+        self.assertEqual(Shopcart.touched_version(customer_id), 4)
+        Product.toggle_wishlist(customer_id, 2, 4)
+        self.assertEqual(Shopcart.touched_version(customer_id), 5)
+        Product.upsert(customer_id, 2, ProductFactory().serialize())
+        Product.apply_batch(customer_id, [("delete", 2, {})])
+        self.assertEqual(Shopcart.version_of(customer_id), 7)
+        Product.find_in_cart(customer_id, 1).delete()
+        self.assertEqual(Shopcart.version_of(customer_id), 8)
+        self.assertIsNone(Shopcart.version_of(customer_id + 1))
+
+    def test_shopcart_expected_version(self):
+        """Writes with a stale expected version are refused"""
+        shopcart = Shopcart()
+        shopcart.create()
+        customer_id = shopcart.customer_id
+        data = ProductFactory().serialize()
+        self.assertRaises(VersionMismatchError, Product.upsert, customer_id, 1, data, 7)
+        self.assertIsNone(Product.find_in_cart(customer_id, 1))
+        Product.upsert(customer_id, 1, data, 1)
+        self.assertEqual(Shopcart.version_of(customer_id), 2)
+        product = Product.find_in_cart(customer_id, 1)
+        self.assertRaises(VersionMismatchError, product.delete, 1)
+        self.assertIsNotNone(Product.find_in_cart(customer_id, 1))
+        self.assertRaises(VersionMismatchError, Shopcart.find(customer_id).delete, 1)
+        Shopcart.find(customer_id).delete(2)
+        self.assertFalse(Shopcart.exists(customer_id))
+        self.assertFalse(Shopcart.touch(customer_id))
+
+    def test_wishlisted_products(self):
+        """Query wishlisted products of one and of all shopcarts"""
+        for _ in range(2):
+            shopcart = Shopcart()
+            shopcart.create()
+            for product_id in range(4):
+                shopcart.product_list.append(
+                    ProductFactory(id=None, product_id=product_id, wishlist=product_id % 2 == 0))
+            shopcart.update()
+        records = Product.read_wishlisted(1)
+        self.assertEqual([p.product_id for p in records], [0, 2])
+        self.assertTrue(all(p.customer_id == 1 and p.wishlist for p in records))
+        self.assertEqual([p.serialize() for p in records],
+                         [Product.find_in_cart(1, p.product_id).serialize() for p in records])
+        self.assertEqual(Product.read_wishlisted(3), [])
+
+        first = Product.read_wishlisted_page(limit=3)
+        self.assertEqual([(p.customer_id, p.product_id) for p in first], [(1, 0), (1, 2), (2, 0)])
+        rest = Product.read_wishlisted_page(after=(first[-1].customer_id, first[-1].id), limit=3)
+        self.assertEqual([(p.customer_id, p.product_id) for p in rest], [(2, 2)])
+
+    def test_read_shopcarts(self):
+        """Read shopcarts and products as records in one statement"""
+        self._create_shopcarts_with_products(3, 2)
+        Shopcart().create()
+        for customer_id in (1, 4):
+            record, queries = self._count_queries(lambda: Shopcart.read(customer_id))
+            self.assertEqual(queries, 1)
+            shopcart = Shopcart.find(customer_id)
+            self.assertEqual(record.serialize(), shopcart.serialize())
+            self.assertEqual(record.version, shopcart.version)
+        self.assertEqual(len(Shopcart.read(1).product_list), 2)
+        self.assertEqual(Shopcart.read(4).product_list, [])
+        self.assertIsNone(Shopcart.read(5))
+
+        records, queries = self._count_queries(lambda: Shopcart.read_page(after=1, limit=2))
+        self.assertEqual(queries, 1)
+        self.assertEqual([r.serialize() for r in records],
+                         [Shopcart.find(customer_id).serialize() for customer_id in (2, 3)])
+        self.assertEqual([r.customer_id for r in Shopcart.read_all(batch_size=3)], [1, 2, 3, 4])
+
+        product = Shopcart.read(2).product_list[0]
+        self.assertEqual(product.serialize(),
+                         Product.find_in_cart(2, product.product_id).serialize())
+        self.assertEqual(Product.read_in_cart(2, product.product_id).serialize(),
+                         product.serialize())
+        self.assertIsNone(Product.read_in_cart(4, product.product_id))
+
+    def test_records_are_not_tracked(self):
+        """Records have slots and stay out of the session"""
+        self._create_shopcarts_with_products(1, 2)
+        record = Shopcart.read(1)
+        self.assertFalse(hasattr(record, "__dict__"))
+        self.assertFalse(hasattr(record.product_list[0], "__dict__"))
+        self.assertEqual(len(db.session.identity_map), 0)
+
+    def test_toggle_wishlist(self):
+        """Toggle the wishlist flag of a product with one UPDATE"""
+        shopcart = Shopcart()
+        shopcart.create()
+        customer_id = shopcart.customer_id
+        Product.upsert(customer_id, 1, ProductFactory(wishlist=False).serialize())
+        product = Product.toggle_wishlist(customer_id, 1)
+        self.assertTrue(product.wishlist)
+        self.assertEqual(product.product_id, 1)
+        self.assertFalse(Product.toggle_wishlist(customer_id, 1, 3).wishlist)
+        self.assertFalse(Product.find_in_cart(customer_id, 1).wishlist)
+        self.assertEqual(Shopcart.version_of(customer_id), 4)
+        self.assertRaises(VersionMismatchError, Product.toggle_wishlist, customer_id, 1, 1)
+        # a missing product leaves the version alone
+        self.assertIsNone(Product.toggle_wishlist(customer_id, 2))
+        self.assertEqual(Shopcart.version_of(customer_id), 4)
+        self.assertIsNone(Product.toggle_wishlist(customer_id + 1, 1))
+
+    def test_set_wishlist(self):
+        """Set the wishlist flag of many products at once"""
+        shopcart = Shopcart()
+        shopcart.create()
+        customer_id = shopcart.customer_id
+        for product_id in range(1, 4):
+            Product.upsert(customer_id, product_id, ProductFactory(wishlist=False).serialize())
+        products = Product.set_wishlist(customer_id, [3, 1, 9], True)
+        self.assertEqual([p.product_id for p in products], [1, 3])
+        self.assertTrue(all(p.wishlist for p in products))
+        self.assertEqual([p.product_id for p in Product.read_wishlisted(customer_id)], [1, 3])
+        Product.set_wishlist(customer_id, [1], False)
+        self.assertEqual([p.product_id for p in Product.read_wishlisted(customer_id)], [3])
+        self.assertIsNone(Product.set_wishlist(customer_id + 1, [1], True))
+        for product_ids, wishlist in (([], True), ("1", True), (["a"], True), ([1], "true")):
+            self.assertRaises(DataValidationError, Product.set_wishlist,
+                              customer_id, product_ids, wishlist)
+
+    def test_init_db_leaves_no_context(self):
+        """Initializing the database leaves no app context pushed"""
+        self.context.pop()
+        try:
+            Shopcart.init_db(app)
+            self.assertFalse(has_app_context())
+        finally:
+            self.context.push()
+
+    def test_sessions_are_per_thread(self):
+        """Every thread gets its own database session"""
+        sessions = []
+
+        def use_session():
+            with app.app_context():
+                sessions.append(db.session())
+                Shopcart().create()
+
+        threads = [threading.Thread(target=use_session) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(session) for session in sessions + [db.session()]}), 4)
+        self.assertEqual(len(Shopcart.all()), 3)
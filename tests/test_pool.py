@@ -0,0 +1,69 @@
+"""
+Test cases for the observable connection pool
+
+"""
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from sqlalchemy import create_engine, exc
+from sqlalchemy.pool import NullPool
+from service.pool import TimedQueuePool, pool_stats
+
+######################################################################
+#  T I M E D   Q U E U E   P O O L   T E S T   C A S E S
+######################################################################
+
+
+class TestTimedQueuePool(unittest.TestCase):
+    """ Test Cases for TimedQueuePool """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_engine(
+            "sqlite:///" + os.path.join(self.directory.name, "pool.db"),
+            poolclass=TimedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.05
+        )
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def test_checkouts_are_timed(self):
+        """Count connection checkouts and their wait time"""
+        with self.engine.connect() as connection:
+            connection.execute("SELECT 1")
+            stats = pool_stats(self.engine.pool)
+            self.assertEqual(stats["in_use"], 1)
+            self.assertEqual(stats["checkouts"], 1)
+        stats = pool_stats(self.engine.pool)
+        self.assertEqual(stats["class"], "TimedQueuePool")
+        self.assertEqual(stats["in_use"], 0)
+        self.assertEqual(stats["idle"], 1)
+        self.assertEqual(stats["size"], 1)
+        self.assertGreaterEqual(stats["wait_seconds_max"], stats["wait_seconds_avg"])
+
+    def test_timeouts_are_counted(self):
+        """Count checkouts that time out on an exhausted pool"""
+        with self.engine.connect():
+            self.assertRaises(exc.TimeoutError, self.engine.connect)
+        stats = pool_stats(self.engine.pool)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertGreaterEqual(stats["wait_seconds_max"], 0.05)
+
+    def test_forked_connections_are_discarded(self):
+        """Replace a pooled connection that another process opened"""
+        with self.engine.connect() as connection:
+            inherited = connection.connection.connection
+        with self.engine.connect() as connection:
+            self.assertIs(connection.connection.connection, inherited)
+        with patch("service.pool.os.getpid", return_value=os.getpid() + 1):
+            with self.engine.connect() as connection:
+                self.assertIsNot(connection.connection.connection, inherited)
+                connection.execute("SELECT 1")
+
+    def test_other_pools(self):
+        """Pools that do not queue only report their class"""
+        engine = create_engine("sqlite://", poolclass=NullPool)
+        self.assertEqual(pool_stats(engine.pool), {"class": "NullPool"})
@@ -0,0 +1,55 @@
+"""
+Test cases for on-demand request profiling
+
+"""
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from service import app, status
+
+TOKEN = "let-me-profile"
+
+######################################################################
+#  P R O F I L I N G   T E S T   C A S E S
+######################################################################
+
+
+class TestProfiling(unittest.TestCase):
+    """ Test Cases for ProfileOnDemand """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.config = patch.dict(app.config, {
+            "PROFILING_ENABLED": True, "PROFILE_TOKEN": TOKEN,
+            "PROFILE_DIR": self.directory.name})
+        self.config.start()
+        self.app = app.test_client()
+
+    def tearDown(self):
+        self.config.stop()
+        self.directory.cleanup()
+
+    def test_profile_a_request(self):
+        """Profile a request that sends the token"""
+        resp = self.app.get("/healthcheck", headers={"X-Profile": TOKEN})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["message"], "Healthy")
+        profile_id = resp.headers["X-Profile-Id"]
+        path = os.path.join(self.directory.name, profile_id)
+        self.assertTrue(os.path.exists(path + ".prof"))
+        with open(path + ".txt") as summary:
+            self.assertTrue(summary.readline().startswith("GET /healthcheck"))
+
+    def test_requests_are_not_profiled(self):
+        """Leave requests without the right token or with profiling off alone"""
+        for headers in ({}, {"X-Profile": "1"}):
+            resp = self.app.get("/healthcheck", headers=headers)
+            self.assertNotIn("X-Profile-Id", resp.headers)
+        with patch.dict(app.config, {"PROFILING_ENABLED": False}):
+            resp = self.app.get("/healthcheck", headers={"X-Profile": TOKEN})
+            self.assertNotIn("X-Profile-Id", resp.headers)
+        with patch.dict(app.config, {"PROFILE_TOKEN": ""}):
+            resp = self.app.get("/healthcheck", headers={"X-Profile": ""})
+            self.assertNotIn("X-Profile-Id", resp.headers)
+        self.assertEqual(os.listdir(self.directory.name), [])
@@ -6,11 +6,13 @@ Test cases can be run with the following:
   coverage report -m
 """
 import os
+import json
 import logging
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
 from service import status  # HTTP Status Codes
-from service.models import db
+from service.models import Product, Shopcart, db
+from service.cache import shopcart_cache
 from service.routes import app, init_db, database_connection_error
 from tests.factories import ProductFactory, ShopcartFactory
 
@@ -40,17 +42,22 @@ class TestYourResourceServer(TestCase):
     @classmethod
     def tearDownClass(cls):
         """ This runs once after the entire test suite """
-        db.session.close()
+        with app.app_context():
+            db.session.close()
 
     def setUp(self):
         """ This runs before each test """
+        self.context = app.app_context()
+        self.context.push()
         db.drop_all()  # clean up the last tests
         db.create_all()  # create new tables
+        shopcart_cache.configure()  # no entries or counters of the last tests
         self.app = app.test_client()
 
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        self.context.pop()
 
 ######################################################################
 #  H E L P E R   M E T H O D S
@@ -118,6 +125,59 @@ class TestYourResourceServer(TestCase):
         data = resp.get_json()
         self.assertEquals(len(data), 3)
 
+    def test_list_shopcarts_paginated(self):
+        """List shopcarts one page at a time"""
+        shopcarts = self._create_shopcarts(3)
+        resp = self.app.get("/shopcarts?limit=2&count=true")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([s["customer_id"] for s in data],
+                         [s.customer_id for s in shopcarts[:2]])
+        self.assertEqual(resp.headers["X-Total-Count"], "3")
+        self.assertIn('rel="next"', resp.headers["Link"])
+        self.assertIn(f"after={shopcarts[1].customer_id}", resp.headers["Link"])
+
+        resp = self.app.get(f"/shopcarts?limit=2&after={shopcarts[1].customer_id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]["customer_id"], shopcarts[2].customer_id)
+        self.assertNotIn("Link", resp.headers)
+        self.assertNotIn("X-Total-Count", resp.headers)
+
+    def test_list_shopcarts_bad_limit(self):
+        """List shopcarts with an invalid page size"""
+        resp = self.app.get("/shopcarts?limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get("/shopcarts?limit=100000")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_shopcarts(self):
+        """Stream every shopcart as newline delimited JSON"""
+        shopcarts = self._create_shopcarts(3)
+        product = ProductFactory(customer_id=shopcarts[1].customer_id)
+        resp = self.app.post(
+            f"/shopcarts/{shopcarts[1].customer_id}/products",
+            json=product.serialize(),
+            content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+        app.config["EXPORT_BATCH_SIZE"] = 2
+        try:
+            resp = self.app.get("/shopcarts/export")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.mimetype, "application/x-ndjson")
+            lines = resp.get_data(as_text=True).splitlines()
+        finally:
+            app.config["EXPORT_BATCH_SIZE"] = 1000
+        exported = [json.loads(line) for line in lines]
+        self.assertEqual([s["customer_id"] for s in exported],
+                         [s.customer_id for s in shopcarts])
+        self.assertEqual(len(exported[1]["product_list"]), 1)
+        self.assertEqual(exported[1]["product_list"][0]["product_id"], product.product_id)
+        self.assertEqual(exported[1]["product_list"][0]["instock"], product.instock)
+
     def test_get_shopcarts(self):
         """Get a single Shopcart"""
         # get the id of a shopcart
@@ -128,6 +188,241 @@ class TestYourResourceServer(TestCase):
         data = resp.get_json()
         self.assertEqual(data["customer_id"], test_shopcart.customer_id)
 
+    def test_get_shopcart_cached(self):
+        """Get a shopcart from the response cache until it changes"""
+        shopcart_cache.configure(enabled=True)
+        try:
+            test_shopcart = self._create_shopcarts(1)[0]
+            url = "/shopcarts/{}".format(test_shopcart.customer_id)
+            resp = self.app.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.headers["X-Cache"], "MISS")
+            resp_hit = self.app.get(url)
+            self.assertEqual(resp_hit.headers["X-Cache"], "HIT")
+            self.assertEqual(resp_hit.get_data(), resp.get_data())
+
+            product = ProductFactory()
+            resp = self.app.post(
+                url + "/products", json=product.serialize(), content_type=CONTENT_TYPE_JSON
+            )
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            resp = self.app.get(url)
+            self.assertEqual(resp.headers["X-Cache"], "MISS")
+            self.assertEqual(len(resp.get_json()["product_list"]), 1)
+
+            resp = self.app.delete("{}/products/{}".format(url, product.product_id))
+            self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+            self.assertEqual(self.app.get(url).get_json()["product_list"], [])
+
+            resp = self.app.get("/stats/cache")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.get_json()["hits"], 1)
+            self.assertEqual(resp.get_json()["misses"], 3)
+        finally:
+            shopcart_cache.configure(enabled=False)
+
+    def test_get_with_x_fields_mask(self):
+        """Apply the X-Fields mask to GETs, bypassing the shopcart cache"""
+        products = [ProductFactory(product_id=product_id).serialize() for product_id in (1, 2)]
+        resp = self.app.post("/shopcarts", json={"product_list": products},
+                             content_type=CONTENT_TYPE_JSON)
+        url = "{0}/{1}".format(BASE_URL, resp.get_json()["customer_id"])
+        shopcart_cache.configure(enabled=True)
+        try:
+            whole = self.app.get(url).get_json()
+            masked = self.app.get(url, headers={"X-Fields": "customer_id"})
+            self.assertEqual(masked.status_code, status.HTTP_200_OK)
+            self.assertEqual(masked.get_json(), {"customer_id": whole["customer_id"]})
+            self.assertNotIn("X-Cache", masked.headers)
+            self.assertEqual(self.app.get(url).get_json(), whole)
+            # the masked and the whole body share an ETag, so both vary with the mask
+            for resp in (masked, self.app.get(url)):
+                self.assertEqual(resp.headers["Vary"], "X-Fields")
+        finally:
+            shopcart_cache.configure(enabled=False)
+        resp = self.app.get(url + "/products", headers={"X-Fields": "product_id"})
+        self.assertEqual(resp.headers["Vary"], "X-Fields")
+        self.assertEqual(resp.get_json(), [{"product_id": 1}, {"product_id": 2}])
+        resp = self.app.get(url + "/products/2", headers={"X-Fields": "product_id,wishlist"})
+        self.assertEqual(resp.get_json(),
+                         {"product_id": 2, "wishlist": products[1]["wishlist"] == "true"})
+
+    def test_pool_stats(self):
+        """Report the connection pool statistics"""
+        resp = self.app.get("/stats/pool")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn("class", resp.get_json())
+
+    def test_statement_stats(self):
+        """Report the hits of the statement cache"""
+        shopcart = self._create_shopcarts(1)[0]
+        for _ in range(2):
+            self.app.get(f"/shopcarts/{shopcart.customer_id}")
+        resp = self.app.get("/stats/statements")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertGreater(resp.get_json()["hits"], 0)
+
+    def test_metrics(self):
+        """Expose request and database metrics per resource"""
+        self._create_shopcarts(1)
+        self.app.get("/shopcarts")
+        self.app.get("/no/such/path")
+        self.app.open("/shopcarts", method="BREW")
+        resp = self.app.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        text = resp.get_data(as_text=True)
+        self.assertIn('shopcarts_http_requests_total{handler="ShopcartCollection.get",'
+                      'method="GET",status="200"}', text)
+        self.assertIn('shopcarts_http_requests_total{handler="ShopcartCollection.post",'
+                      'method="POST",status="201"}', text)
+        self.assertIn('handler="unmatched",method="GET",status="404"', text)
+        self.assertIn('method="other",status="405"', text)
+        self.assertNotIn('method="BREW"', text)
+        self.assertIn('shopcarts_http_request_duration_seconds_bucket{handler="ShopcartCollection.get"',
+                      text)
+        self.assertIn('shopcarts_http_request_db_queries_count{handler="ShopcartCollection.get"',
+                      text)
+        self.assertIn("shopcarts_http_requests_in_progress", text)
+
+    def test_server_timing_and_slow_queries(self):
+        """Report SQL statements in Server-Timing and log slow ones"""
+        shopcart = self._create_shopcarts(1)[0]
+        with patch.dict(app.config, {"SLOW_QUERY_SECONDS": 0}), \
+                self.assertLogs("flask.app", level="WARNING") as logs:
+            resp = self.app.get(f"/shopcarts/{shopcart.customer_id}")
+        self.assertRegex(resp.headers["Server-Timing"],
+                         r'^db;dur=[0-9.]+;desc="1 queries", app;dur=[0-9.]+$')
+        self.assertTrue(any("Slow query" in line and "ShopcartResource.get" in line
+                            for line in logs.output))
+
+    def test_get_shopcart_etag(self):
+        """Conditional GET of a shopcart and its products"""
+        test_shopcart = self._create_shopcarts(1)[0]
+        url = "/shopcarts/{}".format(test_shopcart.customer_id)
+        resp = self.app.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp.headers["ETag"]
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.get_data(), b"")
+        self.assertEqual(resp.headers["ETag"], etag)
+
+        product = ProductFactory()
+        resp = self.app.put(
+            "{}/products/{}".format(url, product.product_id),
+            json=product.serialize(),
+            content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        etag = resp.headers["ETag"]
+
+        for product_url in (url + "/products", "{}/products/{}".format(url, product.product_id)):
+            resp = self.app.get(product_url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.headers["ETag"], etag)
+            resp = self.app.get(product_url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        resp = self.app.get("/shopcarts/9999", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.get("/shopcarts/9999/products")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_shopcart_etag_cached(self):
+        """Conditional GET answered from the response cache"""
+        shopcart_cache.configure(enabled=True)
+        try:
+            test_shopcart = self._create_shopcarts(1)[0]
+            url = "/shopcarts/{}".format(test_shopcart.customer_id)
+            etag = self.app.get(url).headers["ETag"]
+            resp = self.app.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+            resp = self.app.get(url)
+            self.assertEqual(resp.headers["X-Cache"], "HIT")
+            self.assertEqual(resp.headers["ETag"], etag)
+        finally:
+            shopcart_cache.configure(enabled=False)
+
+    def test_write_with_if_match(self):
+        """Writes honour If-Match for optimistic concurrency"""
+        test_shopcart = self._create_shopcarts(1)[0]
+        url = "/shopcarts/{}".format(test_shopcart.customer_id)
+        etag = self.app.get(url).headers["ETag"]
+        product = ProductFactory()
+        product_url = "{}/products/{}".format(url, product.product_id)
+        resp = self.app.put(product_url, json=product.serialize(),
+                            content_type=CONTENT_TYPE_JSON, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # the old ETag is stale now
+        resp = self.app.put(product_url, json=product.serialize(),
+                            content_type=CONTENT_TYPE_JSON, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.delete(product_url, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.delete(url, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.delete(url, headers={"If-Match": 'W/"1"'})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        etag = self.app.get(url).headers["ETag"]
+        resp = self.app.delete(product_url, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        etag = self.app.get(url).headers["ETag"]
+        resp = self.app.delete(url, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.app.delete(url, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_writes_return_the_new_etag(self):
+        """Chain If-Match writes with the ETag each write returns"""
+        test_shopcart = self._create_shopcarts(1)[0]
+        url = "/shopcarts/{}".format(test_shopcart.customer_id)
+        product = ProductFactory()
+        product_url = "{}/products/{}".format(url, product.product_id)
+        etag = self.app.get(url).headers["ETag"]
+        for if_match in (False, True):
+            for method, path, body in (
+                    ("PUT", product_url, product.serialize()),
+                    ("PUT", product_url + "/reversewishlist", None),
+                    ("PUT", url + "/wishlist", {"product_ids": [product.product_id],
+                                                "wishlist": True})):
+                headers = {"If-Match": etag} if if_match else {}
+                resp = self.app.open(path, method=method, json=body, headers=headers)
+                self.assertEqual(resp.status_code, status.HTTP_200_OK, path)
+                self.assertNotEqual(resp.headers["ETag"], etag)
+                etag = resp.headers["ETag"]
+                self.assertEqual(self.app.get(url).headers["ETag"], etag)
+
+    def test_delete_with_if_match_of_a_vanished_shopcart(self):
+        """Fail a conditional delete when the shopcart is deleted after it was found"""
+        products = [ProductFactory(product_id=product_id).serialize() for product_id in (1, 2)]
+        touch = Shopcart.touch
+
+        def delete_then_touch(customer_id, expected_version=None):
+            # another request deletes the shopcart between find() and touch()
+            table = Product.__table__
+            db.session.execute(table.delete().where(table.c.customer_id == customer_id))
+            db.session.execute(Shopcart.__table__.delete().where(
+                Shopcart.__table__.c.customer_id == customer_id))
+            db.session.commit()
+            shopcart_cache.invalidate(customer_id)
+            return touch(customer_id, expected_version)
+
+        for path, expected in (("", status.HTTP_412_PRECONDITION_FAILED),
+                               ("/products/1", status.HTTP_404_NOT_FOUND)):
+            resp = self.app.post("/shopcarts", json={"product_list": products},
+                                 content_type=CONTENT_TYPE_JSON)
+            url = "{0}/{1}".format(BASE_URL, resp.get_json()["customer_id"])
+            etag = self.app.get(url).headers["ETag"]
+            with patch.object(Shopcart, "touch", side_effect=delete_then_touch):
+                resp = self.app.delete(url + path, headers={"If-Match": etag})
+            self.assertEqual(resp.status_code, expected, path)
+            self.assertEqual(self.app.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
     def test_create_shopcart(self):
         """Create a new Shopcart"""
         test_shopcart = ShopcartFactory()
@@ -146,6 +441,15 @@ class TestYourResourceServer(TestCase):
         self.assertEqual(
             new_shopcart["product_list"], test_shopcart.product_list, "Product list do not match")
 
+    def test_create_shopcart_with_duplicate_products(self):
+        """Reject a new Shopcart that lists a product twice"""
+        products = [ProductFactory(product_id=product_id).serialize() for product_id in (1, 2, 1)]
+        resp = self.app.post("/shopcarts", json={"product_list": products},
+                             content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("product_id 1", resp.get_json()["message"])
+        self.assertEqual(self.app.get("/shopcarts").get_json(), [])
+
     def test_delete_shopcart(self):
         """Delete a shopcart"""
         test_shopcart = self._create_shopcarts(1)[0]
@@ -160,6 +464,22 @@ class TestYourResourceServer(TestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_delete_shopcart_with_products(self):
+        """Delete a shopcart together with its products, with and without If-Match"""
+        products = [ProductFactory(product_id=product_id).serialize() for product_id in (1, 2, 3)]
+        for if_match in (False, True):
+            resp = self.app.post("/shopcarts", json={"product_list": products},
+                                 content_type=CONTENT_TYPE_JSON)
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            customer_id = resp.get_json()["customer_id"]
+            headers = {}
+            if if_match:
+                headers["If-Match"] = self.app.get(f"{BASE_URL}/{customer_id}").headers["ETag"]
+            # runs within its query budget, the products are not loaded to be deleted
+            resp = self.app.delete("{0}/{1}".format(BASE_URL, customer_id), headers=headers)
+            self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+            self.assertEqual(Product.query.filter_by(customer_id=customer_id).count(), 0)
+
     def test_update_shopcart(self):
         """Update a shopcart"""
 
@@ -337,6 +657,99 @@ class TestYourResourceServer(TestCase):
         self.assertEqual(data["instock"] == 'true', product.instock)
         self.assertEqual(data["wishlist"] == 'true', product.wishlist)
 
+    def test_add_duplicate_product(self):
+        """Adding the same product to a shopcart twice is rejected"""
+        shopcart = self._create_shopcarts(1)[0]
+        product = ProductFactory()
+        resp = self.app.post(
+            "/shopcarts/{}/products".format(shopcart.customer_id),
+            json=product.serialize(),
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.app.post(
+            "/shopcarts/{}/products".format(shopcart.customer_id),
+            json=product.serialize(),
+            content_type="application/json"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get("/shopcarts/{}/products".format(shopcart.customer_id))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 1)
+
+    def test_batch_products(self):
+        """Add, update and delete products in one batch"""
+        shopcart = self._create_shopcarts(1)[0]
+        kept, removed = ProductFactory(), ProductFactory()
+        for product in (kept, removed):
+            resp = self.app.post(
+                "/shopcarts/{}/products".format(shopcart.customer_id),
+                json=product.serialize(),
+                content_type=CONTENT_TYPE_JSON
+            )
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        added = ProductFactory()
+        operations = [
+            dict(added.serialize(), op="add"),
+            {"op": "update", "product_id": kept.product_id, "quantity": 5, "wishlist": True},
+            {"op": "delete", "product_id": removed.product_id},
+            {"op": "delete", "product_id": 9999},
+            dict(kept.serialize(), op="add", product_id=removed.product_id + 1000),
+        ]
+        resp = self.app.post(
+            f"/shopcarts/{shopcart.customer_id}/products:batch",
+            json={"operations": operations},
+            content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["customer_id"], shopcart.customer_id)
+        self.assertEqual([r["status"] for r in data["results"]], [201, 200, 204, 404, 201])
+        self.assertEqual(data["results"][3]["result"], "not_found")
+
+        resp = self.app.get(f"/shopcarts/{shopcart.customer_id}/products")
+        products = {p["product_id"]: p for p in resp.get_json()}
+        self.assertEqual(sorted(products), sorted(
+            [kept.product_id, added.product_id, removed.product_id + 1000]))
+        self.assertEqual(products[kept.product_id]["quantity"], 5)
+        self.assertEqual(products[kept.product_id]["wishlist"], True)
+
+        # adding a product that is already there is a per operation conflict
+        resp = self.app.post(
+            f"/shopcarts/{shopcart.customer_id}/products:batch",
+            json={"operations": [dict(added.serialize(), op="add")]},
+            content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["results"][0]["status"], status.HTTP_409_CONFLICT)
+
+    def test_batch_products_invalid(self):
+        """A batch with an invalid operation is rejected as a whole"""
+        shopcart = self._create_shopcarts(1)[0]
+        added = ProductFactory()
+        for operations in (
+            [dict(added.serialize(), op="add"), {"op": "update", "product_id": 1, "quantity": 0}],
+            [dict(added.serialize(), op="add"), {"op": "delete", "product_id": added.product_id}],
+            [{"op": "replace", "product_id": 1}],
+            [{"op": "update", "product_id": 1}],
+            [],
+        ):
+            resp = self.app.post(
+                f"/shopcarts/{shopcart.customer_id}/products:batch",
+                json={"operations": operations},
+                content_type=CONTENT_TYPE_JSON
+            )
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, operations)
+        resp = self.app.get(f"/shopcarts/{shopcart.customer_id}/products")
+        self.assertEqual(resp.get_json(), [])
+
+        resp = self.app.post(
+            "/shopcarts/9999/products:batch",
+            json={"operations": [{"op": "delete", "product_id": 1}]},
+            content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_create_bad_content_type(self):
         """Create shopcart with Bad Content Type """
         test_shopcart = ShopcartFactory()
@@ -436,18 +849,44 @@ class TestYourResourceServer(TestCase):
             self.assertEqual(True, data[i]['wishlist'])
 
     def test_get_wishlisted_items_without_customer_id(self):
-        """ Query wishlist without providing customer id """
+        """ Page through the wishlisted items of every shopcart """
+        shopcarts = self._create_shopcarts(2)
+        wishlisted = []
+        for shopcart in shopcarts:
+            for i in range(3):
+                product = ProductFactory(wishlist=(i != 1))
+                resp = self.app.post(
+                    f"/shopcarts/{shopcart.customer_id}/products",
+                    json=product.serialize(),
+                    content_type=CONTENT_TYPE_JSON
+                )
+                self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+                if product.wishlist:
+                    wishlisted.append((shopcart.customer_id, product.product_id))
+
+        resp = self.app.get("/shopcarts/wishlist?limit=3")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        first = [(p["customer_id"], p["product_id"]) for p in resp.get_json()]
+        self.assertEqual(first, wishlisted[:3])
+        self.assertTrue(all(p["wishlist"] for p in resp.get_json()))
+        next_url = resp.headers["Link"].split(">")[0].lstrip("<")
+        self.assertIn("after={}-".format(wishlisted[2][0]), next_url)
 
-        product = ProductFactory()
+        resp = self.app.get(next_url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([(p["customer_id"], p["product_id"]) for p in resp.get_json()],
+                         wishlisted[3:])
+        self.assertNotIn("Link", resp.headers)
 
-        resp = self.app.get(
-            f"/shopcarts/wishlist?bad_query",
-            json=product.serialize(),
-            content_type="application/json"
-        )
+        resp = self.app.get("/shopcarts/wishlist?bad_query")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 4)
 
-        data = resp.get_json()
-        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+    def test_get_wishlisted_items_bad_query(self):
+        """ Query wishlists with an invalid query string """
+        for query in ("customer-id=abc", "after=12", "after=a-b", "limit=0", "limit=x"):
+            resp = self.app.get(f"/shopcarts/wishlist?{query}")
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, query)
 
     def test_get_wishlisted_item_for_non_existent_customer(self):
         """ Query wishlist without providing customer id """
@@ -516,3 +955,75 @@ class TestYourResourceServer(TestCase):
         )
         self.assertEqual(
             reverse_wl_resp_no_such_item.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_set_wishlist_of_many_products(self):
+        """Set the wishlist flag of many products of a shopcart"""
+        shopcart = self._create_shopcarts(1)[0]
+        url = f"/shopcarts/{shopcart.customer_id}/wishlist"
+        product_ids = []
+        for _ in range(3):
+            product = ProductFactory(wishlist=False)
+            self.app.post(f"/shopcarts/{shopcart.customer_id}/products",
+                          json=product.serialize(), content_type=CONTENT_TYPE_JSON)
+            product_ids.append(product.product_id)
+
+        resp = self.app.put(url, json={"product_ids": product_ids[:2] + [99999], "wishlist": True},
+                            content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([p["product_id"] for p in resp.get_json()], product_ids[:2])
+        self.assertTrue(all(p["wishlist"] for p in resp.get_json()))
+        resp = self.app.get(f"/shopcarts/wishlist?customer-id={shopcart.customer_id}")
+        self.assertEqual(len(resp.get_json()), 2)
+
+        etag = self.app.get(f"/shopcarts/{shopcart.customer_id}").headers["ETag"]
+        resp = self.app.put(url, json={"product_ids": product_ids, "wishlist": False},
+                            content_type=CONTENT_TYPE_JSON, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.put(url, json={"product_ids": product_ids, "wishlist": False},
+                            content_type=CONTENT_TYPE_JSON, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        resp = self.app.put(url, json={"product_ids": [], "wishlist": True},
+                            content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.put(f"/shopcarts/{shopcart.customer_id + 1}/wishlist",
+                            json={"product_ids": [1], "wishlist": True},
+                            content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def _record_responses(self, products, fast_json):
+        """Runs the same calls on fresh tables and returns what they answered"""
+        db.drop_all()
+        db.create_all()
+        shopcart_cache.clear()
+        calls = [
+            ("post", "/shopcarts", {"json": {"product_list": products}}),
+            ("post", "/shopcarts", {"json": {"product_list": []}}),
+            ("get", "/shopcarts/1", {}),
+            ("get", "/shopcarts/1/products", {}),
+            ("get", "/shopcarts/1/products/1", {}),
+            ("put", "/shopcarts/1/products/2", {"json": products[1]}),
+            ("put", "/shopcarts/1/products/1/reversewishlist", {}),
+            ("put", "/shopcarts/1/products/1/reversewishlist", {"headers": {"X-Fields": "wishlist"}}),
+            ("put", "/shopcarts/1/wishlist", {"json": {"product_ids": [1, 2], "wishlist": True}}),
+            ("get", "/shopcarts?limit=1", {}),
+            ("get", "/shopcarts/wishlist?customer-id=1", {}),
+            ("get", "/shopcarts/wishlist?limit=1", {}),
+            ("get", "/shopcarts/export", {}),
+        ]
+        responses = []
+        with patch.dict(app.config, {"FAST_JSON_ENABLED": fast_json}):
+            for method, url, kwargs in calls:
+                resp = getattr(self.app, method)(url, **kwargs)
+                responses.append((method, url, resp.status_code, resp.content_type,
+                                  resp.headers.get("ETag"), resp.headers.get("Link"),
+                                  resp.get_data()))
+        return responses
+
+    def test_fast_json_is_byte_for_byte_compatible(self):
+        """Answer with the same bytes with the one pass encoder"""
+        products = [ProductFactory(product_id=product_id).serialize() for product_id in (1, 2)]
+        products[0]["product_name"] = 'café "crème"'
+        expected = self._record_responses(products, fast_json=False)
+        self.assertEqual(self._record_responses(products, fast_json=True), expected)
+        self.assertIn(b'"caf\\u00e9 \\"cr\\u00e8me\\""', expected[0][-1])
@@ -0,0 +1,84 @@
+"""
+Test cases for the sampling profiler
+
+"""
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from service import app, status
+from service.sampler import StackSampler, stack_sampler
+
+######################################################################
+#  S T A C K   S A M P L E R   T E S T   C A S E S
+######################################################################
+
+
+def busy_loop(stop):
+    """ Keeps a thread on the CPU until stop is set """
+    while not stop.is_set():
+        sum(range(100))
+
+
+class TestStackSampler(unittest.TestCase):
+    """ Test Cases for StackSampler """
+
+    def setUp(self):
+        self.stop = threading.Event()
+        self.worker = threading.Thread(target=busy_loop, args=(self.stop,))
+        self.worker.start()
+
+    def tearDown(self):
+        self.stop.set()
+        self.worker.join()
+
+    def test_sample_threads(self):
+        """Count the collapsed stacks of busy threads"""
+        sampler = StackSampler()
+        for _ in range(3):
+            sampler.sample()
+        self.assertEqual(sampler.samples, 3)
+        lines = sampler.collapsed().splitlines()
+        busy = [line for line in lines if "test_sampler.py:busy_loop" in line]
+        self.assertTrue(busy)
+        stack, count = busy[0].rsplit(" ", 1)
+        self.assertTrue(stack.startswith("threading.py:_bootstrap;"))
+        self.assertGreaterEqual(int(count), 1)
+
+    def test_rolling_window(self):
+        """Forget samples that are older than the window"""
+        sampler = StackSampler(window=10)
+        with patch("service.sampler.time.monotonic", return_value=100.0):
+            sampler.sample()
+        with patch("service.sampler.time.monotonic", return_value=120.0):
+            self.assertEqual(sampler.collapsed(), "")
+            sampler.sample()
+            self.assertNotEqual(sampler.collapsed(), "")
+
+    def test_background_thread(self):
+        """Sample in a background thread"""
+        sampler = StackSampler(hz=200)
+        sampler.start()
+        self.assertTrue(sampler.running)
+        deadline = time.monotonic() + 5
+        while sampler.samples < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        sampler.stop()
+        self.assertFalse(sampler.running)
+        self.assertGreaterEqual(sampler.samples, 3)
+        self.assertNotIn("sampler.py:_run", sampler.collapsed())
+
+    def test_flamegraph_endpoint(self):
+        """Serve the sampled stacks at /debug/flamegraph"""
+        client = app.test_client()
+        resp = client.get("/debug/flamegraph")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        stack_sampler.start(hz=200)
+        try:
+            stack_sampler.sample()
+            resp = client.get("/debug/flamegraph")
+        finally:
+            stack_sampler.stop()
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        self.assertIn("busy_loop", resp.get_data(as_text=True))